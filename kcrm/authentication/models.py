@@ -40,6 +40,12 @@ class UserSession(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     last_activity = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'last_activity'], name='user_session_activity_idx'),
+            models.Index(fields=['user', 'is_current'], name='user_session_current_idx'),
+        ]
+
 class EconomicYear(models.Model):
     STATUS_CHOICES = [
         ('active', 'Active'),
@@ -94,6 +100,9 @@ class SecurityActivity(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', 'created_at'], name='security_activity_user_idx'),
+        ]
 
 class StoreConfig(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='store_config')
@@ -451,6 +451,10 @@ def toggle_economic_year(request, year_id):
             EconomicYear.objects.filter(user=owner_user).update(is_active=False)
             year.is_active = True
         year.save()
+        # Cached inventory stats are keyed by owner and mode, not by year
+        from kcrm.caching import bump_tenant_version
+        from inventory.models import INVENTORY_NAMESPACE
+        bump_tenant_version(INVENTORY_NAMESPACE, owner_user.id)
         return Response({
             'success': True,
             'message': 'Economic year status updated successfully'
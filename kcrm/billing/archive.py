@@ -0,0 +1,90 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, Q
+from django.utils import timezone
+
+from .events import publish_restaurant_message
+from .models import ArchivedKitchenOrder, ArchivedKitchenOrderItem, KitchenFeed, KitchenOrder, KitchenOrderChange, KitchenOrderItem
+
+ARCHIVE_BATCH_SIZE = 500
+# Only billed orders; completed ones still wait in the billing queue
+ARCHIVE_STATUSES = ['served']
+
+
+def archive_cutoff(days=None):
+    if days is None:
+        days = settings.KITCHEN_ARCHIVE_AFTER_DAYS
+    return timezone.now() - timedelta(days=days)
+
+
+def archivable_orders(cutoff):
+    return KitchenOrder.objects.filter(status__in=ARCHIVE_STATUSES, updated_at__lt=cutoff)
+
+
+def copied_fields(model):
+    return [field.attname for field in model._meta.concrete_fields if field.name != 'archived_at']
+
+
+def archive_batch(cutoff, batch_size=ARCHIVE_BATCH_SIZE):
+    """Move one batch of old served orders and their items into the archive tables.
+
+    Copies and deletes happen in one transaction, so an order is always in exactly one
+    of the two tables. Returns the number of orders moved.
+    """
+    order_fields = copied_fields(ArchivedKitchenOrder)
+    item_fields = copied_fields(ArchivedKitchenOrderItem)
+
+    with transaction.atomic():
+        orders = list(
+            archivable_orders(cutoff).order_by('id').select_for_update().values(*order_fields)[:batch_size]
+        )
+        if not orders:
+            return 0
+        order_ids = [order['id'] for order in orders]
+        items = KitchenOrderItem.objects.filter(order_id__in=order_ids).values(*item_fields)
+
+        ArchivedKitchenOrder.objects.bulk_create([ArchivedKitchenOrder(**order) for order in orders])
+        ArchivedKitchenOrderItem.objects.bulk_create([ArchivedKitchenOrderItem(**item) for item in items])
+        KitchenOrder.objects.filter(id__in=order_ids).delete()
+
+        # Tell devices following the change feed that the orders left the hot table
+        by_owner = {}
+        for order in orders:
+            by_owner.setdefault(order['user_id'], []).append(order['id'])
+        for owner_id, ids in by_owner.items():
+            changes = KitchenOrderChange.record(owner_id, ids, 'archived', 'served')
+            publish_restaurant_message(owner_id, {'event': 'order.archived', 'order_ids': ids, 'version': changes[-1].version})
+
+    return len(orders)
+
+
+def prune_order_changes(cutoff):
+    """Drop change feed entries older than cutoff; devices that far behind reload their queue.
+
+    Each restaurant's feed records how far it was pruned, so devices behind that are told to
+    reload and the hourly rollups leave the hours they can no longer rebuild alone.
+    """
+    old = KitchenOrderChange.objects.filter(created_at__lt=cutoff)
+    with transaction.atomic():
+        for owner_id, version in old.values_list('user_id').annotate(version=Max('version')).order_by():
+            KitchenFeed.objects.filter(user_id=owner_id, pruned_version__lt=version).update(pruned_version=version)
+        KitchenFeed.objects.filter(Q(pruned_before__isnull=True) | Q(pruned_before__lt=cutoff)).update(pruned_before=cutoff)
+        return old.delete()[0]
+
+
+def archive_kitchen_orders(days=None, batch_size=ARCHIVE_BATCH_SIZE):
+    """Archive served orders last updated more than days ago, in batches, and prune the change feed.
+
+    Returns the number of orders moved.
+    """
+    cutoff = archive_cutoff(days)
+    moved = 0
+    while True:
+        count = archive_batch(cutoff, batch_size)
+        moved += count
+        if count < batch_size:
+            break
+    prune_order_changes(cutoff)
+    return moved
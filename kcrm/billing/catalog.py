@@ -0,0 +1,76 @@
+import hashlib
+import json
+
+from django.core.cache import cache
+from django.db.models import Prefetch
+
+from kcrm.caching import get_tenant_version, tenant_key
+from kcrm.singleflight import flight_key, single_flight
+
+from .models import MENU_NAMESPACE, MenuCategory, MenuItem
+
+CATALOG_CACHE_TTL = 60 * 60
+CATALOG_MAX_AGE = 30
+
+
+def catalog_item(menu_item):
+    return {
+        'id': menu_item.id,
+        'name': menu_item.name,
+        'description': menu_item.description,
+        'price': float(menu_item.price),
+        'thumbnail': menu_item.thumbnail.url if menu_item.thumbnail else None,
+        'image': menu_item.image.url if menu_item.image else None,
+        'portions': menu_item.portions,
+        'sold_out': menu_item.sold_out
+    }
+
+
+def compute_menu_catalog(owner_user, economic_year, mode):
+    """Active categories with their available items nested, in two queries, with an ETag.
+
+    Image URLs are kept relative so the cached catalog serves any host; see absolute_catalog.
+    """
+    items = MenuItem.objects.filter(available=True).only(
+        'id', 'category_id', 'name', 'description', 'price', 'image', 'thumbnail', 'available', 'portions'
+    ).order_by('name')
+    categories = MenuCategory.objects.filter(
+        user=owner_user, economic_year=economic_year, mode=mode, is_active=True
+    ).prefetch_related(Prefetch('menu_items', queryset=items)).order_by('name')
+
+    data = [
+        {
+            'id': category.id,
+            'name': category.name,
+            'description': category.description,
+            'items': [catalog_item(menu_item) for menu_item in category.menu_items.all()]
+        } for category in categories
+    ]
+    etag = '"%s"' % hashlib.md5(json.dumps(data, sort_keys=True).encode()).hexdigest()
+    return {'data': data, 'etag': etag}
+
+
+def cached_menu_catalog(owner_user, economic_year, mode):
+    """The menu catalog with its ETag, cached until the tenant's menu or sold-out state next changes"""
+    version = get_tenant_version(MENU_NAMESPACE, owner_user.id)
+    key = tenant_key(MENU_NAMESPACE, owner_user.id, version, economic_year.id, mode, 'catalog')
+    entry = cache.get(key)
+    if entry is None:
+        entry = single_flight(
+            flight_key('menu_catalog', owner_user.id, version, economic_year.id, mode),
+            lambda: compute_menu_catalog(owner_user, economic_year, mode)
+        )
+        cache.set(key, entry, CATALOG_CACHE_TTL)
+    return entry
+
+
+def absolute_catalog(data, build_url):
+    """A copy of catalog data with image URLs made absolute for the requesting host"""
+    return [
+        dict(category, items=[
+            dict(item, **{
+                field: build_url(item[field]) if item[field] else None
+                for field in ('thumbnail', 'image')
+            }) for item in category['items']
+        ]) for category in data
+    ]
@@ -0,0 +1,131 @@
+import abc
+import asyncio
+import logging
+import threading
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+# Events a slow screen may fall behind by before it is told to reload instead
+SUBSCRIBER_QUEUE_SIZE = 100
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def restaurant_channel(owner_id):
+    return f'kitchen:{owner_id}'
+
+
+class BaseBroker(abc.ABC):
+    """Pub/sub transport for kitchen events.
+
+    publish may be called from any thread. subscribe is called from the event loop
+    serving a stream and returns an object with an async get(timeout) and a close(),
+    which hands it back to unsubscribe. A multi-node deployment points
+    KITCHEN_EVENT_BROKER at a subclass backed by a shared bus; the rest of the code
+    only uses these three methods.
+    """
+
+    @abc.abstractmethod
+    def publish(self, channel, message):
+        pass
+
+    @abc.abstractmethod
+    def subscribe(self, channel):
+        pass
+
+    @abc.abstractmethod
+    def unsubscribe(self, subscription):
+        pass
+
+
+class Subscription:
+    def __init__(self, broker, channel):
+        self.broker = broker
+        self.channel = channel
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+    def put(self, message):
+        self.loop.call_soon_threadsafe(self._put, message)
+
+    def _put(self, message):
+        if self.queue.full():
+            # Drop the backlog and have the screen refetch rather than block publishers
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            message = {'event': 'resync'}
+        self.queue.put_nowait(message)
+
+    async def get(self, timeout):
+        """The next message, or None if none arrives within timeout seconds"""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class InProcessBroker(BaseBroker):
+    """Fans messages out to the subscribers of this process; enough for a single node"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+
+    def publish(self, channel, message):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for subscriber in subscribers:
+            try:
+                subscriber.put(message)
+            except RuntimeError:
+                # The subscriber's event loop has shut down
+                self.unsubscribe(subscriber)
+
+    def subscribe(self, channel):
+        subscription = Subscription(self, channel)
+        with self._lock:
+            self._subscribers.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.channel)
+            if subscribers:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.channel]
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                _broker = import_string(settings.KITCHEN_EVENT_BROKER)()
+    return _broker
+
+
+def publish_restaurant_message(owner_id, message):
+    """Push a message to the restaurant's kitchen screens once the transaction commits"""
+    transaction.on_commit(lambda: get_broker().publish(restaurant_channel(owner_id), message), robust=True)
+
+
+def publish_order_event(order, event, version=None):
+    """Push an order event, with the order as it was committed, to the restaurant's kitchen screens"""
+    def send():
+        from .serializers import KitchenOrderSerializer
+        get_broker().publish(restaurant_channel(order.user_id), {
+            'event': f'order.{event}',
+            'version': version,
+            'order': KitchenOrderSerializer(order).data
+        })
+
+    transaction.on_commit(send, robust=True)
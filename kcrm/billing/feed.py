@@ -0,0 +1,70 @@
+from django.db.models import Exists, OuterRef, Prefetch
+
+from .models import KitchenFeed, KitchenOrder, KitchenOrderChange, KitchenOrderItem
+from .serializers import KitchenOrderSerializer
+
+# The order queues a device can follow, by the statuses that keep an order in them
+FEED_QUEUES = {
+    'kitchen': KitchenOrder.ACTIVE_STATUSES,
+    'billing': ['completed'],
+}
+
+
+def feed_state(owner_user):
+    """(version, pruned_version) of the restaurant's change feed"""
+    feed = KitchenFeed.objects.filter(user=owner_user).first()
+    return (feed.version, feed.pruned_version) if feed else (0, 0)
+
+
+def with_items(orders, station=None):
+    """Prefetch the orders' items; for a station, only orders with lines for it and only those lines.
+
+    Lines without a station are shown on every station's display.
+    """
+    if not station:
+        return orders.prefetch_related('items')
+    lines = KitchenOrderItem.objects.filter(station__in=[station, '']).order_by('id')
+    return orders.filter(
+        Exists(lines.filter(order=OuterRef('pk')))
+    ).prefetch_related(Prefetch('items', queryset=lines))
+
+
+def queue_orders(owner_user, economic_year, queue, station=None):
+    return with_items(KitchenOrder.objects.filter(
+        user=owner_user, economic_year=economic_year, status__in=FEED_QUEUES[queue]
+    ), station).order_by('created_at')
+
+
+def read_changes(owner_user, economic_year, queue, since=None, station=None):
+    """What a device following queue must apply to catch up from version since.
+
+    Returns the new version, the changed orders that are in the queue and the ids of
+    changed orders that are not, which the device drops if it has them. Without since,
+    or when the changes after it have been pruned, the whole queue is returned with
+    reset set, and the device replaces what it has. With station, only orders and lines
+    for that station are returned.
+    """
+    version, pruned_version = feed_state(owner_user)
+    if since is not None and since >= version:
+        return {'version': max(since, version), 'reset': False, 'orders': [], 'removed': []}
+
+    reset = since is None or since < pruned_version
+    orders = queue_orders(owner_user, economic_year, queue, station)
+    if reset:
+        return {
+            'version': version,
+            'reset': True,
+            'orders': KitchenOrderSerializer(orders, many=True).data,
+            'removed': []
+        }
+
+    changed_ids = set(KitchenOrderChange.objects.filter(
+        user=owner_user, version__gt=since, version__lte=version
+    ).values_list('order_id', flat=True))
+    orders = list(orders.filter(id__in=changed_ids))
+    return {
+        'version': version,
+        'reset': False,
+        'orders': KitchenOrderSerializer(orders, many=True).data,
+        'removed': sorted(changed_ids - {order.id for order in orders})
+    }
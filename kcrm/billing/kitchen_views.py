@@ -1,9 +1,28 @@
+import asyncio
+import json
+
+from asgiref.sync import sync_to_async
+from django.core import signing
+from django.http import JsonResponse, StreamingHttpResponse
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
 from .models import KitchenOrder, KitchenOrderItem
-from .serializers import KitchenOrderSerializer
+from .serializers import KitchenOrderSerializer, KitchenOrderItemSerializer
+from .events import get_broker, restaurant_channel
+from .feed import FEED_QUEUES, read_changes, with_items
 from staff.models import Staff
+from kcrm.pagination import KeysetPagination
+
+# Comment lines keep idle streams open through proxies
+KEEPALIVE_INTERVAL = 15
+LONG_POLL_TIMEOUT = 25
+MAX_LONG_POLL_TIMEOUT = 55
+# Seconds a stream ticket can be used to open a stream; an open stream outlives it
+STREAM_TICKET_MAX_AGE = 60
+STREAM_TICKET_SALT = 'kitchen-stream'
 
 def get_owner_user(request):
     """Get the shop owner user for staff or return the user itself for shop owners"""
@@ -18,6 +37,7 @@ def get_owner_user(request):
 class KitchenOrderViewSet(viewsets.ModelViewSet):
     queryset = KitchenOrder.objects.all()
     serializer_class = KitchenOrderSerializer
+    pagination_class = KeysetPagination
     
     def get_queryset(self):
         from authentication.models import EconomicYear, User
@@ -36,14 +56,14 @@ class KitchenOrderViewSet(viewsets.ModelViewSet):
                 
                 if restaurant_owner:
                     active_eco_year = EconomicYear.objects.get(user=restaurant_owner, is_active=True)
-                    orders = KitchenOrder.objects.filter(user=restaurant_owner, economic_year=active_eco_year).order_by('-created_at')
-                    return orders
+                    orders = KitchenOrder.objects.filter(user=restaurant_owner, economic_year=active_eco_year)
+                    return with_items(orders, self.request.query_params.get('station')).order_by('-created_at')
             else:
                 # For restaurant owners and staff, get owner's orders
                 owner_user = get_owner_user(self.request)
                 active_eco_year = EconomicYear.objects.get(user=owner_user, is_active=True)
-                orders = KitchenOrder.objects.filter(user=owner_user, economic_year=active_eco_year).order_by('-created_at')
-                return orders
+                orders = KitchenOrder.objects.filter(user=owner_user, economic_year=active_eco_year)
+                return with_items(orders, self.request.query_params.get('station')).order_by('-created_at')
         except EconomicYear.DoesNotExist:
             logger.error("No active economic year found")
         except Exception as e:
@@ -57,26 +77,130 @@ class KitchenOrderViewSet(viewsets.ModelViewSet):
         active_eco_year = EconomicYear.objects.get(user=owner_user, is_active=True)
         serializer.save(user=owner_user, economic_year=active_eco_year)
     
+    def transition_order(self, request, order, new_status):
+        """Move order to new_status, or the 409 response to return when it cannot be moved.
+
+        Clients may send the version they last saw; without one the version read here is used.
+        Repeating a move the order already made is not a conflict.
+        """
+        try:
+            expected_version = int(request.data.get('version', order.version))
+        except (TypeError, ValueError):
+            return Response({'error': 'Invalid version'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        if order.status == new_status:
+            return None
+        if expected_version != order.version:
+            error = 'Order was changed on another device'
+        elif not order.can_transition(new_status):
+            error = f'Cannot move order from {order.status} to {new_status}'
+        elif not order.transition(new_status, expected_version):
+            error = 'Order was changed on another device'
+        else:
+            return None
+        
+        return Response({
+            'success': False,
+            'error': error,
+            'current': self.get_serializer(order).data
+        }, status=status.HTTP_409_CONFLICT)
+    
     @action(detail=True, methods=['patch'])
     def status(self, request, pk=None):
         order = self.get_object()
         status_value = request.data.get('status')
         
-        if status_value in ['pending', 'preparing', 'ready', 'served', 'completed']:
-            order.status = status_value
-            order.save()
+        if status_value in KitchenOrder.TRANSITIONS:
+            conflict = self.transition_order(request, order, status_value)
+            if conflict:
+                return conflict
             serializer = self.get_serializer(order)
             return Response(serializer.data)
         
         return Response({'error': 'Invalid status'}, status=status.HTTP_400_BAD_REQUEST)
     
+    @action(detail=True, methods=['patch'], url_path='items/(?P<item_id>[^/.]+)/status')
+    def item_status(self, request, pk=None, item_id=None):
+        """Move one line through its station's pending, preparing and ready steps"""
+        order = self.get_object()
+        try:
+            item = KitchenOrderItem.objects.get(id=item_id, order=order)
+        except (KitchenOrderItem.DoesNotExist, ValueError):
+            return Response({'error': 'Item not found'}, status=status.HTTP_404_NOT_FOUND)
+        
+        status_value = request.data.get('status')
+        if status_value not in KitchenOrderItem.TRANSITIONS:
+            return Response({'error': 'Invalid status'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        if item.status != status_value:
+            if order.status not in KitchenOrder.ACTIVE_STATUSES:
+                error = f'Order is already {order.status}'
+            elif not item.can_transition(status_value):
+                error = f'Cannot move item from {item.status} to {status_value}'
+            elif not item.transition(status_value):
+                order.refresh_from_db(fields=['status'])
+                if order.status not in KitchenOrder.ACTIVE_STATUSES:
+                    error = f'Order is already {order.status}'
+                else:
+                    error = 'Item was changed on another device'
+            else:
+                error = None
+            if error:
+                return Response({
+                    'success': False,
+                    'error': error,
+                    'current': KitchenOrderItemSerializer(item).data
+                }, status=status.HTTP_409_CONFLICT)
+        
+        return Response(KitchenOrderItemSerializer(item).data)
+    
     @action(detail=True, methods=['patch'])
     def complete(self, request, pk=None):
         order = self.get_object()
-        order.status = 'completed'
-        order.save()
+        conflict = self.transition_order(request, order, 'completed')
+        if conflict:
+            return conflict
         return Response({'success': True})
     
+    @action(detail=False, methods=['post'])
+    def stream_ticket(self, request):
+        """Short-lived ticket for opening the events or changes stream from an EventSource"""
+        return Response({
+            'success': True,
+            'ticket': issue_stream_ticket(request.user),
+            'expires_in': STREAM_TICKET_MAX_AGE
+        })
+    
+    @action(detail=False, methods=['get'])
+    def active(self, request):
+        """Open orders the kitchen still has to act on, oldest first"""
+        orders = self.get_queryset().filter(
+            status__in=KitchenOrder.ACTIVE_STATUSES
+        ).order_by('created_at')
+        serializer = self.get_serializer(orders, many=True)
+        return Response({'success': True, 'data': serializer.data})
+    
+    @action(detail=False, methods=['get'])
+    def metrics(self, request):
+        """Prep time percentiles, queue depth and hourly throughput from the hourly rollups; ?station= for one station"""
+        from django.utils import timezone
+        from datetime import timedelta
+        from .metrics import kitchen_metrics
+        
+        try:
+            hours = min(max(int(request.query_params.get('hours', 24)), 1), 24 * 31)
+        except ValueError:
+            return Response({'success': False, 'error': 'Invalid hours'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        # Kitchen displays read their restaurant's metrics
+        restaurant_owner = get_restaurant_owner(request.user)
+        if restaurant_owner is None:
+            return Response({'success': False, 'error': 'Restaurant not found'}, status=status.HTTP_404_NOT_FOUND)
+        data = kitchen_metrics(
+            restaurant_owner, timezone.now() - timedelta(hours=hours - 1), request.query_params.get('station', '')
+        )
+        return Response({'success': True, 'data': data})
+    
     @action(detail=False, methods=['get'])
     def billing_orders(self, request):
         """Get orders ready for billing (completed status)"""
@@ -98,7 +222,7 @@ class KitchenOrderViewSet(viewsets.ModelViewSet):
                         user=restaurant_owner, 
                         economic_year=active_eco_year,
                         status='completed'
-                    ).order_by('-created_at')
+                    ).prefetch_related('items').order_by('-created_at')
                     serializer = self.get_serializer(orders, many=True)
                     return Response({'success': True, 'data': serializer.data})
             else:
@@ -109,7 +233,7 @@ class KitchenOrderViewSet(viewsets.ModelViewSet):
                     user=owner_user, 
                     economic_year=active_eco_year,
                     status='completed'
-                ).order_by('-created_at')
+                ).prefetch_related('items').order_by('-created_at')
                 serializer = self.get_serializer(orders, many=True)
                 return Response({'success': True, 'data': serializer.data})
         except Exception as e:
@@ -127,8 +251,9 @@ class KitchenOrderViewSet(viewsets.ModelViewSet):
             order = self.get_object()
             
             # Update order status to served (finalized)
-            order.status = 'served'
-            order.save()
+            conflict = self.transition_order(request, order, 'served')
+            if conflict:
+                return conflict
             
             # Auto clean table if table_id exists
             if order.table_id:
@@ -151,4 +276,140 @@ class KitchenOrderViewSet(viewsets.ModelViewSet):
             
         except Exception as e:
             logger.error(f"Error finalizing billing: {str(e)}")
-            return Response({'success': False, 'error': str(e)}, status=400)
\ No newline at end of file
+            return Response({'success': False, 'error': str(e)}, status=400)
+
+
+def get_restaurant_owner(user):
+    """The shop owner whose kitchen a user follows: the restaurant for kitchen users, the shop for staff"""
+    from authentication.models import User
+    if user.role == 'kitchen_user':
+        if not user.restaurant_id:
+            return None
+        return User.objects.filter(id=user.restaurant_id, role='shop_owner').first()
+    if user.role == 'staff':
+        staff = Staff.objects.filter(user=user).select_related('shop_owner').first()
+        return staff.shop_owner if staff else user
+    return user
+
+def issue_stream_ticket(user):
+    return signing.TimestampSigner(salt=STREAM_TICKET_SALT).sign(str(user.id))
+
+def authenticate_stream(request):
+    """Resolve the user from the Authorization header or, for EventSource clients, a ?ticket= stream ticket.
+
+    Tickets only open streams and expire after STREAM_TICKET_MAX_AGE, so the access token
+    never has to go in a URL where logs and proxies would keep it.
+    """
+    from authentication.models import User
+    try:
+        result = JWTAuthentication().authenticate(request)
+        if result:
+            return result[0]
+    except (InvalidToken, TokenError):
+        return None
+    ticket = request.GET.get('ticket')
+    if not ticket:
+        return None
+    try:
+        user_id = signing.TimestampSigner(salt=STREAM_TICKET_SALT).unsign(ticket, max_age=STREAM_TICKET_MAX_AGE)
+    except signing.BadSignature:
+        return None
+    return User.objects.filter(id=user_id).first()
+
+def format_event(event, data):
+    return f'event: {event}\ndata: {json.dumps(data)}\n\n'
+
+def station_message(message, station):
+    """The message as a station's display sees it: the order's lines for that station, or None if it has none"""
+    order = message.get('order')
+    if not station or order is None:
+        return message
+    items = [item for item in order['items'] if item['station'] in (station, '')]
+    if not items:
+        return None
+    return dict(message, order=dict(order, items=items))
+
+async def kitchen_events(request):
+    """Server-sent events stream of the restaurant's order created, status and finalized events.
+
+    With ?station=, order events carry only that station's lines and orders without any are skipped.
+    """
+    user = await sync_to_async(authenticate_stream)(request)
+    if user is None or not user.is_active:
+        return JsonResponse({'success': False, 'message': 'Authentication required'}, status=401)
+    
+    restaurant_owner = await sync_to_async(get_restaurant_owner)(user)
+    if restaurant_owner is None:
+        return JsonResponse({'success': False, 'message': 'Restaurant not found'}, status=404)
+    
+    station = request.GET.get('station')
+    subscription = get_broker().subscribe(restaurant_channel(restaurant_owner.id))
+    
+    async def stream():
+        try:
+            yield 'retry: 3000\n' + format_event('ready', {'restaurant_id': restaurant_owner.id})
+            while True:
+                message = await subscription.get(KEEPALIVE_INTERVAL)
+                if message is None:
+                    yield ': keepalive\n\n'
+                    continue
+                message = station_message(message, station)
+                if message is not None:
+                    yield format_event(message['event'], message)
+        finally:
+            subscription.close()
+    
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+def get_active_year(owner_user):
+    from authentication.models import EconomicYear
+    return EconomicYear.objects.filter(user=owner_user, is_active=True).first()
+
+async def kitchen_changes(request):
+    """Long-poll change feed for the kitchen or billing queue.
+
+    Answers at once when the queue changed after ?since=<version>, otherwise parks until
+    it does or ?timeout= seconds pass. Omit since to get the whole queue and its version.
+    ?station= limits the orders and their lines to one kitchen station.
+    """
+    user = await sync_to_async(authenticate_stream)(request)
+    if user is None or not user.is_active:
+        return JsonResponse({'success': False, 'message': 'Authentication required'}, status=401)
+    
+    queue = request.GET.get('queue', 'kitchen')
+    station = request.GET.get('station') or None
+    if queue not in FEED_QUEUES:
+        return JsonResponse({'success': False, 'message': 'Invalid queue'}, status=400)
+    try:
+        since = int(request.GET['since']) if request.GET.get('since') else None
+        timeout = min(max(float(request.GET.get('timeout', LONG_POLL_TIMEOUT)), 0), MAX_LONG_POLL_TIMEOUT)
+    except ValueError:
+        return JsonResponse({'success': False, 'message': 'Invalid since or timeout'}, status=400)
+    
+    restaurant_owner = await sync_to_async(get_restaurant_owner)(user)
+    if restaurant_owner is None:
+        return JsonResponse({'success': False, 'message': 'Restaurant not found'}, status=404)
+    economic_year = await sync_to_async(get_active_year)(restaurant_owner)
+    if economic_year is None:
+        return JsonResponse({'success': False, 'message': 'No active economic year found'}, status=400)
+    
+    # Subscribe before reading so a change committed in between still wakes this request
+    subscription = get_broker().subscribe(restaurant_channel(restaurant_owner.id))
+    try:
+        changes = await sync_to_async(read_changes)(restaurant_owner, economic_year, queue, since, station)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while not changes['reset'] and changes['version'] == since:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            # Read again whether woken or timed out, so a change that landed unannounced is not held back
+            await subscription.get(remaining)
+            changes = await sync_to_async(read_changes)(restaurant_owner, economic_year, queue, since, station)
+    finally:
+        subscription.close()
+    
+    return JsonResponse({'success': True, **changes})
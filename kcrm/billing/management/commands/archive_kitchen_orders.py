@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from billing.archive import ARCHIVE_BATCH_SIZE, archivable_orders, archive_cutoff, archive_kitchen_orders
+
+
+class Command(BaseCommand):
+    help = 'Move served kitchen orders older than KITCHEN_ARCHIVE_AFTER_DAYS into the archive tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help='Archive orders served more than this many days ago')
+        parser.add_argument('--batch-size', type=int, default=ARCHIVE_BATCH_SIZE)
+        parser.add_argument('--dry-run', action='store_true', help='Only report how many orders would move')
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            count = archivable_orders(archive_cutoff(options['days'])).count()
+            self.stdout.write(f'{count} kitchen orders would be archived')
+            return
+
+        count = archive_kitchen_orders(options['days'], options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Archived {count} kitchen orders'))
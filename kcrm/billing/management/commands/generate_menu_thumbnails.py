@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from billing.models import MenuItem
+from billing.thumbnails import generate_thumbnail
+
+
+class Command(BaseCommand):
+    help = 'Generate WebP thumbnails for menu item images that do not have one yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Regenerate thumbnails that already exist')
+
+    def handle(self, *args, **options):
+        menu_items = MenuItem.objects.exclude(image='').exclude(image__isnull=True)
+        if not options['all']:
+            menu_items = menu_items.filter(thumbnail__isnull=True) | menu_items.filter(thumbnail='')
+
+        generated = 0
+        failed = 0
+        for menu_item_id in menu_items.values_list('id', flat=True).iterator():
+            try:
+                if generate_thumbnail(menu_item_id):
+                    generated += 1
+            except Exception as e:
+                failed += 1
+                self.stderr.write(f'Menu item {menu_item_id}: {e}')
+        self.stdout.write(self.style.SUCCESS(f'Generated {generated} thumbnails, {failed} failed'))
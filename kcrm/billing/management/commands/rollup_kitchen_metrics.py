@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from billing.metrics import rollup_kitchen_metrics
+
+
+class Command(BaseCommand):
+    help = 'Roll kitchen order events up into hourly throughput stats; run it every few minutes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=2, help='Recompute this many hours back, including the current one')
+
+    def handle(self, *args, **options):
+        count = rollup_kitchen_metrics(max(options['hours'], 1))
+        self.stdout.write(self.style.SUCCESS(f'Rolled up {count} restaurant hours'))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from billing.pricing import claim_repricing_job, run_repricing_job
+
+
+class Command(BaseCommand):
+    help = 'Run queued repricing jobs from update_selling_prices; run it every minute'
+
+    def handle(self, *args, **options):
+        count = 0
+        while True:
+            job = claim_repricing_job()
+            if job is None:
+                break
+            run_repricing_job(job)
+            count += 1
+            self.stdout.write(f'Job {job.id}: {job.status}')
+        self.stdout.write(self.style.SUCCESS(f'Ran {count} repricing jobs'))
@@ -0,0 +1,60 @@
+from decimal import Decimal
+
+from inventory.valuation import COST_PLACES
+from kcrm.caching import bump_tenant_version
+
+from .models import MENU_NAMESPACE, MenuIngredient, MenuItem
+
+
+def affected_menu_items(stock_ids):
+    """Ids of the menu items whose recipes use any of the stocks, read from the ingredient index"""
+    if not stock_ids:
+        return []
+    return list(MenuIngredient.objects.filter(ingredient_id__in=stock_ids).values_list('menu_item_id', flat=True).distinct())
+
+
+def recipe_figures(menu_item_ids):
+    """{menu_item_id: (portions, cost)} from the current stock of each recipe's ingredients, in one query.
+
+    Portions is how many servings the ingredients allow, after the fractions of a unit
+    already used by earlier orders. Cost is the sum of each ingredient quantity at the
+    stock's average unit cost. Items without a recipe are left out.
+    """
+    figures = {}
+    rows = MenuIngredient.objects.filter(menu_item_id__in=menu_item_ids, quantity__gt=0).values_list(
+        'menu_item_id', 'quantity', 'ingredient__current_stock', 'ingredient__consumption_remainder',
+        'ingredient__average_cost', 'ingredient__cost_price'
+    )
+    for menu_item_id, quantity, current_stock, remainder, average_cost, cost_price in rows:
+        makeable = max(int((current_stock - remainder) // quantity), 0)
+        cost = quantity * (average_cost or cost_price)
+        portions, total = figures.get(menu_item_id, (makeable, Decimal('0')))
+        figures[menu_item_id] = (min(portions, makeable), total + cost)
+    return {
+        menu_item_id: (portions, cost.quantize(COST_PLACES))
+        for menu_item_id, (portions, cost) in figures.items()
+    }
+
+
+def refresh_menu_items(menu_item_ids):
+    """Store the portions and recipe cost of the given menu items, writing only the ones that changed"""
+    if not menu_item_ids:
+        return 0
+    figures = recipe_figures(menu_item_ids)
+    changed = []
+    for menu_item in MenuItem.objects.filter(id__in=menu_item_ids).only('id', 'user_id', 'portions', 'cost'):
+        portions, cost = figures.get(menu_item.id, (None, None))
+        if (menu_item.portions, menu_item.cost) != (portions, cost):
+            menu_item.portions = portions
+            menu_item.cost = cost
+            changed.append(menu_item)
+    MenuItem.objects.bulk_update(changed, ['portions', 'cost'])
+    # Sold-out state is part of the cached menu catalog
+    for owner_id in {menu_item.user_id for menu_item in changed}:
+        bump_tenant_version(MENU_NAMESPACE, owner_id)
+    return len(changed)
+
+
+def refresh_stock_menu_items(stock_ids):
+    """Recompute just the menu items that use stocks whose level or cost changed"""
+    return refresh_menu_items(affected_menu_items(stock_ids))
@@ -0,0 +1,156 @@
+import math
+from datetime import timedelta
+
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import (
+    ArchivedKitchenOrderItem, KitchenFeed, KitchenHourlyStats, KitchenOrder, KitchenOrderChange, KitchenOrderItem
+)
+
+# Orders still open after this long are treated as abandoned when measuring queue depth
+QUEUE_LOOKBACK = timedelta(days=1)
+LEFT_QUEUE = Q(event__in=['deleted', 'archived']) | ~Q(status__in=KitchenOrder.ACTIVE_STATUSES)
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers, or None when it is empty"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(math.ceil(pct / 100 * len(ordered)) - 1, 0)]
+
+
+def hour_start(moment):
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def queued_orders(changes, moment):
+    """Ids of orders created before moment that had not yet left the kitchen queue at moment"""
+    created = set(changes.filter(
+        event='created', created_at__gte=moment - QUEUE_LOOKBACK, created_at__lt=moment
+    ).values_list('order_id', flat=True))
+    left = set(changes.filter(LEFT_QUEUE, order_id__in=created, created_at__lt=moment).values_list('order_id', flat=True))
+    return created - left
+
+
+def order_stations(order_ids):
+    """{order_id: stations of its lines}, read from live and archived lines; blank is a line for every station"""
+    stations = {}
+    for model in (KitchenOrderItem, ArchivedKitchenOrderItem):
+        lines = model.objects.filter(order_id__in=order_ids).values_list('order_id', 'station').distinct()
+        for order_id, station in lines:
+            stations.setdefault(order_id, set()).add(station)
+    return stations
+
+
+def shown_at(station, order_station_set):
+    """Whether an order with lines at these stations is on station's display; every order is on the whole kitchen's"""
+    return not station or station in order_station_set or '' in order_station_set
+
+
+def rollup_hour(owner_id, hour):
+    """Recompute one hour of a restaurant's kitchen stats from its change feed.
+
+    Writes the whole-kitchen row and one row per station, counting the orders that
+    station's display shows: those with a line for it or a line without a station.
+    """
+    end = hour + timedelta(hours=1)
+    changes = KitchenOrderChange.objects.filter(user_id=owner_id)
+    in_hour = changes.filter(created_at__gte=hour, created_at__lt=end)
+
+    created = set(in_hour.filter(event='created').values_list('order_id', flat=True))
+    completed = set(in_hour.filter(event='finalized').values_list('order_id', flat=True))
+    queued = queued_orders(changes, end)
+    ready = {}
+    for order_id, at in in_hour.filter(status='ready', event='status').values_list('order_id', 'created_at'):
+        ready.setdefault(order_id, at)
+    created_at = dict(changes.filter(event='created', order_id__in=ready).values_list('order_id', 'created_at'))
+    ready_seconds = {
+        order_id: int((at - created_at[order_id]).total_seconds())
+        for order_id, at in ready.items() if order_id in created_at
+    }
+
+    stations = order_stations(created | completed | queued | set(ready))
+    rows = []
+    for station in [''] + sorted(set().union(*stations.values()) - {''}):
+        def shown(order_id):
+            return shown_at(station, stations.get(order_id, ()))
+        seconds = [value for order_id, value in ready_seconds.items() if shown(order_id)]
+        stats, _ = KitchenHourlyStats.objects.update_or_create(
+            user_id=owner_id, hour=hour, station=station,
+            defaults={
+                'orders_created': sum(1 for order_id in created if shown(order_id)),
+                'orders_ready': sum(1 for order_id in ready if shown(order_id)),
+                'orders_completed': sum(1 for order_id in completed if shown(order_id)),
+                'queue_depth': sum(1 for order_id in queued if shown(order_id)),
+                'ready_p50_seconds': percentile(seconds, 50),
+                'ready_p95_seconds': percentile(seconds, 95),
+                'ready_seconds': seconds
+            }
+        )
+        rows.append(stats)
+    # Stations that no longer have orders in the hour
+    KitchenHourlyStats.objects.filter(user_id=owner_id, hour=hour).exclude(
+        station__in=[stats.station for stats in rows]
+    ).delete()
+    return rows
+
+
+def first_rebuildable_hour(pruned_before):
+    """The earliest hour whose changes, and the day of changes before it, are all still in the feed"""
+    if pruned_before is None:
+        return None
+    start = hour_start(pruned_before + QUEUE_LOOKBACK)
+    return start if start == pruned_before + QUEUE_LOOKBACK else start + timedelta(hours=1)
+
+
+def rollup_kitchen_metrics(hours=2, now=None):
+    """Roll up the last hours (including the current one) for every restaurant with kitchen activity.
+
+    Hours are recomputed from scratch, so running this again, or over a longer range, is safe.
+    Hours whose changes have been pruned from the feed are final and left as they are.
+    Returns the number of rows written.
+    """
+    now = now or timezone.now()
+    last = hour_start(now)
+    first = last - timedelta(hours=hours - 1)
+    owners = KitchenOrderChange.objects.filter(
+        created_at__gte=first - QUEUE_LOOKBACK
+    ).values_list('user_id', flat=True).distinct()
+    pruned_before = dict(KitchenFeed.objects.filter(user_id__in=owners).values_list('user_id', 'pruned_before'))
+
+    written = 0
+    for owner_id in owners:
+        hour = max(filter(None, [first, first_rebuildable_hour(pruned_before.get(owner_id))]))
+        while hour <= last:
+            rollup_hour(owner_id, hour)
+            written += 1
+            hour += timedelta(hours=1)
+    return written
+
+
+def kitchen_metrics(owner_user, since, station=''):
+    """Hourly series and period percentiles for the owner dashboard, or one station, read from rollups only"""
+    rows = list(KitchenHourlyStats.objects.filter(user=owner_user, station=station, hour__gte=hour_start(since)))
+    ready_seconds = [seconds for row in rows for seconds in row.ready_seconds]
+    return {
+        'summary': {
+            'orders_created': sum(row.orders_created for row in rows),
+            'orders_completed': sum(row.orders_completed for row in rows),
+            'ready_p50_seconds': percentile(ready_seconds, 50),
+            'ready_p95_seconds': percentile(ready_seconds, 95),
+            'max_queue_depth': max((row.queue_depth for row in rows), default=0)
+        },
+        'hourly': [
+            {
+                'hour': row.hour.isoformat(),
+                'orders_created': row.orders_created,
+                'orders_ready': row.orders_ready,
+                'orders_completed': row.orders_completed,
+                'queue_depth': row.queue_depth,
+                'ready_p50_seconds': row.ready_p50_seconds,
+                'ready_p95_seconds': row.ready_p95_seconds
+            } for row in rows
+        ]
+    }
@@ -1,8 +1,14 @@
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.utils import timezone
 from django.contrib.auth import get_user_model
+from inventory.models import SearchTermBase
 
 User = get_user_model()
 
+CUSTOMER_SEARCH_NAMESPACE = 'customer_search'
+MENU_NAMESPACE = 'menu'
+DEFAULT_PROFIT_PERCENTAGE = '20.0'
+
 class Customer(models.Model):
     MODE_CHOICES = [
         ('kirana', 'Kirana'),
@@ -12,6 +18,7 @@ class Customer(models.Model):
     
     name = models.CharField(max_length=100)
     phone = models.CharField(max_length=15)
+    normalized_phone = models.CharField(max_length=15, blank=True, default='')
     email = models.EmailField(blank=True, null=True)
     address = models.TextField(blank=True)
     loyalty_points = models.IntegerField(default=0)
@@ -26,9 +33,53 @@ class Customer(models.Model):
     
     class Meta:
         unique_together = ['phone', 'user', 'economic_year', 'mode']
+        indexes = [
+            models.Index(fields=['user', 'economic_year', 'mode', 'normalized_phone'], name='customer_phone_lookup_idx'),
+            models.Index(fields=['user', 'economic_year', 'mode', 'created_at'], name='customer_tenant_created_idx'),
+        ]
 
     def __str__(self):
         return self.name
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._indexed_key = (instance.__dict__.get('name'), instance.__dict__.get('mode'))
+        return instance
+    
+    def save(self, *args, **kwargs):
+        from inventory.search import normalize_phone
+        from kcrm.caching import bump_tenant_version
+        
+        self.normalized_phone = normalize_phone(self.phone)
+        if kwargs.get('update_fields') is not None and 'phone' in kwargs['update_fields']:
+            kwargs['update_fields'] = set(kwargs['update_fields']) | {'normalized_phone'}
+        reindex = getattr(self, '_indexed_key', None) != (self.name, self.mode)
+        super().save(*args, **kwargs)
+        
+        if reindex:
+            from inventory.search import index_objects
+            index_objects(CustomerSearchTerm, [self], lambda customer: customer.name, kinds=('prefix',))
+            self._indexed_key = (self.name, self.mode)
+        bump_tenant_version(CUSTOMER_SEARCH_NAMESPACE, self.user_id)
+    
+    def delete(self, *args, **kwargs):
+        from kcrm.caching import bump_tenant_version
+        
+        result = super().delete(*args, **kwargs)
+        bump_tenant_version(CUSTOMER_SEARCH_NAMESPACE, self.user_id)
+        return result
+
+class CustomerSearchTerm(SearchTermBase):
+    target = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='search_terms')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'economic_year', 'mode', 'kind', 'term', 'target'], name='customer_search_term_idx')
+        ]
+
+    def __str__(self):
+        return f"{self.kind}:{self.term} -> {self.target_id}"
 
 class Sale(models.Model):
     PAYMENT_METHODS = [
@@ -65,8 +116,22 @@ class Sale(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['cashier', 'economic_year', 'mode', 'created_at'], name='sale_tenant_created_idx'),
+            models.Index(fields=['customer', 'payment_method', 'created_at'], name='sale_customer_payment_idx'),
+        ]
+
     def __str__(self):
         return f"Sale {self.sale_number}"
+    
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        
+        # Credit balances shown by customer autocomplete depend on this sale
+        if self.customer_id:
+            from kcrm.caching import bump_tenant_version
+            bump_tenant_version(CUSTOMER_SEARCH_NAMESPACE, self.cashier_id)
 
 class SaleItem(models.Model):
     sale = models.ForeignKey(Sale, related_name='items', on_delete=models.CASCADE)
@@ -74,8 +139,14 @@ class SaleItem(models.Model):
     quantity = models.DecimalField(max_digits=10, decimal_places=2)
     unit_price = models.DecimalField(max_digits=10, decimal_places=2)
     total_price = models.DecimalField(max_digits=10, decimal_places=2)
+    unit_cost = models.DecimalField(max_digits=12, decimal_places=4, null=True, blank=True)
     unit = models.CharField(max_length=20)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['sale', 'product_name'], name='sale_item_product_idx'),
+        ]
+
     def __str__(self):
         return f"{self.product_name} - {self.quantity} {self.unit}"
 
@@ -88,6 +159,8 @@ class MenuCategory(models.Model):
     
     name = models.CharField(max_length=100)
     description = models.TextField(blank=True)
+    # Kitchen station (grill, tandoor, bar...) that prepares this category's items; blank for the whole kitchen
+    station = models.CharField(max_length=50, blank=True)
     mode = models.CharField(max_length=20, choices=MODE_CHOICES)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     economic_year = models.ForeignKey('authentication.EconomicYear', on_delete=models.CASCADE)
@@ -101,6 +174,17 @@ class MenuCategory(models.Model):
     
     def __str__(self):
         return f"{self.name} ({self.mode})"
+    
+    def save(self, *args, **kwargs):
+        from kcrm.caching import bump_tenant_version
+        super().save(*args, **kwargs)
+        bump_tenant_version(MENU_NAMESPACE, self.user_id)
+    
+    def delete(self, *args, **kwargs):
+        from kcrm.caching import bump_tenant_version
+        result = super().delete(*args, **kwargs)
+        bump_tenant_version(MENU_NAMESPACE, self.user_id)
+        return result
 
 class MenuItem(models.Model):
     MODE_CHOICES = [
@@ -114,8 +198,16 @@ class MenuItem(models.Model):
     price = models.DecimalField(max_digits=10, decimal_places=2)
     category = models.ForeignKey(MenuCategory, on_delete=models.CASCADE, related_name='menu_items')
     image = models.ImageField(upload_to='menu_items/', blank=True, null=True)
+    # Small WebP copy of image for the POS menu, generated in the background after upload
+    thumbnail = models.ImageField(upload_to='menu_items/thumbnails/', blank=True, null=True)
     available = models.BooleanField(default=True)
     stock = models.IntegerField(default=0)
+    # Overrides the category's station when set
+    station = models.CharField(max_length=50, blank=True)
+    # Portions the recipe's ingredient stock allows; kept up to date on stock changes, null without a recipe
+    portions = models.IntegerField(null=True, blank=True)
+    # Recipe cost at the ingredients' average cost; kept up to date on cost changes, null without a recipe
+    cost = models.DecimalField(max_digits=12, decimal_places=4, null=True, blank=True)
     mode = models.CharField(max_length=20, choices=MODE_CHOICES)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     economic_year = models.ForeignKey('authentication.EconomicYear', on_delete=models.CASCADE)
@@ -127,6 +219,41 @@ class MenuItem(models.Model):
     
     def __str__(self):
         return f"{self.name} - {self.category.name}"
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_image = instance.__dict__.get('image') or None
+        return instance
+    
+    def save(self, *args, **kwargs):
+        from kcrm.caching import bump_tenant_version
+        image_changed = getattr(self, '_loaded_image', None) != (self.image.name or None)
+        if image_changed and self.thumbnail:
+            # The old thumbnail no longer matches; the menu shows none until the new one is made
+            self.thumbnail.delete(save=False)
+        super().save(*args, **kwargs)
+        self._loaded_image = self.image.name or None
+        bump_tenant_version(MENU_NAMESPACE, self.user_id)
+        
+        if image_changed and self.image:
+            from .thumbnails import schedule_thumbnail
+            schedule_thumbnail(self.id)
+    
+    def delete(self, *args, **kwargs):
+        from kcrm.caching import bump_tenant_version
+        result = super().delete(*args, **kwargs)
+        bump_tenant_version(MENU_NAMESPACE, self.user_id)
+        return result
+    
+    @property
+    def kitchen_station(self):
+        return self.station or self.category.station
+    
+    @property
+    def sold_out(self):
+        """Switched off by hand, or out of an ingredient for even one portion"""
+        return not self.available or self.portions == 0
 
 class MenuIngredient(models.Model):
     menu_item = models.ForeignKey(MenuItem, on_delete=models.CASCADE, related_name='ingredients')
@@ -137,9 +264,24 @@ class MenuIngredient(models.Model):
     
     class Meta:
         unique_together = ['menu_item', 'ingredient']
+        indexes = [
+            # Reverse lookup from a changed stock to the menu items that use it
+            models.Index(fields=['ingredient', 'menu_item'], name='menu_ingredient_usage_idx'),
+        ]
     
     def __str__(self):
         return f"{self.menu_item.name} - {self.ingredient.product_name} ({self.quantity})"
+    
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        from .menu_stock import refresh_menu_items
+        refresh_menu_items([self.menu_item_id])
+    
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        from .menu_stock import refresh_menu_items
+        refresh_menu_items([self.menu_item_id])
+        return result
 
 class ProfitPercentage(models.Model):
     MODE_CHOICES = [
@@ -162,6 +304,86 @@ class ProfitPercentage(models.Model):
         eco_year_name = self.economic_year.name if self.economic_year else 'No Year'
         mode_name = self.mode or 'No Mode'
         return f"Profit: {self.percentage}% ({mode_name} - {eco_year_name})"
+    
+    @classmethod
+    def resolve(cls, owner_id, economic_year_id, mode):
+        """Profit percentage for a shop owner's economic year and mode, cached until it changes"""
+        from decimal import Decimal
+        from django.core.cache import cache
+        from kcrm.caching import tenant_key
+        
+        key = tenant_key('profit_percentage', owner_id, economic_year_id, mode)
+        percentage = cache.get(key)
+        if percentage is None:
+            profit = cls.objects.filter(
+                economic_year_id=economic_year_id,
+                economic_year__user_id=owner_id,
+                mode=mode
+            ).first()
+            percentage = str(profit.percentage) if profit else DEFAULT_PROFIT_PERCENTAGE
+            cache.set(key, percentage, None)
+        return Decimal(percentage)
+    
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self.invalidate_cache()
+    
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        self.invalidate_cache()
+        return result
+    
+    def invalidate_cache(self):
+        from django.core.cache import cache
+        from kcrm.caching import tenant_key
+        
+        if self.economic_year_id:
+            cache.delete(tenant_key('profit_percentage', self.economic_year.user_id, self.economic_year_id, self.mode))
+
+class RepricingJob(models.Model):
+    """A large repricing queued by update_selling_prices and run by run_repricing_jobs"""
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+    
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    economic_year = models.ForeignKey('authentication.EconomicYear', on_delete=models.CASCADE, related_name='+')
+    mode = models.CharField(max_length=20, choices=ProfitPercentage.MODE_CHOICES)
+    percentage = models.DecimalField(max_digits=7, decimal_places=2)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    updated_count = models.IntegerField(null=True, blank=True)
+    stock_count = models.IntegerField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='repricing_job_status_idx'),
+        ]
+    
+    def __str__(self):
+        return f"Repricing {self.mode} {self.percentage}% ({self.status})"
+    
+    def as_dict(self):
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'mode': self.mode,
+            'economic_year': self.economic_year.name,
+            'percentage': float(self.percentage),
+            'updated_count': self.updated_count,
+            'stock_count': self.stock_count,
+            'error': self.error,
+            'created_at': self.created_at.isoformat(),
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
 
 class Floor(models.Model):
     name = models.CharField(max_length=100)
@@ -240,6 +462,16 @@ class KitchenOrder(models.Model):
         ('served', 'Served'),
         ('completed', 'Completed'),
     ]
+    # Statuses a kitchen still has to act on
+    ACTIVE_STATUSES = ['pending', 'preparing', 'ready']
+    # The only status moves transition() allows
+    TRANSITIONS = {
+        'pending': ['preparing'],
+        'preparing': ['ready'],
+        'ready': ['completed'],
+        'completed': ['served'],
+        'served': [],
+    }
     
     table_id = models.CharField(max_length=50)
     table_name = models.CharField(max_length=100)
@@ -251,21 +483,312 @@ class KitchenOrder(models.Model):
     chair_ids = models.JSONField(default=list, blank=True)
     notes = models.TextField(blank=True, null=True)
     economic_year = models.ForeignKey('authentication.EconomicYear', on_delete=models.CASCADE)
+    version = models.PositiveIntegerField(default=0)
+    # Set once the order's recipe ingredients have been taken out of stock
+    ingredients_consumed = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', 'economic_year', 'status', 'created_at'], name='kitchen_order_queue_idx'),
+            models.Index(fields=['user', 'table_id', 'status'], name='kitchen_order_table_idx'),
+        ]
     
     def __str__(self):
         return f"Order {self.id} - {self.table_name} ({self.status})"
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_status = instance.__dict__.get('status')
+        return instance
+    
+    def status_event(self, previous_status):
+        if previous_status == self.status:
+            return None
+        return 'finalized' if self.status == 'completed' else 'status'
+    
+    def record_change(self, event):
+        """Append to the change feed and, once committed, push the event to kitchen screens"""
+        from .events import publish_order_event
+        change = KitchenOrderChange.record(self.user_id, [self.id], event, self.status)[0]
+        publish_order_event(self, event, change.version)
+    
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        event = 'created' if adding else self.status_event(getattr(self, '_loaded_status', self.status))
+        if not adding:
+            self.version += 1
+        
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if event:
+                self.record_change(event)
+            if event == 'finalized':
+                self.consume_ingredients()
+        self._loaded_status = self.status
+    
+    def can_transition(self, new_status):
+        return new_status in self.TRANSITIONS.get(self.status, [])
+    
+    def transition(self, new_status, expected_version=None):
+        """Compare-and-set status move that writes only status, version and updated_at.
+
+        Returns False, with this instance reloaded from the current row, when another
+        writer changed the order after expected_version (default: the loaded version).
+        """
+        if expected_version is None:
+            expected_version = self.version
+        previous_status = self.status
+        now = timezone.now()
+        
+        with transaction.atomic():
+            updated = KitchenOrder.objects.filter(id=self.id, version=expected_version).update(
+                status=new_status, version=models.F('version') + 1, updated_at=now
+            )
+            if not updated:
+                self.refresh_from_db()
+                self._loaded_status = self.status
+                return False
+            
+            self.status = new_status
+            self.version = expected_version + 1
+            self.updated_at = now
+            self._loaded_status = new_status
+            if new_status == 'ready':
+                # Marking the whole order ready covers lines no station marked
+                self.items.exclude(status='ready').update(status='ready')
+            event = self.status_event(previous_status)
+            if event:
+                self.record_change(event)
+            if event == 'finalized':
+                self.consume_ingredients()
+        return True
+    
+    def consume_ingredients(self):
+        from .recipes import consume_ingredients
+        return consume_ingredients(self)
+    
+    def delete(self, *args, **kwargs):
+        order_id = self.id
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            change = KitchenOrderChange.record(self.user_id, [order_id], 'deleted', self.status)[0]
+        from .events import publish_restaurant_message
+        publish_restaurant_message(self.user_id, {'event': 'order.deleted', 'order_ids': [order_id], 'version': change.version})
+        return result
+
+class KitchenFeed(models.Model):
+    """A restaurant's change feed position.
+
+    Feed versions are handed out under this row's lock, so a restaurant's changes commit
+    in version order and a device that has seen a version has seen every one before it.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='+')
+    version = models.PositiveBigIntegerField(default=0)
+    # Changes up to pruned_version, all made before pruned_before, have been deleted
+    pruned_version = models.PositiveBigIntegerField(default=0)
+    pruned_before = models.DateTimeField(null=True, blank=True)
+    
+    def __str__(self):
+        return f"Kitchen feed {self.user_id} (v{self.version})"
+    
+    @classmethod
+    def claim_versions(cls, owner_id, count=1):
+        """The next count versions; call inside a transaction, which holds the feed lock until it ends"""
+        feed = cls.objects.select_for_update().filter(user_id=owner_id).first()
+        if feed is None:
+            try:
+                with transaction.atomic():
+                    cls.objects.create(user_id=owner_id)
+            except IntegrityError:
+                # Another transaction created it first
+                pass
+            feed = cls.objects.select_for_update().get(user_id=owner_id)
+        first = feed.version + 1
+        feed.version += count
+        cls.objects.filter(user_id=owner_id).update(version=feed.version)
+        return range(first, feed.version + 1)
+
+class KitchenOrderChange(models.Model):
+    """Append-only feed of kitchen order changes; a change's version is the restaurant's feed version after it"""
+    EVENT_CHOICES = [
+        ('created', 'Created'),
+        ('status', 'Status'),
+        ('item', 'Item status'),
+        ('finalized', 'Finalized'),
+        ('deleted', 'Deleted'),
+        ('archived', 'Archived'),
+    ]
+    
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    order_id = models.BigIntegerField()
+    event = models.CharField(max_length=20, choices=EVENT_CHOICES)
+    status = models.CharField(max_length=20, blank=True)
+    version = models.PositiveBigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'version'], name='kitchen_change_feed_idx'),
+            models.Index(fields=['user', 'created_at'], name='kitchen_change_time_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.event} order {self.order_id} (v{self.version})"
+    
+    @classmethod
+    def record(cls, owner_id, order_ids, event, status):
+        """Append one change per order under the next feed versions"""
+        with transaction.atomic():
+            versions = KitchenFeed.claim_versions(owner_id, len(order_ids))
+            return cls.objects.bulk_create([
+                cls(user_id=owner_id, order_id=order_id, event=event, status=status, version=version)
+                for order_id, version in zip(order_ids, versions)
+            ])
+
+class KitchenHourlyStats(models.Model):
+    """Hourly kitchen throughput rolled up from the change feed by rollup_kitchen_metrics"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    hour = models.DateTimeField()
+    # Blank is the whole kitchen
+    station = models.CharField(max_length=50, blank=True, default='')
+    orders_created = models.IntegerField(default=0)
+    orders_ready = models.IntegerField(default=0)
+    orders_completed = models.IntegerField(default=0)
+    queue_depth = models.IntegerField(default=0)
+    ready_p50_seconds = models.IntegerField(null=True, blank=True)
+    ready_p95_seconds = models.IntegerField(null=True, blank=True)
+    # Time-to-ready of each order that became ready in the hour, for percentiles over longer periods
+    ready_seconds = models.JSONField(default=list, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        unique_together = ['user', 'hour', 'station']
+        ordering = ['hour']
+    
+    def __str__(self):
+        return f"{self.user_id} {self.hour:%Y-%m-%d %H}:00 {self.station or 'kitchen'}"
 
 class KitchenOrderItem(models.Model):
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('preparing', 'Preparing'),
+        ('ready', 'Ready'),
+    ]
+    # The only line status moves transition() allows
+    TRANSITIONS = {
+        'pending': ['preparing', 'ready'],
+        'preparing': ['ready'],
+        'ready': [],
+    }
+    
     order = models.ForeignKey(KitchenOrder, related_name='items', on_delete=models.CASCADE)
+    menu_item = models.ForeignKey(MenuItem, on_delete=models.SET_NULL, null=True, blank=True, related_name='order_lines')
+    name = models.CharField(max_length=100)
+    quantity = models.IntegerField()
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+    total = models.DecimalField(max_digits=10, decimal_places=2)
+    unit_cost = models.DecimalField(max_digits=12, decimal_places=4, null=True, blank=True)
+    # Routed from the menu item when ordered; blank lines show on every display
+    station = models.CharField(max_length=50, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['station', 'order'], name='kitchen_item_station_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.name} x{self.quantity}"
+    
+    def can_transition(self, new_status):
+        return new_status in self.TRANSITIONS.get(self.status, [])
+    
+    def transition(self, new_status):
+        """Compare-and-set move of this line's status, carrying the order along with its lines.
+
+        The order starts preparing with its first line and is ready once every line is.
+        Returns False, with this instance reloaded, when another device moved the line first
+        or the order is no longer active.
+        """
+        with transaction.atomic():
+            order = KitchenOrder.objects.select_for_update().get(id=self.order_id)
+            if order.status not in KitchenOrder.ACTIVE_STATUSES:
+                self.refresh_from_db()
+                return False
+            updated = KitchenOrderItem.objects.filter(id=self.id, status=self.status).update(status=new_status)
+            if not updated:
+                self.refresh_from_db()
+                return False
+            self.status = new_status
+            
+            moved = False
+            if order.status == 'pending':
+                moved = order.transition('preparing')
+            if order.status == 'preparing' and not order.items.exclude(status='ready').exists():
+                moved = order.transition('ready')
+            if not moved:
+                order.record_change('item')
+        return True
+
+class IngredientConsumption(models.Model):
+    """Stock taken out for a completed kitchen order's recipes"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    order_id = models.BigIntegerField()
+    stock = models.ForeignKey('inventory.Stock', on_delete=models.CASCADE, related_name='consumptions')
+    quantity = models.DecimalField(max_digits=14, decimal_places=4)
+    # Whole units the recipe needed that were not in stock
+    shortfall = models.DecimalField(max_digits=14, decimal_places=4, default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['stock', 'created_at'], name='ingredient_usage_stock_idx'),
+            models.Index(fields=['user', 'order_id'], name='ingredient_usage_order_idx'),
+        ]
+    
+    def __str__(self):
+        return f"Order {self.order_id}: {self.quantity} of stock {self.stock_id}"
+
+class ArchivedKitchenOrder(models.Model):
+    """Served kitchen order moved out of the hot table by archive_kitchen_orders, keeping its original id"""
+    id = models.BigIntegerField(primary_key=True)
+    table_id = models.CharField(max_length=50)
+    table_name = models.CharField(max_length=100)
+    customer_name = models.CharField(max_length=100)
+    customer_phone = models.CharField(max_length=15)
+    total = models.DecimalField(max_digits=10, decimal_places=2)
+    status = models.CharField(max_length=20, choices=KitchenOrder.STATUS_CHOICES)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    chair_ids = models.JSONField(default=list, blank=True)
+    notes = models.TextField(blank=True, null=True)
+    economic_year = models.ForeignKey('authentication.EconomicYear', on_delete=models.CASCADE, related_name='+')
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', 'economic_year', 'created_at'], name='archived_order_tenant_idx'),
+        ]
+    
+    def __str__(self):
+        return f"Archived order {self.id} - {self.table_name}"
+
+class ArchivedKitchenOrderItem(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    order = models.ForeignKey(ArchivedKitchenOrder, related_name='items', on_delete=models.CASCADE)
     name = models.CharField(max_length=100)
     quantity = models.IntegerField()
     price = models.DecimalField(max_digits=10, decimal_places=2)
     total = models.DecimalField(max_digits=10, decimal_places=2)
+    unit_cost = models.DecimalField(max_digits=12, decimal_places=4, null=True, blank=True)
+    station = models.CharField(max_length=50, blank=True)
+    status = models.CharField(max_length=20, blank=True)
     
     def __str__(self):
         return f"{self.name} x{self.quantity}"
@@ -0,0 +1,130 @@
+import logging
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import DecimalField, ExpressionWrapper, F, Q, Value
+from django.db.models.functions import Round
+from django.utils import timezone
+
+from kcrm.caching import bump_tenant_version
+
+logger = logging.getLogger(__name__)
+
+# Years with more purchases than this are queued for run_repricing_jobs instead of repriced in the request
+REPRICE_BACKGROUND_THRESHOLD = 5000
+REPRICE_PREVIEW_LIMIT = 50
+# A job running longer than this is assumed to have lost its runner and is picked up again
+REPRICE_STALE_AFTER = timedelta(minutes=30)
+
+
+def margin_factor(profit_percentage):
+    return Decimal('1') + Decimal(str(profit_percentage)) / Decimal('100')
+
+
+def repriced(field, factor):
+    return Round(ExpressionWrapper(
+        F(field) * Value(factor, output_field=DecimalField(max_digits=12, decimal_places=6)),
+        output_field=DecimalField(max_digits=12, decimal_places=2)
+    ), 2)
+
+
+def repricing_querysets(owner_user, economic_year, mode):
+    from inventory.models import Purchase, Stock
+
+    purchases = Purchase.objects.filter(user=owner_user, economic_year=economic_year, mode=mode)
+    # Stocks without a known cost keep their manual selling price
+    stocks = Stock.objects.filter(user=owner_user, economic_year=economic_year, mode=mode, cost_price__gt=0)
+    return purchases, stocks
+
+
+def preview_repricing(owner_user, economic_year, mode, profit_percentage, limit=REPRICE_PREVIEW_LIMIT):
+    """Describe the purchases whose selling price a repricing would change, without writing"""
+    factor = margin_factor(profit_percentage)
+    purchases, stocks = repricing_querysets(owner_user, economic_year, mode)
+
+    changed = purchases.annotate(new_selling_price=repriced('unit_price', factor)).filter(
+        Q(selling_price__isnull=True) | ~Q(selling_price=F('new_selling_price'))
+    )
+    changed_stocks = stocks.annotate(new_selling_price=repriced('cost_price', factor)).exclude(
+        selling_price=F('new_selling_price')
+    )
+
+    return {
+        'changed_count': changed.count(),
+        'changed_stock_count': changed_stocks.count(),
+        'preview': [
+            {
+                'id': row['id'],
+                'product_name': row['product_name'],
+                'unit_price': float(row['unit_price']),
+                'selling_price': float(row['selling_price']) if row['selling_price'] is not None else None,
+                'new_selling_price': float(row['new_selling_price'])
+            } for row in changed.order_by('product_name', 'id').values(
+                'id', 'product_name', 'unit_price', 'selling_price', 'new_selling_price'
+            )[:limit]
+        ]
+    }
+
+
+def apply_repricing(owner_user, economic_year, mode, profit_percentage):
+    """Reprice purchases and stock with two set-based UPDATEs that bypass model save hooks.
+
+    Both run in one transaction, so stock never keeps old prices for repriced purchases.
+    """
+    from inventory.models import INVENTORY_NAMESPACE
+
+    factor = margin_factor(profit_percentage)
+    purchases, stocks = repricing_querysets(owner_user, economic_year, mode)
+    now = timezone.now()
+
+    with transaction.atomic():
+        updated_count = purchases.update(selling_price=repriced('unit_price', factor), updated_at=now)
+        stock_count = stocks.update(selling_price=repriced('cost_price', factor), updated_at=now)
+    # The UPDATEs skip the model hooks that normally invalidate cached inventory
+    bump_tenant_version(INVENTORY_NAMESPACE, owner_user.id)
+
+    return {'updated_count': updated_count, 'stock_count': stock_count}
+
+
+def queue_repricing(owner_user, economic_year, mode, profit_percentage):
+    """Record a repricing for run_repricing_jobs to pick up"""
+    from .models import RepricingJob
+
+    return RepricingJob.objects.create(
+        user=owner_user, economic_year=economic_year, mode=mode, percentage=Decimal(str(profit_percentage))
+    )
+
+
+def claim_repricing_job(stale_after=REPRICE_STALE_AFTER):
+    """Mark the oldest queued job, or one whose runner died mid-way, as running and return it"""
+    from .models import RepricingJob
+
+    stale = timezone.now() - stale_after
+    with transaction.atomic():
+        job = RepricingJob.objects.select_for_update().filter(
+            Q(status='queued') | Q(status='running', started_at__lt=stale)
+        ).order_by('created_at').first()
+        if job is None:
+            return None
+        job.status = 'running'
+        job.started_at = timezone.now()
+        job.save(update_fields=['status', 'started_at'])
+    return job
+
+
+def run_repricing_job(job):
+    """Apply a claimed job and record how it ended; the repricing is all or nothing, so a retry is safe"""
+    try:
+        result = apply_repricing(job.user, job.economic_year, job.mode, job.percentage)
+    except Exception as e:
+        logger.error(f"Repricing job {job.id} failed: {str(e)}")
+        job.status = 'failed'
+        job.error = str(e)
+    else:
+        job.status = 'completed'
+        job.updated_count = result['updated_count']
+        job.stock_count = result['stock_count']
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'error', 'updated_count', 'stock_count', 'finished_at'])
+    return job
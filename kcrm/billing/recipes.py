@@ -0,0 +1,82 @@
+import logging
+from decimal import ROUND_FLOOR
+
+from django.db import transaction
+from django.db.models import DecimalField, ExpressionWrapper, F, Sum
+from django.utils import timezone
+
+from inventory.models import INVENTORY_NAMESPACE, Stock
+from kcrm.caching import bump_tenant_version
+
+from .menu_stock import refresh_stock_menu_items
+from .models import IngredientConsumption, KitchenOrder, KitchenOrderItem
+
+logger = logging.getLogger(__name__)
+
+QUANTITY_FIELD = DecimalField(max_digits=14, decimal_places=4)
+
+
+def bill_of_materials(order_id):
+    """{stock_id: quantity} an order's lines use, exploded through MenuIngredient and summed in one query"""
+    rows = KitchenOrderItem.objects.filter(
+        order_id=order_id, menu_item__ingredients__isnull=False
+    ).values('menu_item__ingredients__ingredient').annotate(
+        quantity=Sum(ExpressionWrapper(
+            F('quantity') * F('menu_item__ingredients__quantity'), output_field=QUANTITY_FIELD
+        ))
+    ).order_by()
+    return {row['menu_item__ingredients__ingredient']: row['quantity'] for row in rows if row['quantity']}
+
+
+def consume_ingredients(order):
+    """Take a completed order's recipe ingredients out of stock, once.
+
+    The ingredients_consumed flag is claimed with a conditional UPDATE, so a retried or
+    concurrent completion does nothing. All stock rows change in one bulk UPDATE and each
+    ingredient is written to the consumption log. Stock is counted in whole units, so the
+    fraction of a unit used is carried on the stock until it adds up to one. Stock never goes
+    below zero; units the recipe needed beyond what was on hand are logged as the shortfall.
+    Returns {stock_id: quantity} consumed.
+    """
+    with transaction.atomic():
+        claimed = KitchenOrder.objects.filter(id=order.id, ingredients_consumed=False).update(ingredients_consumed=True)
+        if not claimed:
+            return {}
+        order.ingredients_consumed = True
+
+        needed = bill_of_materials(order.id)
+        if not needed:
+            return {}
+
+        now = timezone.now()
+        stocks = list(Stock.objects.select_for_update().filter(id__in=needed))
+        shortfalls = {}
+        status_changed = False
+        for stock in stocks:
+            used = stock.consumption_remainder + needed[stock.id]
+            units = int(used.to_integral_value(rounding=ROUND_FLOOR))
+            taken = min(units, max(stock.current_stock, 0))
+            if taken < units:
+                shortfalls[stock.id] = units - taken
+                logger.warning(f"Order {order.id} needed {units} {stock.unit} of {stock.product_name}, only {taken} in stock")
+            stock.current_stock -= taken
+            stock.consumption_remainder = used - units
+            status = stock.compute_status()
+            status_changed = status_changed or status != stock.status
+            stock.status = status
+            stock.updated_at = now
+        Stock.objects.bulk_update(stocks, ['current_stock', 'consumption_remainder', 'status', 'updated_at'])
+        refresh_stock_menu_items(list(needed))
+
+        IngredientConsumption.objects.bulk_create([
+            IngredientConsumption(
+                user_id=order.user_id, order_id=order.id, stock=stock,
+                quantity=needed[stock.id], shortfall=shortfalls.get(stock.id, 0)
+            )
+            for stock in stocks
+        ])
+
+    # Only low-stock counts are cached, so plain level changes keep the cache
+    if status_changed:
+        bump_tenant_version(INVENTORY_NAMESPACE, order.user_id)
+    return needed
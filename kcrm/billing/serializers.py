@@ -86,11 +86,12 @@ class MenuCategorySerializer(serializers.ModelSerializer):
 
 class MenuItemSerializer(serializers.ModelSerializer):
     category_name = serializers.CharField(source='category.name', read_only=True)
+    sold_out = serializers.BooleanField(read_only=True)
     
     class Meta:
         model = MenuItem
         fields = '__all__'
-        read_only_fields = ('user', 'economic_year', 'created_at', 'updated_at')
+        read_only_fields = ('user', 'economic_year', 'thumbnail', 'portions', 'cost', 'created_at', 'updated_at')
     
     def create(self, validated_data):
         owner_user = get_owner_user_from_context(self.context)
@@ -140,6 +141,8 @@ class KitchenOrderItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = KitchenOrderItem
         fields = '__all__'
+        # Line status only moves through the item_status transition
+        read_only_fields = ('unit_cost', 'status')
 
 class KitchenOrderSerializer(serializers.ModelSerializer):
     items = KitchenOrderItemSerializer(many=True, read_only=True)
@@ -147,7 +150,8 @@ class KitchenOrderSerializer(serializers.ModelSerializer):
     class Meta:
         model = KitchenOrder
         fields = '__all__'
-        read_only_fields = ('user', 'economic_year', 'created_at', 'updated_at')
+        # Status only moves through the status, complete and finalize_billing transitions
+        read_only_fields = ('user', 'economic_year', 'status', 'version', 'ingredients_consumed', 'created_at', 'updated_at')
     
     def to_representation(self, instance):
         data = super().to_representation(instance)
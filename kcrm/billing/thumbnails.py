@@ -0,0 +1,75 @@
+import logging
+import os
+import threading
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.db import connection, transaction
+from PIL import Image, ImageOps
+
+from kcrm.caching import bump_tenant_version
+
+from .models import MENU_NAMESPACE, MenuItem
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_SIZE = (320, 320)
+THUMBNAIL_QUALITY = 80
+
+
+def render_thumbnail(image_file):
+    """WebP bytes of the image scaled to fit THUMBNAIL_SIZE, upright and without metadata"""
+    with Image.open(image_file) as image:
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail(THUMBNAIL_SIZE)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'transparency' in image.info or image.mode in ('LA', 'PA') else 'RGB')
+        output = BytesIO()
+        image.save(output, 'WEBP', quality=THUMBNAIL_QUALITY, method=6)
+    return output.getvalue()
+
+
+def generate_thumbnail(menu_item_id):
+    """Make and attach the thumbnail for a menu item's current image.
+
+    The thumbnail is only attached if the image is unchanged by then; a newer upload
+    schedules its own. Returns the stored thumbnail name, or None.
+    """
+    menu_item = MenuItem.objects.filter(id=menu_item_id).only('id', 'user_id', 'image', 'thumbnail').first()
+    if menu_item is None or not menu_item.image:
+        return None
+
+    with menu_item.image.open('rb') as image_file:
+        content = render_thumbnail(image_file)
+    name = os.path.splitext(os.path.basename(menu_item.image.name))[0] + '.webp'
+    field = MenuItem._meta.get_field('thumbnail')
+    stored = field.storage.save(field.generate_filename(menu_item, name), ContentFile(content))
+
+    attached = MenuItem.objects.filter(id=menu_item_id, image=menu_item.image.name).update(thumbnail=stored)
+    if not attached:
+        field.storage.delete(stored)
+        return None
+    if menu_item.thumbnail and menu_item.thumbnail.name != stored:
+        field.storage.delete(menu_item.thumbnail.name)
+    bump_tenant_version(MENU_NAMESPACE, menu_item.user_id)
+    return stored
+
+
+def schedule_thumbnail(menu_item_id):
+    """Generate a menu item's thumbnail on a worker thread once the upload is committed.
+
+    The thread dies with its process, so a restart can drop a pending thumbnail; the
+    catalog falls back to the full image and generate_menu_thumbnails fills the gap.
+    """
+    def run():
+        try:
+            generate_thumbnail(menu_item_id)
+        except Exception as e:
+            logger.error(f"Thumbnail for menu item {menu_item_id} failed: {str(e)}")
+        finally:
+            connection.close()
+
+    transaction.on_commit(
+        lambda: threading.Thread(target=run, name=f'thumbnail-{menu_item_id}', daemon=True).start(),
+        robust=True
+    )
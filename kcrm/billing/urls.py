@@ -2,7 +2,7 @@ from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import CustomerViewSet, SaleViewSet, StockViewSet, ProfitPercentageViewSet, MenuCategoryViewSet, MenuItemViewSet
 from .table_views import TableSystemViewSet
-from .kitchen_views import KitchenOrderViewSet
+from .kitchen_views import KitchenOrderViewSet, kitchen_events, kitchen_changes
 
 
 router = DefaultRouter()
@@ -17,5 +17,7 @@ router.register(r'kitchen-orders', KitchenOrderViewSet)
 
 
 urlpatterns = [
+    path('kitchen-orders/events/', kitchen_events, name='kitchen_events'),
+    path('kitchen-orders/changes/', kitchen_changes, name='kitchen_changes'),
     path('', include(router.urls)),
 ]
\ No newline at end of file
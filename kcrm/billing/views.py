@@ -3,19 +3,30 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from django.db import transaction, models
 from django.utils import timezone
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags
 from datetime import datetime, timedelta
-from decimal import Decimal
+from decimal import Decimal, InvalidOperation
 import uuid
 import json
+import re
 
-from .models import Customer, Sale, SaleItem, ProfitPercentage, MenuCategory, MenuItem, MenuIngredient, KitchenOrder, KitchenOrderItem
+from .models import Customer, Sale, SaleItem, ProfitPercentage, MenuCategory, MenuItem, MenuIngredient, KitchenOrder, KitchenOrderItem, CUSTOMER_SEARCH_NAMESPACE
+from .catalog import absolute_catalog, cached_menu_catalog, CATALOG_MAX_AGE
+from .pricing import (
+    REPRICE_BACKGROUND_THRESHOLD, margin_factor, repricing_querysets, preview_repricing,
+    apply_repricing, queue_repricing
+)
 from .serializers import (
     CustomerSerializer, SaleSerializer, 
     POSCreateSerializer, MenuCategorySerializer, MenuItemSerializer, MenuIngredientSerializer,
     KitchenOrderSerializer, StockSerializer
 )
 from inventory.models import Stock, Category, Supplier, Purchase
+from inventory.valuation import stock_value
 from staff.models import Staff
+from kcrm.pagination import KeysetPagination
+from kcrm.singleflight import single_flight, flight_key
 
 def get_owner_user(request):
     """Get the shop owner user for staff or return the user itself for shop owners"""
@@ -27,9 +38,72 @@ def get_owner_user(request):
             return request.user
     return request.user
 
+CUSTOMER_AUTOCOMPLETE_TTL = 60
+CUSTOMER_AUTOCOMPLETE_LIMIT = 8
+
+def annotate_credit_balance(queryset):
+    """Annotate each customer's outstanding credit (credit sales minus collections) as subqueries"""
+    from django.db.models import OuterRef, Subquery, Sum, Value, DecimalField
+    from django.db.models.functions import Coalesce
+    
+    credit_sales = Sale.objects.filter(
+        customer=OuterRef('pk'),
+        payment_method='credit'
+    ).order_by().values('customer').annotate(total=Sum('credit_amount')).values('total')
+    
+    credit_collections = Sale.objects.filter(
+        customer=OuterRef('pk'),
+        payment_method='credit_collection'
+    ).order_by().values('customer').annotate(total=Sum('amount_paid')).values('total')
+    
+    zero = Value(Decimal('0'), output_field=DecimalField(max_digits=12, decimal_places=2))
+    return queryset.annotate(
+        credit_balance=Coalesce(Subquery(credit_sales, output_field=DecimalField(max_digits=12, decimal_places=2)), zero) -
+                       Coalesce(Subquery(credit_collections, output_field=DecimalField(max_digits=12, decimal_places=2)), zero)
+    )
+
+def find_customer_by_phone(owner_user, economic_year, mode, phone):
+    """Match an existing customer however the cashier typed the phone number"""
+    from inventory.search import normalize_phone
+    
+    normalized = normalize_phone(phone)
+    if not normalized:
+        return None
+    return Customer.objects.filter(
+        user=owner_user,
+        economic_year=economic_year,
+        mode=mode,
+        normalized_phone=normalized
+    ).order_by('id').first()
+
+def line_menu_item_id(item):
+    menu_item_id = str(item.get('menu_item_id') or item.get('menu_item') or '')
+    return int(menu_item_id) if menu_item_id.isdigit() else None
+
+def resolve_menu_items(owner_user, economic_year, items):
+    """Match POS lines to the owner's menu items by menu_item_id, else by name, in one query.
+
+    Returns {line index: MenuItem} for the lines that matched.
+    """
+    names = [item.get('product_name', item.get('name', '')) for item in items]
+    ids = [line_menu_item_id(item) for item in items]
+    menu_items = list(MenuItem.objects.filter(user=owner_user, economic_year=economic_year).select_related('category').filter(
+        models.Q(id__in=[menu_item_id for menu_item_id in ids if menu_item_id]) | models.Q(name__in=names)
+    ))
+    by_id = {menu_item.id: menu_item for menu_item in menu_items}
+    by_name = {menu_item.name: menu_item for menu_item in menu_items}
+    
+    matched = {}
+    for index, (menu_item_id, name) in enumerate(zip(ids, names)):
+        menu_item = by_id.get(menu_item_id) or by_name.get(name)
+        if menu_item:
+            matched[index] = menu_item
+    return matched
+
 class CustomerViewSet(viewsets.ModelViewSet):
     queryset = Customer.objects.all()
     serializer_class = CustomerSerializer
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
         from authentication.models import EconomicYear
@@ -57,26 +131,78 @@ class CustomerViewSet(viewsets.ModelViewSet):
         return queryset.order_by('-created_at')
     
     def list(self, request, *args, **kwargs):
-        queryset = self.get_queryset()
-        serializer = self.get_serializer(queryset, many=True)
+        queryset = annotate_credit_balance(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        customers = page if page is not None else queryset
+        serializer = self.get_serializer(customers, many=True)
         data = serializer.data
         
         # Add credit balance for each customer
-        for customer_data in data:
-            customer_id = customer_data['id']
-            credit_sales = Sale.objects.filter(
-                customer_id=customer_id,
-                payment_method='credit'
-            ).aggregate(total_credit=models.Sum('credit_amount'))['total_credit'] or 0
+        for customer, customer_data in zip(customers, data):
+            customer_data['credit_balance'] = float(customer.credit_balance)
+        
+        if page is not None:
+            return self.get_paginated_response(data)
+        return Response(data)
+    
+    @action(detail=False, methods=['get'])
+    def autocomplete(self, request):
+        """Top customers for a POS phone or name prefix, with credit and loyalty in one query"""
+        from authentication.models import EconomicYear
+        from django.core.cache import cache
+        from inventory.search import normalize_phone, normalize_search_key, rank_by_search
+        from kcrm.caching import get_tenant_version, tenant_key
+        
+        owner_user = get_owner_user(request)
+        try:
+            active_eco_year = EconomicYear.objects.get(user=owner_user, is_active=True)
+        except EconomicYear.DoesNotExist:
+            return Response({'success': True, 'results': []})
+        
+        query = request.query_params.get('q', '').strip()
+        mode = request.query_params.get('mode')
+        try:
+            limit = min(max(int(request.query_params.get('limit', CUSTOMER_AUTOCOMPLETE_LIMIT)), 1), 50)
+        except ValueError:
+            limit = CUSTOMER_AUTOCOMPLETE_LIMIT
+        
+        is_phone = bool(re.fullmatch(r'[\d\s+()-]+', query))
+        key = normalize_phone(query) if is_phone else normalize_search_key(query)
+        if not key:
+            return Response({'success': True, 'results': []})
+        
+        cache_key = tenant_key(
+            CUSTOMER_SEARCH_NAMESPACE, owner_user.id,
+            get_tenant_version(CUSTOMER_SEARCH_NAMESPACE, owner_user.id),
+            active_eco_year.id, mode or 'all', 'phone' if is_phone else 'name', key, limit
+        )
+        results = cache.get(cache_key)
+        
+        if results is None:
+            customers = Customer.objects.filter(user=owner_user, economic_year=active_eco_year)
+            if mode:
+                customers = customers.filter(mode=mode)
             
-            credit_collections = Sale.objects.filter(
-                customer_id=customer_id,
-                payment_method='credit_collection'
-            ).aggregate(total_collected=models.Sum('amount_paid'))['total_collected'] or 0
+            if is_phone:
+                customers = customers.filter(normalized_phone__startswith=key).order_by('normalized_phone', 'id')
+            else:
+                customers = rank_by_search(customers, owner_user, active_eco_year, mode, query, 'name', kinds=('prefix',))
             
-            customer_data['credit_balance'] = float(credit_sales) - float(credit_collections)
+            results = [
+                {
+                    'id': customer.id,
+                    'name': customer.name,
+                    'phone': customer.phone,
+                    'email': customer.email,
+                    'mode': customer.mode,
+                    'loyalty_points': customer.loyalty_points or 0,
+                    'total_spent': float(customer.total_spent),
+                    'credit_balance': float(customer.credit_balance)
+                } for customer in annotate_credit_balance(customers)[:limit]
+            ]
+            cache.set(cache_key, results, CUSTOMER_AUTOCOMPLETE_TTL)
         
-        return Response(data)
+        return Response({'success': True, 'results': results})
     
     def perform_create(self, serializer):
         from authentication.models import EconomicYear
@@ -324,6 +450,7 @@ class CustomerViewSet(viewsets.ModelViewSet):
 class SaleViewSet(viewsets.ModelViewSet):
     queryset = Sale.objects.all()
     serializer_class = SaleSerializer
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
         from authentication.models import EconomicYear
@@ -442,29 +569,37 @@ class SaleViewSet(viewsets.ModelViewSet):
                             economic_year=active_eco_year
                         )
                         
-                        # Create KitchenOrderItem objects
-                        for item in data['items']:
-                            KitchenOrderItem.objects.create(
+                        # Create KitchenOrderItem objects linked to their menu items for recipe costing
+                        menu_items = resolve_menu_items(owner_user, active_eco_year, data['items'])
+                        KitchenOrderItem.objects.bulk_create([
+                            KitchenOrderItem(
                                 order=kitchen_order,
+                                menu_item=menu_items.get(index),
                                 name=item.get('product_name', item.get('name', 'Unknown Item')),
                                 quantity=int(item['quantity']),
                                 price=Decimal(str(item.get('unit_price', item.get('price', 0)))),
-                                total=Decimal(str(item.get('total_price', item.get('total', 0))))
-                            )
+                                total=Decimal(str(item.get('total_price', item.get('total', 0)))),
+                                unit_cost=menu_items[index].cost if index in menu_items else None,
+                                station=menu_items[index].kitchen_station if index in menu_items else ''
+                            ) for index, item in enumerate(data['items'])
+                        ])
                         
                         # Update customer statistics for restaurant mode too
                         if data.get('customer_phone') and data.get('customer_phone') != '0000000000':
                             try:
-                                customer, created = Customer.objects.get_or_create(
-                                    phone=data.get('customer_phone'),
-                                    user=owner_user,
-                                    economic_year=active_eco_year,
-                                    mode='restaurant',
-                                    defaults={
-                                        'name': data.get('customer_name', 'Walk-in Customer'),
-                                        'status': 'active'
-                                    }
-                                )
+                                customer = find_customer_by_phone(owner_user, active_eco_year, 'restaurant', data.get('customer_phone'))
+                                created = False
+                                if customer is None:
+                                    customer, created = Customer.objects.get_or_create(
+                                        phone=data.get('customer_phone'),
+                                        user=owner_user,
+                                        economic_year=active_eco_year,
+                                        mode='restaurant',
+                                        defaults={
+                                            'name': data.get('customer_name', 'Walk-in Customer'),
+                                            'status': 'active'
+                                        }
+                                    )
                                 if not created and data.get('customer_name'):
                                     customer.name = data.get('customer_name')
                                 
@@ -492,16 +627,19 @@ class SaleViewSet(viewsets.ModelViewSet):
                         customer = None
                         if data.get('customer_phone') and data.get('customer_phone') != '0000000000':
                             try:
-                                customer, created = Customer.objects.get_or_create(
-                                    phone=data.get('customer_phone'),
-                                    user=owner_user,
-                                    economic_year=active_eco_year,
-                                    mode=data.get('mode', 'kirana'),
-                                    defaults={
-                                        'name': data.get('customer_name', 'Walk-in Customer'),
-                                        'status': 'active'
-                                    }
-                                )
+                                customer = find_customer_by_phone(owner_user, active_eco_year, data.get('mode', 'kirana'), data.get('customer_phone'))
+                                created = False
+                                if customer is None:
+                                    customer, created = Customer.objects.get_or_create(
+                                        phone=data.get('customer_phone'),
+                                        user=owner_user,
+                                        economic_year=active_eco_year,
+                                        mode=data.get('mode', 'kirana'),
+                                        defaults={
+                                            'name': data.get('customer_name', 'Walk-in Customer'),
+                                            'status': 'active'
+                                        }
+                                    )
                                 if not created and data.get('customer_name'):
                                     customer.name = data.get('customer_name')
                                     customer.save()
@@ -559,7 +697,8 @@ class SaleViewSet(viewsets.ModelViewSet):
                                     product_name=item.get('product_name', stock.product_name),
                                     quantity=Decimal(str(item['quantity'])),
                                     unit_price=Decimal(str(item.get('unit_price', 0))),
-                                    total_price=Decimal(str(item.get('total_price', 0)))
+                                    total_price=Decimal(str(item.get('total_price', 0))),
+                                    unit_cost=stock.unit_cost
                                 )
                                 
                                 # Update stock
@@ -602,45 +741,52 @@ class SaleViewSet(viewsets.ModelViewSet):
 
     @action(detail=False, methods=['get'])
     def dashboard_stats(self, request):
+        owner_user = get_owner_user(request)
+        mode_filter = request.query_params.get('mode', 'kirana')
+        today = timezone.now().date()
+        
+        # Terminals refreshing together share one computation
+        data = single_flight(
+            flight_key('sales_dashboard', owner_user.id, mode_filter, today),
+            lambda: self.compute_dashboard_stats(owner_user, mode_filter, today)
+        )
+        return Response({
+            'success': True,
+            'data': data
+        })
+
+    def compute_dashboard_stats(self, owner_user, mode_filter, today):
         from authentication.models import EconomicYear
         try:
-            owner_user = get_owner_user(request)
             active_eco_year = EconomicYear.objects.get(user=owner_user, is_active=True)
-            today = timezone.now().date()
-            
-            mode_filter = request.query_params.get('mode', 'kirana')
-            today_sales = Sale.objects.filter(
-                cashier=owner_user, 
-                economic_year=active_eco_year,
-                created_at__date=today
-            )
-            
-            if mode_filter:
-                today_sales = today_sales.filter(mode=mode_filter)
-            
-            today_total = sum(sale.total for sale in today_sales)
-            today_orders = today_sales.count()
-            avg_order = float(today_total / today_orders) if today_orders > 0 else 0
-            
-            return Response({
-                'success': True,
-                'data': {
-                    'todaySales': float(today_total),
-                    'todayOrders': today_orders,
-                    'avgOrderValue': avg_order,
-                    'activeOrders': 0
-                }
-            })
         except EconomicYear.DoesNotExist:
-            return Response({
-                'success': True,
-                'data': {
-                    'todaySales': 0,
-                    'todayOrders': 0,
-                    'avgOrderValue': 0,
-                    'activeOrders': 0
-                }
-            })
+            return {
+                'todaySales': 0,
+                'todayOrders': 0,
+                'avgOrderValue': 0,
+                'activeOrders': 0
+            }
+        
+        today_sales = Sale.objects.filter(
+            cashier=owner_user, 
+            economic_year=active_eco_year,
+            created_at__date=today
+        )
+        
+        if mode_filter:
+            today_sales = today_sales.filter(mode=mode_filter)
+        
+        totals = today_sales.aggregate(total=models.Sum('total'), orders=models.Count('id'))
+        today_total = totals['total'] or 0
+        today_orders = totals['orders']
+        avg_order = float(today_total / today_orders) if today_orders > 0 else 0
+        
+        return {
+            'todaySales': float(today_total),
+            'todayOrders': today_orders,
+            'avgOrderValue': avg_order,
+            'activeOrders': 0
+        }
 
     @action(detail=False, methods=['get'])
     def reports(self, request):
@@ -760,7 +906,8 @@ class StockViewSet(viewsets.ModelViewSet):
             # Apply search filter if provided
             search = request.query_params.get('search', None)
             if search:
-                stocks = stocks.filter(product_name__icontains=search)
+                from inventory.search import rank_by_search
+                stocks = rank_by_search(stocks, owner_user, active_eco_year, None, search, 'product_name')
             
             data = []
             for stock in stocks:
@@ -857,7 +1004,6 @@ class StockViewSet(viewsets.ModelViewSet):
     def inventory_status(self, request):
         try:
             from authentication.models import EconomicYear
-            from inventory.models import Purchase
             
             try:
                 owner_user = get_owner_user(request)
@@ -871,20 +1017,10 @@ class StockViewSet(viewsets.ModelViewSet):
             low_stock_items = []
             out_of_stock_items = []
             
-            total_value = 0
+            total_value = float(stock_value(stocks))
             
             for stock in stocks:
                 try:
-                    # Calculate value from purchases
-                    purchase = Purchase.objects.filter(
-                        product_name=stock.product_name,
-                        user=owner_user,
-                        economic_year=active_eco_year
-                    ).order_by('-created_at').first()
-                    
-                    if purchase:
-                        total_value += float(purchase.unit_price) * stock.current_stock
-                    
                     if stock.current_stock == 0:
                         out_of_stock_items.append(stock)
                     elif stock.current_stock <= stock.min_stock:
@@ -955,10 +1091,38 @@ class MenuCategoryViewSet(viewsets.ModelViewSet):
         owner_user = get_owner_user(self.request)
         active_eco_year = EconomicYear.objects.get(user=owner_user, is_active=True)
         serializer.save(user=owner_user, economic_year=active_eco_year)
+    
+    @action(detail=False, methods=['get'])
+    def catalog(self, request):
+        """The POS menu in one response: active categories with their available items and thumbnails"""
+        from authentication.models import EconomicYear
+        owner_user = get_owner_user(request)
+        mode = request.query_params.get('mode', 'restaurant')
+        try:
+            active_eco_year = EconomicYear.objects.get(user=owner_user, is_active=True)
+        except EconomicYear.DoesNotExist:
+            return Response({
+                'success': False,
+                'message': 'No active economic year found'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        entry = cached_menu_catalog(owner_user, active_eco_year, mode)
+        if entry['etag'] in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response({
+                'success': True,
+                'data': absolute_catalog(entry['data'], request.build_absolute_uri)
+            })
+        response['ETag'] = entry['etag']
+        patch_cache_control(response, private=True, max_age=CATALOG_MAX_AGE)
+        return response
 
 class MenuItemViewSet(viewsets.ModelViewSet):
     queryset = MenuItem.objects.all()
     serializer_class = MenuItemSerializer
+    pagination_class = KeysetPagination
+    keyset_ordering = ('name', 'id')
     
     def get_serializer_context(self):
         context = super().get_serializer_context()
@@ -970,7 +1134,7 @@ class MenuItemViewSet(viewsets.ModelViewSet):
         try:
             owner_user = get_owner_user(self.request)
             active_eco_year = EconomicYear.objects.get(user=owner_user, is_active=True)
-            queryset = MenuItem.objects.filter(user=owner_user, economic_year=active_eco_year)
+            queryset = MenuItem.objects.filter(user=owner_user, economic_year=active_eco_year).select_related('category')
         except EconomicYear.DoesNotExist:
             queryset = MenuItem.objects.none()
         
@@ -1199,6 +1363,24 @@ class ProfitPercentageViewSet(viewsets.ViewSet):
                 'message': str(e)
             }, status=500)
     
+    @action(detail=False, methods=['get'])
+    def reprice_status(self, request):
+        from .models import RepricingJob
+        job_id = request.query_params.get('job_id', '')
+        job = RepricingJob.objects.select_related('economic_year').filter(
+            id=job_id, user=request.user
+        ).first() if job_id.isdigit() else None
+        if not job:
+            return Response({
+                'success': False,
+                'message': 'Repricing job not found'
+            }, status=404)
+        
+        return Response({
+            'success': True,
+            'data': job.as_dict()
+        })
+    
     @action(detail=False, methods=['post'])
     def update_selling_prices(self, request):
         try:
@@ -1233,22 +1415,42 @@ class ProfitPercentageViewSet(viewsets.ViewSet):
                         'message': 'No active economic year found'
                     }, status=404)
             
-            # Filter purchases by mode if needed (assuming purchases have mode field)
-            purchases = Purchase.objects.filter(user=request.user, economic_year=economic_year)
-            if hasattr(Purchase, 'mode'):
-                purchases = purchases.filter(mode=mode)
+            try:
+                margin_factor(profit_percentage)
+            except (InvalidOperation, ValueError, TypeError):
+                return Response({
+                    'success': False,
+                    'message': 'Profit percentage must be a number'
+                }, status=400)
+            
+            dry_run = str(request.data.get('dry_run', '')).lower() in ('1', 'true', 'yes')
+            if dry_run:
+                preview = preview_repricing(request.user, economic_year, mode, profit_percentage)
+                return Response({
+                    'success': True,
+                    'dry_run': True,
+                    'message': f'{preview["changed_count"]} products would be repriced for {mode} mode in {economic_year.name}',
+                    **preview
+                })
+            
+            purchases, _ = repricing_querysets(request.user, economic_year, mode)
+            if purchases.count() > REPRICE_BACKGROUND_THRESHOLD:
+                job = queue_repricing(request.user, economic_year, mode, profit_percentage)
+                return Response({
+                    'success': True,
+                    'message': f'Repricing {mode} mode in {economic_year.name} in the background',
+                    'job_id': job.id,
+                    'status': job.status
+                }, status=202)
             
-            updated_count = 0
-            for purchase in purchases:
-                new_selling_price = float(purchase.unit_price) * (1 + float(profit_percentage) / 100)
-                purchase.selling_price = new_selling_price
-                purchase.save()
-                updated_count += 1
+            result = apply_repricing(request.user, economic_year, mode, profit_percentage)
+            updated_count = result['updated_count']
             
             return Response({
                 'success': True,
                 'message': f'Updated {updated_count} products for {mode} mode in {economic_year.name}',
-                'updated_count': updated_count
+                'updated_count': updated_count,
+                'stock_count': result['stock_count']
             })
         except Exception as e:
             return Response({
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from billing.models import Customer, CustomerSearchTerm
+from inventory.models import Stock
+from inventory.search import index_objects, index_stocks, normalize_phone
+
+
+class Command(BaseCommand):
+    help = 'Rebuild product and customer search terms and normalized customer phones'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        stock_ids = list(Stock.objects.order_by('id').values_list('id', flat=True))
+        for start in range(0, len(stock_ids), batch_size):
+            index_stocks(Stock.objects.filter(id__in=stock_ids[start:start + batch_size]))
+        self.stdout.write(f'Indexed {len(stock_ids)} products')
+
+        customer_ids = list(Customer.objects.order_by('id').values_list('id', flat=True))
+        for start in range(0, len(customer_ids), batch_size):
+            customers = list(Customer.objects.filter(id__in=customer_ids[start:start + batch_size]))
+            for customer in customers:
+                customer.normalized_phone = normalize_phone(customer.phone)
+            Customer.objects.bulk_update(customers, ['normalized_phone'])
+            index_objects(CustomerSearchTerm, customers, lambda customer: customer.name, kinds=('prefix',))
+        self.stdout.write(self.style.SUCCESS(f'Indexed {len(customer_ids)} customers'))
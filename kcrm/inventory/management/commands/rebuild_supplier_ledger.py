@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from inventory.models import Supplier
+
+
+class Command(BaseCommand):
+    help = 'Recalculate paid, pending and partial supplier totals and outstanding days from purchases'
+
+    def handle(self, *args, **options):
+        count = 0
+        for supplier in Supplier.objects.iterator():
+            supplier.recalculate_totals()
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt ledger for {count} suppliers'))
@@ -1,9 +1,14 @@
-from django.db import models
+from django.db import IntegrityError, models, transaction
 from django.contrib.auth import get_user_model
 from authentication.models import EconomicYear
+from kcrm.caching import bump_tenant_version
+from kcrm.counts import adjust_count, record_deleted
 
 User = get_user_model()
 
+# Version namespace for cached inventory aggregates, bumped whenever inventory rows change
+INVENTORY_NAMESPACE = 'inventory'
+
 class Category(models.Model):
     MODE_CHOICES = [
         ('kirana', 'Kirana'),
@@ -26,6 +31,23 @@ class Category(models.Model):
 
     def __str__(self):
         return f"{self.name} - {self.economic_year.name}"
+    
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        super().save(*args, **kwargs)
+        if adding:
+            adjust_count(self._meta.label, self.user_id, self.economic_year_id, self.mode, 1)
+            bump_tenant_version(INVENTORY_NAMESPACE, self.user_id)
+    
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            # The cascade removes purchases without Purchase.delete, so take them off the ledger here
+            deltas = removed_ledger_deltas(self.purchases.all())
+            result = super().delete(*args, **kwargs)
+            apply_ledger_deltas(deltas)
+        record_deleted(self.user_id, self.economic_year_id, self.mode, result[1])
+        bump_tenant_version(INVENTORY_NAMESPACE, self.user_id)
+        return result
 
 class Supplier(models.Model):
     MODE_CHOICES = [
@@ -39,6 +61,9 @@ class Supplier(models.Model):
     address = models.TextField()
     categories = models.JSONField(default=list, blank=True)
     total_payments = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    paid_total = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    pending_total = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    partial_total = models.DecimalField(max_digits=12, decimal_places=2, default=0)
     status = models.CharField(max_length=20, choices=[('Active', 'Active'), ('Inactive', 'Inactive')], default='Active')
     mode = models.CharField(max_length=20, choices=MODE_CHOICES, default='kirana')
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -52,6 +77,121 @@ class Supplier(models.Model):
 
     def __str__(self):
         return f"{self.name} - {self.status}"
+    
+    def save(self, *args, **kwargs):
+        # Ledger totals only move through F() deltas, so a stale instance must not write them back
+        adding = self._state.adding
+        if not adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in LEDGER_PROTECTED_FIELDS
+            ]
+        super().save(*args, **kwargs)
+        if adding:
+            adjust_count(self._meta.label, self.user_id, self.economic_year_id, self.mode, 1)
+            bump_tenant_version(INVENTORY_NAMESPACE, self.user_id)
+    
+    def recalculate_totals(self):
+        """Rebuild the payable ledger, totals and outstanding days, from this supplier's purchases"""
+        totals = self.purchases.aggregate(**{
+            field: models.Sum('total_amount', filter=models.Q(payment_status=payment_status))
+            for payment_status, field in LEDGER_FIELDS.items()
+        })
+        days = self.purchases.filter(payment_status__in=OUTSTANDING_STATUSES).values('purchase_date').annotate(
+            outstanding=models.Sum('total_amount')
+        ).filter(outstanding__gt=0).order_by()
+        with transaction.atomic():
+            for field in LEDGER_FIELDS.values():
+                setattr(self, field, totals[field] or 0)
+            self.total_payments = self.paid_total
+            self.save(update_fields=list(LEDGER_FIELDS.values()) + ['total_payments', 'updated_at'])
+            self.payable_days.all().delete()
+            SupplierPayableDay.objects.bulk_create([
+                SupplierPayableDay(supplier=self, purchase_date=day['purchase_date'], outstanding=day['outstanding'])
+                for day in days
+            ])
+    
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        record_deleted(self.user_id, self.economic_year_id, self.mode, result[1])
+        bump_tenant_version(INVENTORY_NAMESPACE, self.user_id)
+        return result
+
+class SupplierPayableDay(models.Model):
+    """What a supplier is still owed for one purchase date, kept alongside the supplier totals"""
+    supplier = models.ForeignKey(Supplier, on_delete=models.CASCADE, related_name='payable_days')
+    purchase_date = models.DateField()
+    outstanding = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        unique_together = ['supplier', 'purchase_date']
+
+    def __str__(self):
+        return f"{self.supplier_id} {self.purchase_date}: {self.outstanding}"
+
+    @classmethod
+    def adjust(cls, supplier_id, purchase_date, amount):
+        """Add amount to a day's outstanding with an atomic F() update, creating the row on first use"""
+        rows = cls.objects.filter(supplier_id=supplier_id, purchase_date=purchase_date)
+        if not rows.update(outstanding=models.F('outstanding') + amount):
+            try:
+                with transaction.atomic():
+                    cls.objects.create(supplier_id=supplier_id, purchase_date=purchase_date, outstanding=amount)
+            except IntegrityError:
+                # Another transaction created it first
+                rows.update(outstanding=models.F('outstanding') + amount)
+        if amount < 0:
+            rows.filter(outstanding=0).delete()
+
+LEDGER_FIELDS = {
+    'paid': 'paid_total',
+    'pending': 'pending_total',
+    'partial': 'partial_total'
+}
+
+# Payment statuses that still count towards what a supplier is owed
+OUTSTANDING_STATUSES = ('pending', 'partial')
+
+LEDGER_PROTECTED_FIELDS = set(LEDGER_FIELDS.values()) | {'total_payments'}
+
+def apply_ledger_deltas(deltas):
+    """Apply {supplier_id: {(payment_status, purchase_date): amount}} changes to supplier totals and
+    outstanding days with atomic F() updates"""
+    for supplier_id, amounts in deltas.items():
+        totals = {}
+        days = {}
+        for (payment_status, purchase_date), amount in amounts.items():
+            field = LEDGER_FIELDS.get(payment_status)
+            if not field or not amount:
+                continue
+            totals[field] = totals.get(field, 0) + amount
+            if payment_status in OUTSTANDING_STATUSES:
+                days[purchase_date] = days.get(purchase_date, 0) + amount
+        if totals.get('paid_total'):
+            totals['total_payments'] = totals['paid_total']
+        updates = {field: models.F(field) + amount for field, amount in totals.items() if amount}
+        if updates:
+            Supplier.objects.filter(pk=supplier_id).update(**updates)
+        for purchase_date, amount in days.items():
+            if amount:
+                SupplierPayableDay.adjust(supplier_id, purchase_date, amount)
+
+def add_ledger_delta(deltas, supplier_id, payment_status, purchase_date, amount):
+    bucket = deltas.setdefault(supplier_id, {})
+    key = (payment_status, purchase_date)
+    bucket[key] = bucket.get(key, 0) + amount
+
+def removed_ledger_deltas(purchases):
+    """Ledger deltas that take a queryset of purchases off their suppliers' totals, in one grouped query"""
+    deltas = {}
+    rows = purchases.values('supplier_id', 'payment_status', 'purchase_date').annotate(
+        amount=models.Sum('total_amount')
+    ).order_by()
+    for row in rows:
+        add_ledger_delta(deltas, row['supplier_id'], row['payment_status'], row['purchase_date'], -row['amount'])
+    return deltas
+
+STOCK_AGGREGATE_FIELDS = ('product_name', 'category_id', 'supplier_id', 'status', 'mode', 'economic_year_id')
 
 class Stock(models.Model):
     STATUS_CHOICES = [
@@ -74,6 +214,9 @@ class Stock(models.Model):
     max_stock = models.IntegerField(default=100)
     cost_price = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     selling_price = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    average_cost = models.DecimalField(max_digits=12, decimal_places=4, default=0)
+    # Fraction of a unit used by recipes but not yet taken off current_stock
+    consumption_remainder = models.DecimalField(max_digits=8, decimal_places=4, default=0)
     category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, blank=True)
     supplier = models.ForeignKey(Supplier, on_delete=models.SET_NULL, null=True, blank=True)
     barcode = models.CharField(max_length=100, blank=True, null=True)
@@ -87,21 +230,117 @@ class Stock(models.Model):
     class Meta:
         unique_together = ['product_name', 'user', 'economic_year', 'mode']
         ordering = ['-updated_at']
+        indexes = [
+            models.Index(fields=['user', 'economic_year', 'mode', 'updated_at'], name='stock_list_updated_idx'),
+            models.Index(fields=['user', 'economic_year', 'mode', 'product_name'], name='stock_list_name_idx'),
+            models.Index(fields=['user', 'economic_year', 'mode', 'current_stock'], name='stock_list_level_idx'),
+            models.Index(fields=['user', 'economic_year', 'mode', 'status'], name='stock_list_status_idx'),
+        ]
 
     def __str__(self):
         return f"{self.product_name} - {self.current_stock} {self.unit}"
     
-    def update_status(self):
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._indexed_key = (instance.__dict__.get('product_name'), instance.__dict__.get('mode'))
+        instance._loaded_recipe_inputs = instance.recipe_inputs()
+        instance._loaded_aggregate_inputs = instance.aggregate_inputs()
+        return instance
+    
+    def recipe_inputs(self):
+        """The fields menu item portions and costs are derived from"""
+        return tuple(self.__dict__.get(name) for name in ('current_stock', 'consumption_remainder', 'average_cost', 'cost_price'))
+    
+    def aggregate_inputs(self):
+        """The fields cached inventory aggregates read; a stock level change alone leaves them valid"""
+        return tuple(self.__dict__.get(name) for name in STOCK_AGGREGATE_FIELDS)
+    
+    @property
+    def unit_cost(self):
+        return self.average_cost or self.cost_price
+    
+    def receive(self, quantity, unit_cost):
+        """Add received units, folding their cost into the moving average"""
+        from .valuation import add_to_average
+        self.average_cost = add_to_average(self.current_stock, self.unit_cost, quantity, unit_cost)
+        self.current_stock += quantity
+    
+    def save(self, *args, **kwargs):
+        if not self.average_cost and self.cost_price:
+            self.average_cost = self.cost_price
+        adding = self._state.adding
+        reindex = getattr(self, '_indexed_key', None) != (self.product_name, self.mode)
+        recipe_inputs_changed = getattr(self, '_loaded_recipe_inputs', None) != self.recipe_inputs()
+        aggregate_inputs_changed = getattr(self, '_loaded_aggregate_inputs', None) != self.aggregate_inputs()
+        super().save(*args, **kwargs)
+        if adding:
+            adjust_count(self._meta.label, self.user_id, self.economic_year_id, self.mode, 1)
+        # Per-sale stock decrements leave the dashboard counts cached
+        if adding or aggregate_inputs_changed:
+            bump_tenant_version(INVENTORY_NAMESPACE, self.user_id)
+        self._loaded_recipe_inputs = self.recipe_inputs()
+        self._loaded_aggregate_inputs = self.aggregate_inputs()
+        
+        # New stock is not in any recipe yet
+        if recipe_inputs_changed and not adding:
+            from billing.menu_stock import refresh_stock_menu_items
+            refresh_stock_menu_items([self.id])
+        
+        # Keep the typeahead index in step with the product name
+        if reindex:
+            from .search import index_stocks
+            index_stocks([self])
+            self._indexed_key = (self.product_name, self.mode)
+    
+    def delete(self, *args, **kwargs):
+        from billing.menu_stock import affected_menu_items, refresh_menu_items
+        menu_item_ids = affected_menu_items([self.id])
+        result = super().delete(*args, **kwargs)
+        record_deleted(self.user_id, self.economic_year_id, self.mode, result[1])
+        bump_tenant_version(INVENTORY_NAMESPACE, self.user_id)
+        refresh_menu_items(menu_item_ids)
+        return result
+    
+    def compute_status(self):
         if self.current_stock <= 0:
-            self.status = 'Critical'
+            return 'Critical'
         elif self.current_stock <= self.min_stock:
-            self.status = 'Low'
+            return 'Low'
         elif self.current_stock >= self.max_stock:
-            self.status = 'Overstock'
-        else:
-            self.status = 'Good'
+            return 'Overstock'
+        return 'Good'
+    
+    def update_status(self):
+        self.status = self.compute_status()
         self.save()
 
+class SearchTermBase(models.Model):
+    KIND_CHOICES = [
+        ('prefix', 'Prefix'),
+        ('trigram', 'Trigram')
+    ]
+    
+    term = models.CharField(max_length=32)
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    mode = models.CharField(max_length=20)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    economic_year = models.ForeignKey(EconomicYear, on_delete=models.CASCADE, related_name='+')
+
+    class Meta:
+        abstract = True
+
+class ProductSearchTerm(SearchTermBase):
+    target = models.ForeignKey(Stock, on_delete=models.CASCADE, related_name='search_terms')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'economic_year', 'mode', 'kind', 'term', 'target'], name='inv_search_term_idx')
+        ]
+
+    def __str__(self):
+        return f"{self.kind}:{self.term} -> {self.target_id}"
+
 class Purchase(models.Model):
     PAYMENT_STATUS_CHOICES = [
         ('pending', 'Pending'),
@@ -125,6 +364,7 @@ class Purchase(models.Model):
     total_amount = models.DecimalField(max_digits=12, decimal_places=2)
     purchase_date = models.DateField()
     payment_status = models.CharField(max_length=20, choices=PAYMENT_STATUS_CHOICES, default='pending')
+    invoice_number = models.CharField(max_length=50, blank=True, default='')
     auto_add_stock = models.BooleanField(default=False)
     isTransferredStock = models.BooleanField(default=False)
     notes = models.TextField(blank=True, null=True)
@@ -136,10 +376,26 @@ class Purchase(models.Model):
 
     class Meta:
         ordering = ['-purchase_date', '-created_at']
+        indexes = [
+            models.Index(fields=['user', 'economic_year', 'mode', 'purchase_date', 'created_at'], name='purchase_tenant_date_idx'),
+            models.Index(fields=['user', 'economic_year', 'mode', 'product_name', 'created_at'], name='purchase_tenant_product_idx'),
+            models.Index(fields=['supplier', 'payment_status'], name='purchase_supplier_status_idx'),
+        ]
 
     def __str__(self):
         return f"{self.product_name} - {self.supplier.name}"
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._ledger_key = (
+            instance.__dict__.get('supplier_id'),
+            instance.__dict__.get('payment_status'),
+            instance.__dict__.get('total_amount'),
+            instance.__dict__.get('purchase_date')
+        )
+        return instance
+    
     def save(self, *args, **kwargs):
         # Calculate total amount
         self.total_amount = self.quantity * self.unit_price
@@ -149,13 +405,25 @@ class Purchase(models.Model):
             from decimal import Decimal
             from billing.models import ProfitPercentage
             try:
-                profit = ProfitPercentage.objects.first()
-                profit_percentage = Decimal(str(profit.percentage)) if profit else Decimal('20.0')
+                profit_percentage = ProfitPercentage.resolve(self.user_id, self.economic_year_id, self.mode)
                 self.selling_price = self.unit_price * (Decimal('1') + profit_percentage / Decimal('100'))
             except:
                 self.selling_price = self.unit_price * Decimal('1.2')  # Default 20% profit
         
+        adding = self._state.adding
         super().save(*args, **kwargs)
+        if adding:
+            adjust_count(self._meta.label, self.user_id, self.economic_year_id, self.mode, 1)
+        
+        # Move this purchase's amount between supplier payable buckets
+        deltas = {}
+        previous = getattr(self, '_ledger_key', None)
+        if previous and previous[0] and previous[2] is not None:
+            add_ledger_delta(deltas, previous[0], previous[1], previous[3], -previous[2])
+        add_ledger_delta(deltas, self.supplier_id, self.payment_status, self.purchase_date, self.total_amount)
+        apply_ledger_deltas(deltas)
+        self._ledger_key = (self.supplier_id, self.payment_status, self.total_amount, self.purchase_date)
+        bump_tenant_version(INVENTORY_NAMESPACE, self.user_id)
         
         # Auto add to stock if enabled
         if self.auto_add_stock:
@@ -166,12 +434,14 @@ class Purchase(models.Model):
                 mode=self.mode,
                 defaults={'current_stock': 0, 'unit': self.unit}
             )
-            stock.current_stock += self.quantity
+            stock.receive(self.quantity, self.unit_price)
             stock.update_status()
-        
-        # Update supplier total payments if paid
-        if self.payment_status == 'paid':
-            self.supplier.total_payments = self.supplier.purchases.filter(payment_status='paid').aggregate(
-                total=models.Sum('total_amount')
-            )['total'] or 0
-            self.supplier.save()
\ No newline at end of file
+    
+    def delete(self, *args, **kwargs):
+        deltas = {}
+        add_ledger_delta(deltas, self.supplier_id, self.payment_status, self.purchase_date, -self.total_amount)
+        result = super().delete(*args, **kwargs)
+        apply_ledger_deltas(deltas)
+        record_deleted(self.user_id, self.economic_year_id, self.mode, result[1])
+        bump_tenant_version(INVENTORY_NAMESPACE, self.user_id)
+        return result
\ No newline at end of file
@@ -0,0 +1,291 @@
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+
+from django.db.models import Case, IntegerField, Q, Sum, Value, When
+
+from kcrm.caching import get_tenant_version, bump_tenant_version
+
+MAX_PREFIX_LENGTH = 32
+TRIGRAM_MIN_LENGTH = 3
+PREFIX_WEIGHT = 10
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 50
+
+# Tries are only kept for tenants that search often and have catalogs small enough to hold in memory
+HOT_TENANT_HITS = 20
+TRIE_MAX_PRODUCTS = 20000
+TRIE_MAX_TENANTS = 32
+TRIE_NODE_CAP = MAX_LIMIT
+
+SEARCH_NAMESPACE = 'product_search'
+
+NEPAL_COUNTRY_CODE = '977'
+
+DEVANAGARI_VOWELS = {
+    'अ': 'a', 'आ': 'a', 'इ': 'i', 'ई': 'i', 'उ': 'u', 'ऊ': 'u', 'ऋ': 'ri',
+    'ए': 'e', 'ऐ': 'ai', 'ओ': 'o', 'औ': 'au',
+}
+
+DEVANAGARI_CONSONANTS = {
+    'क': 'k', 'ख': 'kh', 'ग': 'g', 'घ': 'gh', 'ङ': 'ng',
+    'च': 'ch', 'छ': 'chh', 'ज': 'j', 'झ': 'jh', 'ञ': 'ny',
+    'ट': 't', 'ठ': 'th', 'ड': 'd', 'ढ': 'dh', 'ण': 'n',
+    'त': 't', 'थ': 'th', 'द': 'd', 'ध': 'dh', 'न': 'n',
+    'प': 'p', 'फ': 'ph', 'ब': 'b', 'भ': 'bh', 'म': 'm',
+    'य': 'y', 'र': 'r', 'ल': 'l', 'व': 'v',
+    'श': 'sh', 'ष': 'sh', 'स': 's', 'ह': 'h',
+}
+
+DEVANAGARI_MATRAS = {
+    'ा': 'a', 'ि': 'i', 'ी': 'i', 'ु': 'u', 'ू': 'u', 'ृ': 'ri',
+    'े': 'e', 'ै': 'ai', 'ो': 'o', 'ौ': 'au',
+}
+
+DEVANAGARI_SIGNS = {'ं': 'n', 'ँ': 'n', 'ः': 'h'}
+
+VIRAMA = '्'
+NUKTA = '़'
+DEVANAGARI_DIGITS = {chr(0x0966 + i): str(i) for i in range(10)}
+
+
+def transliterate(text):
+    """Romanize Devanagari text, dropping the inherent vowel at word ends as spoken Nepali does"""
+    output = []
+    pending_vowel = False
+    for char in text:
+        if char in DEVANAGARI_CONSONANTS:
+            if pending_vowel:
+                output.append('a')
+            output.append(DEVANAGARI_CONSONANTS[char])
+            pending_vowel = True
+        elif char in DEVANAGARI_MATRAS:
+            output.append(DEVANAGARI_MATRAS[char])
+            pending_vowel = False
+        elif char == VIRAMA:
+            pending_vowel = False
+        elif char == NUKTA:
+            continue
+        else:
+            if pending_vowel and char in DEVANAGARI_SIGNS:
+                output.append('a')
+            pending_vowel = False
+            if char in DEVANAGARI_VOWELS:
+                output.append(DEVANAGARI_VOWELS[char])
+            elif char in DEVANAGARI_SIGNS:
+                output.append(DEVANAGARI_SIGNS[char])
+            elif char in DEVANAGARI_DIGITS:
+                output.append(DEVANAGARI_DIGITS[char])
+            else:
+                output.append(char)
+    return ''.join(output)
+
+
+def normalize_search_key(text):
+    """Case-fold, romanize and squeeze text into the key used by the search index"""
+    if not text:
+        return ''
+    text = transliterate(str(text))
+    text = unicodedata.normalize('NFKD', text)
+    text = ''.join(char for char in text if not unicodedata.combining(char)).casefold()
+    text = re.sub(r'[^a-z0-9]+', ' ', text)
+    # Collapse repeated letters, not digits, so "chaamal" and "chamal" match but "10ml" and "1000ml" do not
+    text = re.sub(r'([a-z])\1+', r'\1', text)
+    return ' '.join(text.split())
+
+
+def normalize_phone(phone):
+    """Reduce a phone number to its local digits, dropping separators and the Nepal country code"""
+    if not phone:
+        return ''
+    digits = ''.join(DEVANAGARI_DIGITS.get(char, char) for char in str(phone))
+    digits = re.sub(r'\D', '', digits).lstrip('0')
+    # Partial input is stripped too, so "+977 98" already matches as the cashier types
+    if digits.startswith(NEPAL_COUNTRY_CODE) and len(digits) > len(NEPAL_COUNTRY_CODE):
+        digits = digits[len(NEPAL_COUNTRY_CODE):]
+    return digits
+
+
+def trigrams(key):
+    grams = set()
+    for word in key.split():
+        for i in range(len(word) - 2):
+            grams.add(word[i:i + 3])
+    return grams
+
+
+def prefixes(key):
+    terms = set()
+    for word in key.split():
+        for i in range(1, min(len(word), MAX_PREFIX_LENGTH) + 1):
+            terms.add(word[:i])
+    # Whole-name prefixes let multi-word queries such as "basmati ri" match
+    for i in range(1, min(len(key), MAX_PREFIX_LENGTH) + 1):
+        terms.add(key[:i])
+    return terms
+
+
+def build_terms(text):
+    """Return the (kind, term) pairs indexed for a piece of text"""
+    key = normalize_search_key(text)
+    terms = [('prefix', term) for term in prefixes(key)]
+    terms += [('trigram', term) for term in trigrams(key)]
+    return terms
+
+
+def index_objects(term_model, objects, text_of, kinds=('prefix', 'trigram')):
+    """Replace the search terms of the given tenant-scoped objects"""
+    objects = [obj for obj in objects if obj.pk]
+    if not objects:
+        return
+    term_model.objects.filter(target__in=objects).delete()
+    rows = []
+    for obj in objects:
+        for kind, term in build_terms(text_of(obj)):
+            if kind not in kinds:
+                continue
+            rows.append(term_model(
+                target=obj,
+                term=term,
+                kind=kind,
+                user_id=obj.user_id,
+                economic_year_id=obj.economic_year_id,
+                mode=obj.mode
+            ))
+    term_model.objects.bulk_create(rows, batch_size=1000)
+
+
+def rank_by_search(queryset, owner_user, economic_year, mode, query, order_field, kinds=('prefix', 'trigram')):
+    """Filter a queryset to index matches and order it by relevance in a single query"""
+    key = normalize_search_key(query)
+    if not key:
+        return queryset.none()
+
+    tenant = {
+        'search_terms__user': owner_user,
+        'search_terms__economic_year': economic_year,
+    }
+    if mode:
+        tenant['search_terms__mode'] = mode
+
+    match = Q(search_terms__kind='prefix', search_terms__term=key[:MAX_PREFIX_LENGTH])
+    grams = trigrams(key) if 'trigram' in kinds and len(key) >= TRIGRAM_MIN_LENGTH else set()
+    if grams:
+        match |= Q(search_terms__kind='trigram', search_terms__term__in=grams)
+
+    return queryset.filter(match, **tenant).annotate(
+        search_score=Sum(Case(
+            When(search_terms__kind='prefix', then=Value(PREFIX_WEIGHT)),
+            default=Value(1),
+            output_field=IntegerField()
+        ))
+    ).order_by('-search_score', order_field, 'id')
+
+
+class PrefixTrie:
+    """Character trie whose nodes keep the first few matches in name order"""
+
+    def __init__(self, node_cap=TRIE_NODE_CAP):
+        self.root = {}
+        self.node_cap = node_cap
+
+    def insert(self, word, entry):
+        node = self.root
+        for char in word:
+            node = node.setdefault(char, {})
+            matches = node.setdefault('', [])
+            if entry not in matches:
+                matches.append(entry)
+                matches.sort()
+                del matches[self.node_cap:]
+
+    def lookup(self, prefix):
+        node = self.root
+        for char in prefix:
+            node = node.get(char)
+            if node is None:
+                return []
+        return node.get('', [])
+
+
+_tries = OrderedDict()
+_tenant_hits = {}
+_tries_lock = threading.Lock()
+
+
+def _tenant(owner_user, economic_year, mode):
+    return (owner_user.id, economic_year.id, mode)
+
+
+def _build_trie(owner_user, economic_year, mode):
+    from .models import Stock
+
+    stocks = list(Stock.objects.filter(
+        user=owner_user, economic_year=economic_year, mode=mode
+    ).values_list('id', 'product_name')[:TRIE_MAX_PRODUCTS + 1])
+    if len(stocks) > TRIE_MAX_PRODUCTS:
+        return None
+
+    trie = PrefixTrie()
+    for stock_id, product_name in stocks:
+        key = normalize_search_key(product_name)
+        entry = (product_name.casefold(), stock_id)
+        for word in set(key.split() + [key]):
+            trie.insert(word[:MAX_PREFIX_LENGTH], entry)
+    return trie
+
+
+def get_hot_trie(owner_user, economic_year, mode):
+    """Return the tenant's in-memory trie once it is hot, rebuilding it after writes"""
+    tenant = _tenant(owner_user, economic_year, mode)
+    version = get_tenant_version(SEARCH_NAMESPACE, owner_user.id)
+
+    with _tries_lock:
+        cached = _tries.get(tenant)
+        if cached and cached[0] == version:
+            _tries.move_to_end(tenant)
+            return cached[1]
+        hits = _tenant_hits.get(tenant, 0) + 1
+        _tenant_hits[tenant] = hits
+        if hits < HOT_TENANT_HITS:
+            return None
+
+    trie = _build_trie(owner_user, economic_year, mode)
+    if trie is None:
+        return None
+
+    with _tries_lock:
+        _tries[tenant] = (version, trie)
+        _tries.move_to_end(tenant)
+        while len(_tries) > TRIE_MAX_TENANTS:
+            evicted, _ = _tries.popitem(last=False)
+            _tenant_hits.pop(evicted, None)
+    return trie
+
+
+def index_stocks(stocks):
+    from .models import ProductSearchTerm
+
+    stocks = list(stocks)
+    index_objects(ProductSearchTerm, stocks, lambda stock: stock.product_name)
+    for owner_id in {stock.user_id for stock in stocks}:
+        bump_tenant_version(SEARCH_NAMESPACE, owner_id)
+
+
+def search_products(owner_user, economic_year, mode, query, limit=DEFAULT_LIMIT):
+    """Top products matching a typeahead query, best match first"""
+    from .models import Stock
+
+    stocks = Stock.objects.filter(user=owner_user, economic_year=economic_year, mode=mode).select_related('category')
+    key = normalize_search_key(query)
+
+    # Short queries are pure prefix lookups, which a hot tenant's trie answers without touching the index
+    if key and len(key) < TRIGRAM_MIN_LENGTH and limit <= TRIE_NODE_CAP:
+        trie = get_hot_trie(owner_user, economic_year, mode)
+        if trie is not None:
+            ids = [stock_id for _, stock_id in trie.lookup(key)[:limit]]
+            found = stocks.in_bulk(ids)
+            return [found[stock_id] for stock_id in ids if stock_id in found]
+
+    return list(rank_by_search(stocks, owner_user, economic_year, mode, query, 'product_name')[:limit])
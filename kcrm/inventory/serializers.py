@@ -1,3 +1,4 @@
+from decimal import Decimal
 from rest_framework import serializers
 from .models import Category, Supplier, Purchase, Stock
 
@@ -10,6 +11,9 @@ class CategorySerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'created_at', 'updated_at']
     
     def get_purchases_count(self, obj):
+        # List views annotate the count; single objects fall back to a query
+        if hasattr(obj, 'purchases_count'):
+            return obj.purchases_count
         return obj.purchases.count()
     
     def create(self, validated_data):
@@ -24,10 +28,14 @@ class CategorySerializer(serializers.ModelSerializer):
         return super().create(validated_data)
 
 class SupplierSerializer(serializers.ModelSerializer):
+    purchases_count = serializers.IntegerField(read_only=True)
+    purchases_total = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
+    
     class Meta:
         model = Supplier
-        fields = ['id', 'name', 'contact', 'address', 'categories', 'total_payments', 'status', 'mode', 'created_at', 'updated_at']
-        read_only_fields = ['id', 'created_at', 'updated_at']
+        fields = ['id', 'name', 'contact', 'address', 'categories', 'total_payments', 'paid_total', 'pending_total',
+                 'partial_total', 'purchases_count', 'purchases_total', 'status', 'mode', 'created_at', 'updated_at']
+        read_only_fields = ['id', 'total_payments', 'paid_total', 'pending_total', 'partial_total', 'created_at', 'updated_at']
     
     def create(self, validated_data):
         user = self.context.get('owner_user', self.context['request'].user)
@@ -43,13 +51,14 @@ class SupplierSerializer(serializers.ModelSerializer):
 class StockSerializer(serializers.ModelSerializer):
     category_name = serializers.CharField(source='category.name', read_only=True)
     supplier_name = serializers.CharField(source='supplier.name', read_only=True)
+    last_movement = serializers.DateTimeField(read_only=True)
     
     class Meta:
         model = Stock
         fields = ['id', 'product_name', 'current_stock', 'unit', 'min_stock', 'max_stock', 
-                 'cost_price', 'selling_price', 'category', 'category_name', 'supplier', 
-                 'supplier_name', 'barcode', 'status', 'mode', 'created_at', 'updated_at']
-        read_only_fields = ['id', 'status', 'created_at', 'updated_at']
+                 'cost_price', 'selling_price', 'average_cost', 'category', 'category_name', 'supplier', 
+                 'supplier_name', 'barcode', 'status', 'mode', 'last_movement', 'created_at', 'updated_at']
+        read_only_fields = ['id', 'status', 'average_cost', 'created_at', 'updated_at']
     
     def create(self, validated_data):
         user = self.context.get('owner_user', self.context['request'].user)
@@ -64,6 +73,10 @@ class StockSerializer(serializers.ModelSerializer):
         stock.update_status()
         return stock
 
+class StockListSerializer(StockSerializer):
+    category_name = serializers.CharField(source='display_category_name', read_only=True)
+    supplier_name = serializers.CharField(source='display_supplier_name', read_only=True)
+
 class PurchaseSerializer(serializers.ModelSerializer):
     supplier_name = serializers.CharField(source='supplier.name', read_only=True)
     category_name = serializers.CharField(source='category.name', read_only=True)
@@ -72,7 +85,7 @@ class PurchaseSerializer(serializers.ModelSerializer):
         model = Purchase
         fields = ['id', 'supplier', 'supplier_name', 'category', 'category_name', 'product_name', 
                  'quantity', 'unit', 'unit_price', 'total_amount', 'purchase_date', 'payment_status', 
-                 'auto_add_stock', 'isTransferredStock', 'notes', 'mode', 'created_at', 'updated_at']
+                 'invoice_number', 'auto_add_stock', 'isTransferredStock', 'notes', 'mode', 'created_at', 'updated_at']
         read_only_fields = ['id', 'total_amount', 'created_at', 'updated_at']
     
     def create(self, validated_data):
@@ -84,4 +97,47 @@ class PurchaseSerializer(serializers.ModelSerializer):
         
         validated_data['user'] = user
         validated_data['economic_year'] = active_year
-        return super().create(validated_data)
\ No newline at end of file
+        return super().create(validated_data)
+
+class PurchaseInvoiceLineSerializer(serializers.Serializer):
+    category = serializers.IntegerField()
+    product_name = serializers.CharField(max_length=200)
+    quantity = serializers.IntegerField(min_value=1)
+    unit = serializers.CharField(max_length=20, default='kg')
+    unit_price = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=Decimal('0'))
+    selling_price = serializers.DecimalField(max_digits=10, decimal_places=2, required=False, allow_null=True)
+    notes = serializers.CharField(required=False, allow_blank=True, allow_null=True)
+
+class PurchaseInvoiceSerializer(serializers.Serializer):
+    supplier = serializers.IntegerField()
+    purchase_date = serializers.DateField()
+    payment_status = serializers.ChoiceField(choices=Purchase.PAYMENT_STATUS_CHOICES, default='pending')
+    invoice_number = serializers.CharField(max_length=50, required=False, allow_blank=True, default='')
+    mode = serializers.ChoiceField(choices=Purchase.MODE_CHOICES, default='kirana')
+    notes = serializers.CharField(required=False, allow_blank=True, allow_null=True)
+    transfer_to_stock = serializers.BooleanField(default=False)
+    lines = PurchaseInvoiceLineSerializer(many=True, allow_empty=False)
+    
+    def validate(self, attrs):
+        owner_user = self.context['owner_user']
+        active_year = self.context['active_year']
+        
+        supplier = Supplier.objects.filter(
+            id=attrs['supplier'], user=owner_user, economic_year=active_year
+        ).first()
+        if not supplier:
+            raise serializers.ValidationError({'supplier': 'Supplier not found'})
+        if supplier.mode != attrs['mode']:
+            raise serializers.ValidationError({'supplier': f'Supplier belongs to {supplier.mode} mode, not {attrs["mode"]}'})
+        
+        category_ids = {line['category'] for line in attrs['lines']}
+        categories = Category.objects.filter(id__in=category_ids, user=owner_user, economic_year=active_year).in_bulk()
+        missing = sorted(category_ids - set(categories))
+        if missing:
+            raise serializers.ValidationError({'lines': f'Categories not found: {missing}'})
+        other_mode = sorted(category_id for category_id, category in categories.items() if category.mode != attrs['mode'])
+        if other_mode:
+            raise serializers.ValidationError({'lines': f'Categories not in {attrs["mode"]} mode: {other_mode}'})
+        
+        attrs['supplier'] = supplier
+        return attrs
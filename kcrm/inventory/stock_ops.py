@@ -0,0 +1,244 @@
+from decimal import Decimal
+
+from django.db import transaction
+from django.utils import timezone
+
+from billing.menu_stock import affected_menu_items, refresh_stock_menu_items, refresh_menu_items
+from kcrm.caching import bump_tenant_version
+from kcrm.counts import adjust_count, record_deleted
+
+from .models import INVENTORY_NAMESPACE, Stock
+from .search import index_stocks
+from .valuation import add_to_average
+
+DEFAULT_MIN_STOCK = 10
+DEFAULT_MAX_STOCK = 100
+DEFAULT_MARGIN = Decimal('1.2')
+
+
+def merge_into_stock(owner_user, economic_year, mode, lines):
+    """Add purchased quantities to Stock with one locked read, one bulk update and one bulk insert.
+
+    Each line is a dict with product_name, quantity, unit, unit_price, selling_price,
+    category_id and supplier_id. Lines for the same product are summed, and the last
+    line sets the prices, category and supplier, as repeated single transfers would.
+    Average cost moves by the quantity-weighted cost of all the lines.
+    Returns the affected stocks keyed by product name.
+    """
+    grouped = {}
+    for line in lines:
+        merged = grouped.setdefault(line['product_name'], dict(line, quantity=0, cost=Decimal('0')))
+        merged.update({key: value for key, value in line.items() if key != 'quantity'})
+        merged['quantity'] += line['quantity']
+        merged['cost'] += line['quantity'] * line['unit_price']
+    if not grouped:
+        return {}
+
+    with transaction.atomic():
+        existing = {
+            stock.product_name: stock
+            for stock in Stock.objects.select_for_update().filter(
+                user=owner_user,
+                economic_year=economic_year,
+                mode=mode,
+                product_name__in=list(grouped)
+            )
+        }
+
+        now = timezone.now()
+        to_update = []
+        to_create = []
+        for product_name, line in grouped.items():
+            selling_price = line.get('selling_price') or line['unit_price'] * DEFAULT_MARGIN
+            unit_cost = line['cost'] / line['quantity'] if line['quantity'] else line['unit_price']
+            stock = existing.get(product_name)
+            if stock is None:
+                stock = Stock(
+                    product_name=product_name,
+                    current_stock=line['quantity'],
+                    unit=line.get('unit') or 'kg',
+                    min_stock=DEFAULT_MIN_STOCK,
+                    max_stock=DEFAULT_MAX_STOCK,
+                    cost_price=line['unit_price'],
+                    selling_price=selling_price,
+                    average_cost=add_to_average(0, 0, line['quantity'], unit_cost),
+                    category_id=line.get('category_id'),
+                    supplier_id=line.get('supplier_id'),
+                    mode=mode,
+                    user=owner_user,
+                    economic_year=economic_year
+                )
+                stock.status = stock.compute_status()
+                to_create.append(stock)
+            else:
+                stock.receive(line['quantity'], unit_cost)
+                stock.cost_price = line['unit_price']
+                stock.selling_price = selling_price
+                stock.category_id = line.get('category_id')
+                stock.supplier_id = line.get('supplier_id')
+                stock.status = stock.compute_status()
+                stock.updated_at = now
+                to_update.append(stock)
+
+        if to_update:
+            Stock.objects.bulk_update(
+                to_update,
+                ['current_stock', 'cost_price', 'selling_price', 'average_cost', 'category', 'supplier', 'status', 'updated_at']
+            )
+            refresh_stock_menu_items([stock.id for stock in to_update])
+
+        if to_create:
+            Stock.objects.bulk_create(to_create)
+            adjust_count(Stock._meta.label, owner_user.id, economic_year.id, mode, len(to_create))
+            # MySQL does not return primary keys from a bulk insert
+            created = list(Stock.objects.filter(
+                user=owner_user,
+                economic_year=economic_year,
+                mode=mode,
+                product_name__in=[stock.product_name for stock in to_create]
+            ))
+            index_stocks(created)
+            existing.update({stock.product_name: stock for stock in created})
+
+    bump_tenant_version(INVENTORY_NAMESPACE, owner_user.id)
+    return existing
+
+
+def remove_from_stock(owner_user, economic_year, mode, quantities):
+    """Take {product_name: quantity} back out of Stock, deleting rows that reach zero.
+
+    Returns {product_name: outcome} where outcome is 'removed', 'stock_not_found'
+    or 'insufficient_stock'. Products that cannot be reduced are left untouched.
+    """
+    if not quantities:
+        return {}
+
+    with transaction.atomic():
+        stocks = {
+            stock.product_name: stock
+            for stock in Stock.objects.select_for_update().filter(
+                user=owner_user,
+                economic_year=economic_year,
+                mode=mode,
+                product_name__in=list(quantities)
+            )
+        }
+
+        now = timezone.now()
+        outcomes = {}
+        to_update = []
+        to_delete = []
+        for product_name, quantity in quantities.items():
+            stock = stocks.get(product_name)
+            if stock is None:
+                outcomes[product_name] = 'stock_not_found'
+            elif stock.current_stock < quantity:
+                outcomes[product_name] = 'insufficient_stock'
+            else:
+                stock.current_stock -= quantity
+                if stock.current_stock == 0:
+                    to_delete.append(stock.id)
+                else:
+                    stock.status = stock.compute_status()
+                    stock.updated_at = now
+                    to_update.append(stock)
+                outcomes[product_name] = 'removed'
+
+        menu_item_ids = affected_menu_items([stock.id for stock in to_update] + to_delete)
+        if to_update:
+            Stock.objects.bulk_update(to_update, ['current_stock', 'status', 'updated_at'])
+        if to_delete:
+            record_deleted(owner_user.id, economic_year.id, mode, Stock.objects.filter(id__in=to_delete).delete()[1])
+        refresh_menu_items(menu_item_ids)
+
+    # Deletes and status changes move the cached low-stock count; plain level changes do not
+    if to_delete or any(stock.aggregate_inputs() != stock._loaded_aggregate_inputs for stock in to_update):
+        bump_tenant_version(INVENTORY_NAMESPACE, owner_user.id)
+    return outcomes
+
+
+def purchase_stock_line(purchase):
+    return {
+        'product_name': purchase.product_name,
+        'quantity': purchase.quantity,
+        'unit': purchase.unit,
+        'unit_price': purchase.unit_price,
+        'selling_price': purchase.selling_price,
+        'category_id': purchase.category_id,
+        'supplier_id': purchase.supplier_id
+    }
+
+
+def transfer_purchases(owner_user, economic_year, purchase_ids):
+    """Move purchases into stock as one transaction, grouped by product.
+
+    Returns {purchase_id: {'status': ..., 'stock_id': ...}} for every requested id.
+    """
+    from .models import Purchase
+
+    results = {purchase_id: {'status': 'not_found'} for purchase_id in purchase_ids}
+    with transaction.atomic():
+        purchases = list(Purchase.objects.select_for_update().filter(
+            id__in=purchase_ids, user=owner_user, economic_year=economic_year
+        ).order_by('created_at', 'id'))
+
+        by_mode = {}
+        for purchase in purchases:
+            if purchase.isTransferredStock:
+                results[purchase.id] = {'status': 'already_transferred'}
+            else:
+                by_mode.setdefault(purchase.mode, []).append(purchase)
+
+        transferred = []
+        for mode, mode_purchases in by_mode.items():
+            stocks = merge_into_stock(owner_user, economic_year, mode, [
+                purchase_stock_line(purchase) for purchase in mode_purchases
+            ])
+            for purchase in mode_purchases:
+                results[purchase.id] = {'status': 'transferred', 'stock_id': stocks[purchase.product_name].id}
+                transferred.append(purchase.id)
+
+        if transferred:
+            Purchase.objects.filter(id__in=transferred).update(isTransferredStock=True, updated_at=timezone.now())
+
+    return results
+
+
+def untransfer_purchases(owner_user, economic_year, purchase_ids):
+    """Take transferred purchases back out of stock as one transaction, grouped by product.
+
+    Returns {purchase_id: {'status': ...}} for every requested id. Every purchase of a
+    product group shares that group's outcome.
+    """
+    from .models import Purchase
+
+    results = {purchase_id: {'status': 'not_found'} for purchase_id in purchase_ids}
+    with transaction.atomic():
+        purchases = list(Purchase.objects.select_for_update().filter(
+            id__in=purchase_ids, user=owner_user, economic_year=economic_year
+        ))
+
+        groups = {}
+        for purchase in purchases:
+            if not purchase.isTransferredStock:
+                results[purchase.id] = {'status': 'not_transferred'}
+            else:
+                groups.setdefault(purchase.mode, {}).setdefault(purchase.product_name, []).append(purchase)
+
+        untransferred = []
+        for mode, products in groups.items():
+            outcomes = remove_from_stock(owner_user, economic_year, mode, {
+                product_name: sum(purchase.quantity for purchase in product_purchases)
+                for product_name, product_purchases in products.items()
+            })
+            for product_name, product_purchases in products.items():
+                outcome = outcomes[product_name]
+                for purchase in product_purchases:
+                    results[purchase.id] = {'status': 'untransferred' if outcome == 'removed' else outcome}
+                    if outcome == 'removed':
+                        untransferred.append(purchase.id)
+
+        if untransferred:
+            Purchase.objects.filter(id__in=untransferred).update(isTransferredStock=False, updated_at=timezone.now())
+
+    return results
@@ -7,13 +7,18 @@ urlpatterns = [
 
     path('suppliers/', views.suppliers, name='suppliers'),
     path('suppliers/<int:supplier_id>/', views.manage_supplier, name='manage_supplier'),
+    path('suppliers/payables-aging/', views.payables_aging, name='payables_aging'),
     
     path('purchases/', views.purchases, name='purchases'),
     path('purchases/<int:purchase_id>/', views.manage_purchase, name='manage_purchase'),
+    path('purchases/transfer/', views.batch_transfer_to_stock, name='batch_transfer_to_stock'),
+    path('purchases/untransfer/', views.batch_untransfer_from_stock, name='batch_untransfer_from_stock'),
     path('purchases/<int:purchase_id>/transfer/', views.transfer_to_stock, name='transfer_to_stock'),
     path('purchases/<int:purchase_id>/untransfer/', views.untransfer_from_stock, name='untransfer_from_stock'),
+    path('purchase-invoices/', views.purchase_invoices, name='purchase_invoices'),
     
     path('stocks/', views.stocks, name='stocks'),
+    path('stocks/search/', views.search_stocks, name='search_stocks'),
     path('stocks/<int:stock_id>/', views.manage_stock, name='manage_stock'),
     path('stocks/bulk_delete/', views.bulk_delete_stocks, name='bulk_delete_stocks'),
     path('stocks/bulk_create/', views.bulk_create_stocks, name='bulk_create_stocks'),
@@ -0,0 +1,44 @@
+from decimal import Decimal
+
+from django.db.models import Case, DecimalField, ExpressionWrapper, F, Sum, When
+
+COST_PLACES = Decimal('0.0001')
+MONEY_FIELD = DecimalField(max_digits=18, decimal_places=4)
+
+
+def add_to_average(on_hand, average_cost, quantity, unit_cost):
+    """Moving weighted-average unit cost after receiving quantity units at unit_cost"""
+    on_hand = Decimal(max(on_hand, 0))
+    quantity = Decimal(quantity)
+    total = on_hand + quantity
+    if total <= 0:
+        return Decimal(str(unit_cost)).quantize(COST_PLACES)
+    value = on_hand * Decimal(str(average_cost)) + quantity * Decimal(str(unit_cost))
+    return (value / total).quantize(COST_PLACES)
+
+
+def stock_unit_cost():
+    # Rows that predate average costing fall back to their last cost price
+    return Case(
+        When(average_cost__gt=0, then=F('average_cost')),
+        default=F('cost_price'),
+        output_field=MONEY_FIELD
+    )
+
+
+def stock_value(stocks):
+    """Total value of a Stock queryset at average cost, as one aggregate"""
+    value = stocks.aggregate(
+        value=Sum(ExpressionWrapper(F('current_stock') * stock_unit_cost(), output_field=MONEY_FIELD))
+    )['value']
+    return value or Decimal('0')
+
+
+def gross_profit(sale_items):
+    """Revenue minus cost of goods sold for a SaleItem queryset, at the unit costs snapshotted at sale time"""
+    profit = sale_items.filter(unit_cost__isnull=False).aggregate(
+        profit=Sum(ExpressionWrapper(
+            F('quantity') * (F('unit_price') - F('unit_cost')), output_field=MONEY_FIELD
+        ))
+    )['profit']
+    return profit or Decimal('0')
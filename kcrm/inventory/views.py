@@ -2,12 +2,29 @@ from rest_framework import status
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
-from django.core.paginator import Paginator
 from authentication.models import EconomicYear
-from .models import Category, Supplier, Purchase, Stock
-from .serializers import CategorySerializer, SupplierSerializer, StockSerializer
-from django.db.models import Sum, Count
+from .models import Category, Supplier, Purchase, Stock, apply_ledger_deltas, INVENTORY_NAMESPACE
+from .serializers import CategorySerializer, SupplierSerializer, StockSerializer, StockListSerializer, PurchaseInvoiceSerializer
+from .stock_ops import merge_into_stock, purchase_stock_line, transfer_purchases, untransfer_purchases
+from django.db.models import Sum, Count, Q, Value, DecimalField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+import hashlib
+import json
 from staff.models import Staff
+from .search import search_products, DEFAULT_LIMIT, MAX_LIMIT
+from .valuation import stock_value
+from kcrm.caching import tenant_key, get_tenant_version, bump_tenant_version
+from kcrm.pagination import paginate
+from kcrm.counts import tenant_counter, adjust_count
+from kcrm.singleflight import single_flight, flight_key
+from billing.menu_stock import affected_menu_items, refresh_menu_items
 
 def get_owner_user(request):
     """Get the shop owner user for staff or return the user itself for shop owners"""
@@ -32,33 +49,34 @@ def categories(request):
     
     if request.method == 'GET':
         mode = request.GET.get('mode', 'kirana')
-        page = int(request.GET.get('page', 1))
-        page_size = int(request.GET.get('page_size', 10))
         
         categories = Category.objects.filter(user=owner_user, economic_year=active_year, mode=mode)
         
-        paginator = Paginator(categories, page_size)
-        page_obj = paginator.get_page(page)
-        serializer = CategorySerializer(page_obj, many=True)
+        data, pagination = paginate(
+            request,
+            categories.annotate(purchases_count=Count('purchases')),
+            ('-created_at', '-id'),
+            lambda rows: CategorySerializer(rows, many=True).data,
+            counter=tenant_counter(Category, owner_user, active_year, mode)
+        )
         
         # Calculate stats from all categories
-        total_purchases = sum(cat.purchases.count() for cat in categories)
-        active_categories = categories.filter(is_active=True).count()
+        stats = categories.aggregate(
+            total_purchases=Count('purchases'),
+            active_categories=Count('id', filter=Q(is_active=True), distinct=True),
+            total_categories=Count('id', distinct=True)
+        )
+        total_purchases = stats['total_purchases']
+        active_categories = stats['active_categories']
         
         return Response({
             'success': True,
-            'categories': serializer.data,
-            'pagination': {
-                'current_page': page_obj.number,
-                'total_pages': paginator.num_pages,
-                'total_items': paginator.count,
-                'has_next': page_obj.has_next(),
-                'has_previous': page_obj.has_previous()
-            },
+            'categories': data,
+            'pagination': pagination,
             'stats': {
                 'total_purchases': total_purchases,
                 'active_categories': active_categories,
-                'total_categories': paginator.count
+                'total_categories': stats['total_categories']
             }
         })
     
@@ -124,25 +142,22 @@ def suppliers(request):
     
     if request.method == 'GET':
         mode = request.GET.get('mode', 'kirana')
-        page = int(request.GET.get('page', 1))
-        page_size = int(request.GET.get('page_size', 10))
         
-        suppliers = Supplier.objects.filter(user=owner_user, economic_year=active_year, mode=mode)
+        suppliers = Supplier.objects.filter(user=owner_user, economic_year=active_year, mode=mode).annotate(
+            purchases_count=Count('purchases'),
+            purchases_total=Coalesce(Sum('purchases__total_amount'), Value(0), output_field=DecimalField())
+        )
         
-        paginator = Paginator(suppliers, page_size)
-        page_obj = paginator.get_page(page)
-        serializer = SupplierSerializer(page_obj, many=True)
+        data, pagination = paginate(
+            request, suppliers, ('-created_at', '-id'),
+            lambda rows: SupplierSerializer(rows, many=True).data,
+            counter=tenant_counter(Supplier, owner_user, active_year, mode)
+        )
         
         return Response({
             'success': True,
-            'suppliers': serializer.data,
-            'pagination': {
-                'current_page': page_obj.number,
-                'total_pages': paginator.num_pages,
-                'total_items': paginator.count,
-                'has_next': page_obj.has_next(),
-                'has_previous': page_obj.has_previous()
-            }
+            'suppliers': data,
+            'pagination': pagination
         })
     
     elif request.method == 'POST':
@@ -194,6 +209,59 @@ def manage_supplier(request, supplier_id):
             'message': 'Supplier not found'
         }, status=status.HTTP_404_NOT_FOUND)
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def payables_aging(request):
+    owner_user = get_owner_user(request)
+    active_year = EconomicYear.objects.filter(user=owner_user, is_active=True).first()
+    if not active_year:
+        return Response({
+            'success': False,
+            'message': 'No active economic year found'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    mode = request.GET.get('mode', 'kirana')
+    today = timezone.now().date()
+    
+    # Only suppliers the maintained ledger says still have something outstanding
+    suppliers = Supplier.objects.filter(
+        user=owner_user, economic_year=active_year, mode=mode
+    ).filter(Q(pending_total__gt=0) | Q(partial_total__gt=0)).order_by('name')
+    
+    # Bucket the maintained per-date outstanding rows rather than every purchase
+    suppliers = suppliers.annotate(
+        days_0_30=Sum('payable_days__outstanding', filter=Q(payable_days__purchase_date__gte=today - timedelta(days=30))),
+        days_31_60=Sum('payable_days__outstanding', filter=Q(
+            payable_days__purchase_date__lt=today - timedelta(days=30),
+            payable_days__purchase_date__gte=today - timedelta(days=60)
+        )),
+        days_60_plus=Sum('payable_days__outstanding', filter=Q(payable_days__purchase_date__lt=today - timedelta(days=60)))
+    )
+    
+    rows = []
+    summary = {'outstanding': 0, 'days_0_30': 0, 'days_31_60': 0, 'days_60_plus': 0}
+    for supplier in suppliers:
+        row = {
+            'supplier_id': supplier.id,
+            'supplier': supplier.name,
+            'paid_total': float(supplier.paid_total),
+            'pending_total': float(supplier.pending_total),
+            'partial_total': float(supplier.partial_total),
+            'outstanding': float(supplier.pending_total + supplier.partial_total),
+            'days_0_30': float(supplier.days_0_30 or 0),
+            'days_31_60': float(supplier.days_31_60 or 0),
+            'days_60_plus': float(supplier.days_60_plus or 0)
+        }
+        for field in summary:
+            summary[field] += row[field]
+        rows.append(row)
+    
+    return Response({
+        'success': True,
+        'aging': rows,
+        'summary': summary
+    })
+
 @api_view(['GET', 'POST'])
 @permission_classes([IsAuthenticated])
 def purchases(request):
@@ -207,26 +275,20 @@ def purchases(request):
     
     if request.method == 'GET':
         mode = request.GET.get('mode', 'kirana')
-        page = int(request.GET.get('page', 1))
-        page_size = int(request.GET.get('page_size', 10))
         
         purchases = Purchase.objects.filter(user=owner_user, economic_year=active_year, mode=mode)
         
-        paginator = Paginator(purchases, page_size)
-        page_obj = paginator.get_page(page)
         from .serializers import PurchaseSerializer
-        serializer = PurchaseSerializer(page_obj, many=True)
+        data, pagination = paginate(
+            request, purchases.select_related('supplier', 'category'), ('-purchase_date', '-created_at', '-id'),
+            lambda rows: PurchaseSerializer(rows, many=True).data,
+            counter=tenant_counter(Purchase, owner_user, active_year, mode)
+        )
         
         return Response({
             'success': True,
-            'purchases': serializer.data,
-            'pagination': {
-                'current_page': page_obj.number,
-                'total_pages': paginator.num_pages,
-                'total_items': paginator.count,
-                'has_next': page_obj.has_next(),
-                'has_previous': page_obj.has_previous()
-            }
+            'purchases': data,
+            'pagination': pagination
         })
     
     elif request.method == 'POST':
@@ -244,6 +306,89 @@ def purchases(request):
             'errors': serializer.errors
         }, status=status.HTTP_400_BAD_REQUEST)
 
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def purchase_invoices(request):
+    owner_user = get_owner_user(request)
+    active_year = EconomicYear.objects.filter(user=owner_user, is_active=True).first()
+    if not active_year:
+        return Response({
+            'success': False,
+            'message': 'No active economic year found'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    serializer = PurchaseInvoiceSerializer(data=request.data, context={'owner_user': owner_user, 'active_year': active_year})
+    if not serializer.is_valid():
+        return Response({
+            'success': False,
+            'errors': serializer.errors
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    data = serializer.validated_data
+    supplier = data['supplier']
+    mode = data['mode']
+    transfer = data['transfer_to_stock']
+    
+    from billing.models import ProfitPercentage
+    margin = Decimal('1') + ProfitPercentage.resolve(owner_user.id, active_year.id, mode) / Decimal('100')
+    
+    purchases = []
+    for line in data['lines']:
+        purchases.append(Purchase(
+            supplier=supplier,
+            category_id=line['category'],
+            product_name=line['product_name'],
+            quantity=line['quantity'],
+            unit=line['unit'],
+            unit_price=line['unit_price'],
+            selling_price=line.get('selling_price') or line['unit_price'] * margin,
+            total_amount=line['quantity'] * line['unit_price'],
+            purchase_date=data['purchase_date'],
+            payment_status=data['payment_status'],
+            invoice_number=data.get('invoice_number', ''),
+            isTransferredStock=transfer,
+            notes=line.get('notes') or data.get('notes'),
+            mode=mode,
+            user=owner_user,
+            economic_year=active_year
+        ))
+    invoice_total = sum(purchase.total_amount for purchase in purchases)
+    
+    try:
+        with transaction.atomic():
+            # bulk_create skips Purchase.save, so ledger and stock are updated once for the whole invoice
+            Purchase.objects.bulk_create(purchases, batch_size=500)
+            apply_ledger_deltas({supplier.id: {(data['payment_status'], data['purchase_date']): invoice_total}})
+            adjust_count(Purchase._meta.label, owner_user.id, active_year.id, mode, len(purchases))
+            bump_tenant_version(INVENTORY_NAMESPACE, owner_user.id)
+            
+            stocks = {}
+            if transfer:
+                stocks = merge_into_stock(owner_user, active_year, mode, [
+                    purchase_stock_line(purchase) for purchase in purchases
+                ])
+    except Exception as e:
+        return Response({
+            'success': False,
+            'message': f'Error creating purchase invoice: {str(e)}'
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    
+    return Response({
+        'success': True,
+        'message': f'{len(purchases)} purchases created successfully',
+        'invoice': {
+            'supplier': supplier.id,
+            'supplier_name': supplier.name,
+            'invoice_number': data.get('invoice_number', ''),
+            'purchase_date': data['purchase_date'],
+            'payment_status': data['payment_status'],
+            'lines': len(purchases),
+            'total_amount': float(invoice_total),
+            'transferred_to_stock': transfer,
+            'stock_ids': sorted(stock.id for stock in stocks.values())
+        }
+    }, status=status.HTTP_201_CREATED)
+
 @api_view(['PUT', 'DELETE'])
 @permission_classes([IsAuthenticated])
 def manage_purchase(request, purchase_id):
@@ -280,6 +425,32 @@ def manage_purchase(request, purchase_id):
             'message': 'Purchase not found'
         }, status=status.HTTP_404_NOT_FOUND)
 
+STOCK_SORT_FIELDS = {'product_name', 'current_stock', 'updated_at'}
+STOCK_FILTER_PARAMS = ('status', 'category', 'supplier', 'min_price', 'max_price')
+
+def filter_stocks(stocks, params):
+    """Apply the stock list's status, category, supplier and price filters"""
+    if params.get('status'):
+        stocks = stocks.filter(status__in=params['status'].split(','))
+    if params.get('category'):
+        stocks = stocks.filter(category_id=int(params['category']))
+    if params.get('supplier'):
+        stocks = stocks.filter(supplier_id=int(params['supplier']))
+    if params.get('min_price'):
+        stocks = stocks.filter(selling_price__gte=Decimal(params['min_price']))
+    if params.get('max_price'):
+        stocks = stocks.filter(selling_price__lte=Decimal(params['max_price']))
+    return stocks
+
+def latest_purchase_of_stock(field):
+    """Subquery for a field of the newest purchase of each stock row's product"""
+    return Subquery(Purchase.objects.filter(
+        product_name=OuterRef('product_name'),
+        user=OuterRef('user'),
+        economic_year=OuterRef('economic_year'),
+        mode=OuterRef('mode')
+    ).order_by('-created_at').values(field)[:1])
+
 @api_view(['GET', 'POST'])
 @permission_classes([IsAuthenticated])
 def stocks(request):
@@ -293,53 +464,43 @@ def stocks(request):
     
     if request.method == 'GET':
         mode = request.GET.get('mode', 'kirana')
-        page = int(request.GET.get('page', 1))
-        page_size = int(request.GET.get('page_size', 10))
         
         stocks = Stock.objects.filter(user=owner_user, economic_year=active_year, mode=mode)
         
-        paginator = Paginator(stocks, page_size)
-        page_obj = paginator.get_page(page)
+        # Server-side filters
+        filtered = any(request.GET.get(param) for param in STOCK_FILTER_PARAMS)
+        try:
+            stocks = filter_stocks(stocks, request.GET)
+        except (ValueError, InvalidOperation):
+            return Response({
+                'success': False,
+                'message': 'Invalid stock filter'
+            }, status=status.HTTP_400_BAD_REQUEST)
         
-        # Enhance stock data with category and supplier information
-        enhanced_stocks = []
-        for stock in page_obj:
-            stock_data = StockSerializer(stock).data
-            
-            # Get category and supplier names from the stock's foreign keys first
-            stock_data['category_name'] = stock.category.name if stock.category else 'General'
-            stock_data['supplier_name'] = stock.supplier.name if stock.supplier else 'Unknown'
-            
-            # If no category/supplier in stock, try to get from latest purchase
-            if not stock.category or not stock.supplier:
-                try:
-                    latest_purchase = Purchase.objects.filter(
-                        product_name=stock.product_name,
-                        user=owner_user,
-                        economic_year=active_year,
-                        mode=mode
-                    ).order_by('-created_at').first()
-                    
-                    if latest_purchase:
-                        if not stock.category and latest_purchase.category:
-                            stock_data['category_name'] = latest_purchase.category.name
-                        if not stock.supplier and latest_purchase.supplier:
-                            stock_data['supplier_name'] = latest_purchase.supplier.name
-                except Exception:
-                    pass
-            
-            enhanced_stocks.append(stock_data)
+        ordering = request.GET.get('ordering', '-updated_at')
+        if ordering.lstrip('-') not in STOCK_SORT_FIELDS:
+            return Response({
+                'success': False,
+                'message': f'Cannot sort stocks by {ordering}'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        # Fall back to the latest purchase's category and supplier when the stock has none
+        stocks = stocks.select_related('category', 'supplier').annotate(
+            last_movement=latest_purchase_of_stock('created_at'),
+            display_category_name=Coalesce('category__name', latest_purchase_of_stock('category__name'), Value('General')),
+            display_supplier_name=Coalesce('supplier__name', latest_purchase_of_stock('supplier__name'), Value('Unknown'))
+        )
+        
+        enhanced_stocks, pagination = paginate(
+            request, stocks, (ordering, '-id' if ordering.startswith('-') else 'id'),
+            lambda rows: StockListSerializer(rows, many=True).data,
+            counter=None if filtered else tenant_counter(Stock, owner_user, active_year, mode)
+        )
         
         return Response({
             'success': True,
             'stocks': enhanced_stocks,
-            'pagination': {
-                'current_page': page_obj.number,
-                'total_pages': paginator.num_pages,
-                'total_items': paginator.count,
-                'has_next': page_obj.has_next(),
-                'has_previous': page_obj.has_previous()
-            }
+            'pagination': pagination
         })
     
     elif request.method == 'POST':
@@ -356,6 +517,42 @@ def stocks(request):
             'errors': serializer.errors
         }, status=status.HTTP_400_BAD_REQUEST)
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def search_stocks(request):
+    owner_user = get_owner_user(request)
+    active_year = EconomicYear.objects.filter(user=owner_user, is_active=True).first()
+    if not active_year:
+        return Response({
+            'success': False,
+            'message': 'No active economic year found'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    query = request.GET.get('q', '')
+    mode = request.GET.get('mode', 'kirana')
+    try:
+        limit = min(max(int(request.GET.get('limit', DEFAULT_LIMIT)), 1), MAX_LIMIT)
+    except ValueError:
+        limit = DEFAULT_LIMIT
+    
+    stocks = search_products(owner_user, active_year, mode, query, limit)
+    
+    return Response({
+        'success': True,
+        'query': query,
+        'results': [
+            {
+                'id': stock.id,
+                'product_name': stock.product_name,
+                'current_stock': stock.current_stock,
+                'unit': stock.unit,
+                'selling_price': float(stock.selling_price),
+                'status': stock.status,
+                'category_name': stock.category.name if stock.category else 'General'
+            } for stock in stocks
+        ]
+    })
+
 @api_view(['PUT', 'DELETE'])
 @permission_classes([IsAuthenticated])
 def manage_stock(request, stock_id):
@@ -391,6 +588,20 @@ def manage_stock(request, stock_id):
             'message': 'Stock not found'
         }, status=status.HTTP_404_NOT_FOUND)
 
+REPORT_CACHE_TTL = 300
+
+def cached_purchase_total(owner_user, active_year, mode):
+    """Total purchase amount for the tenant, cached until its purchases next change"""
+    version = get_tenant_version(INVENTORY_NAMESPACE, owner_user.id)
+    key = tenant_key(INVENTORY_NAMESPACE, owner_user.id, version, active_year.id, mode, 'purchase_total')
+    total = cache.get(key)
+    if total is None:
+        total = Purchase.objects.filter(
+            user=owner_user, economic_year=active_year, mode=mode
+        ).aggregate(total=Sum('total_amount'))['total'] or 0
+        cache.set(key, total, REPORT_CACHE_TTL)
+    return total
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def reports(request):
@@ -410,38 +621,41 @@ def reports(request):
     categories = Category.objects.filter(user=owner_user, economic_year=active_year, mode=mode)
     
     # Calculate inventory summary
-    total_value = sum(stock.current_stock * 50 for stock in stocks)  # Assuming avg price 50
+    total_value = stock_value(stocks)
     total_products = stocks.count()
     low_stock_items = stocks.filter(status='Low').count()
     out_of_stock_items = stocks.filter(current_stock=0).count()
     
-    # Category performance
-    category_performance = []
-    for category in categories:
-        category_purchases = purchases.filter(category=category)
-        category_value = sum(p.total_amount for p in category_purchases)
-        category_performance.append({
+    # Category performance and supplier payments, one grouped query each
+    in_scope = Q(purchases__user=owner_user, purchases__economic_year=active_year, purchases__mode=mode)
+    purchase_total = cached_purchase_total(owner_user, active_year, mode)
+    
+    category_performance = [
+        {
             'category': category.name,
-            'products': category_purchases.count(),
-            'value': float(category_value),
-            'percentage': round((category_value / max(sum(p.total_amount for p in purchases), 1)) * 100, 1)
-        })
+            'products': category.purchase_count,
+            'value': float(category.purchase_value),
+            'percentage': round((category.purchase_value / max(purchase_total, 1)) * 100, 1)
+        } for category in categories.annotate(
+            purchase_count=Count('purchases', filter=in_scope),
+            purchase_value=Coalesce(Sum('purchases__total_amount', filter=in_scope), Value(0), output_field=DecimalField())
+        )
+    ]
     
-    # Supplier payments
-    supplier_payments = []
-    for supplier in suppliers:
-        supplier_purchases = purchases.filter(supplier=supplier)
-        total_paid = sum(p.total_amount for p in supplier_purchases.filter(payment_status='paid'))
-        total_due = sum(p.total_amount for p in supplier_purchases.filter(payment_status='pending'))
-        supplier_payments.append({
+    supplier_payments = [
+        {
             'supplier': supplier.name,
-            'total_paid': float(total_paid),
-            'total_due': float(total_due),
-            'orders': supplier_purchases.count()
-        })
+            'total_paid': float(supplier.paid_amount),
+            'total_due': float(supplier.due_amount),
+            'orders': supplier.order_count
+        } for supplier in suppliers.annotate(
+            order_count=Count('purchases', filter=in_scope),
+            paid_amount=Coalesce(Sum('purchases__total_amount', filter=in_scope & Q(purchases__payment_status='paid')), Value(0), output_field=DecimalField()),
+            due_amount=Coalesce(Sum('purchases__total_amount', filter=in_scope & Q(purchases__payment_status='pending')), Value(0), output_field=DecimalField())
+        )
+    ]
     
     # Top products by purchase quantity
-    from django.db.models import Sum
     top_products = purchases.values('product_name').annotate(
         total_quantity=Sum('quantity'),
         total_value=Sum('total_amount')
@@ -480,57 +694,34 @@ def untransfer_from_stock(request, purchase_id):
                 'message': 'No active economic year found'
             }, status=status.HTTP_400_BAD_REQUEST)
         
-        purchase = Purchase.objects.get(id=purchase_id, user=owner_user, economic_year=active_year)
+        result = untransfer_purchases(owner_user, active_year, [purchase_id])[purchase_id]
         
-        # Check if not transferred
-        if not purchase.isTransferredStock:
+        if result['status'] == 'not_found':
+            return Response({
+                'success': False,
+                'message': 'Purchase not found'
+            }, status=status.HTTP_404_NOT_FOUND)
+        elif result['status'] == 'not_transferred':
             return Response({
                 'success': False,
                 'message': 'Purchase is not transferred to stock'
             }, status=status.HTTP_400_BAD_REQUEST)
-        
-        # Find and update stock
-        try:
-            stock = Stock.objects.get(
-                product_name=purchase.product_name,
-                user=owner_user,
-                economic_year=active_year,
-                mode=purchase.mode
-            )
-            
-            # Reduce stock quantity
-            if stock.current_stock >= purchase.quantity:
-                stock.current_stock -= purchase.quantity
-                if stock.current_stock == 0:
-                    stock.delete()
-                else:
-                    stock.save()
-            else:
-                return Response({
-                    'success': False,
-                    'message': 'Insufficient stock to untransfer'
-                }, status=status.HTTP_400_BAD_REQUEST)
-                
-        except Stock.DoesNotExist:
+        elif result['status'] == 'insufficient_stock':
+            return Response({
+                'success': False,
+                'message': 'Insufficient stock to untransfer'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        elif result['status'] == 'stock_not_found':
             return Response({
                 'success': False,
                 'message': 'Stock not found for this product'
             }, status=status.HTTP_404_NOT_FOUND)
         
-        # Mark purchase as not transferred
-        purchase.isTransferredStock = False
-        purchase.save()
-        
         return Response({
             'success': True,
             'message': 'Purchase untransferred from stock successfully'
         })
         
-    except Purchase.DoesNotExist:
-        return Response({
-            'success': False,
-            'message': 'Purchase not found'
-        }, status=status.HTTP_404_NOT_FOUND)
     except Exception as e:
         return Response({
             'success': False,
@@ -549,69 +740,77 @@ def transfer_to_stock(request, purchase_id):
                 'message': 'No active economic year found'
             }, status=status.HTTP_400_BAD_REQUEST)
         
-        purchase = Purchase.objects.get(id=purchase_id, user=owner_user, economic_year=active_year)
+        result = transfer_purchases(owner_user, active_year, [purchase_id])[purchase_id]
         
-        # Check if already transferred
-        if purchase.isTransferredStock:
+        if result['status'] == 'not_found':
+            return Response({
+                'success': False,
+                'message': 'Purchase not found'
+            }, status=status.HTTP_404_NOT_FOUND)
+        elif result['status'] == 'already_transferred':
             return Response({
                 'success': False,
                 'message': 'Purchase already transferred to stock'
             }, status=status.HTTP_400_BAD_REQUEST)
         
-        # Create or update stock
-        stock, created = Stock.objects.get_or_create(
-            product_name=purchase.product_name,
-            user=owner_user,
-            economic_year=active_year,
-            mode=purchase.mode,
-            defaults={
-                'current_stock': purchase.quantity,
-                'unit': purchase.unit,
-                'min_stock': 10,
-                'max_stock': 100,
-                'cost_price': purchase.unit_price,
-                'selling_price': purchase.selling_price or purchase.unit_price * 1.2,
-                'category': purchase.category,
-                'supplier': purchase.supplier
-            }
-        )
-        
-        if not created:
-            # Update existing stock
-            stock.current_stock += purchase.quantity
-            stock.cost_price = purchase.unit_price
-            stock.selling_price = purchase.selling_price or purchase.unit_price * 1.2
-            stock.category = purchase.category
-            stock.supplier = purchase.supplier
-            stock.save()
-        
-        # Update stock status
-        stock.update_status()
-        
-        # Mark purchase as transferred
-        purchase.isTransferredStock = True
-        purchase.save()
-        
         return Response({
             'success': True,
             'message': 'Purchase transferred to stock successfully',
-            'stock_id': stock.id
+            'stock_id': result['stock_id']
         })
         
-    except Purchase.DoesNotExist:
+    except Exception as e:
         return Response({
             'success': False,
-            'message': 'Purchase not found'
-        }, status=status.HTTP_404_NOT_FOUND)
+            'message': f'Error transferring to stock: {str(e)}'
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+def _batch_purchase_ids(request):
+    ids = request.data.get('ids', [])
+    if not isinstance(ids, list):
+        return None
+    try:
+        return list(dict.fromkeys(int(purchase_id) for purchase_id in ids))
+    except (TypeError, ValueError):
+        return None
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def batch_transfer_to_stock(request):
+    owner_user = get_owner_user(request)
+    active_year = EconomicYear.objects.filter(user=owner_user, is_active=True).first()
+    if not active_year:
+        return Response({
+            'success': False,
+            'message': 'No active economic year found'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    purchase_ids = _batch_purchase_ids(request)
+    if not purchase_ids:
+        return Response({
+            'success': False,
+            'message': 'No purchase IDs provided'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
+        results = transfer_purchases(owner_user, active_year, purchase_ids)
     except Exception as e:
         return Response({
             'success': False,
             'message': f'Error transferring to stock: {str(e)}'
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    
+    transferred_count = sum(1 for result in results.values() if result['status'] == 'transferred')
+    return Response({
+        'success': transferred_count > 0,
+        'message': f'{transferred_count} purchases transferred to stock',
+        'transferred_count': transferred_count,
+        'results': results
+    })
 
-@api_view(['GET'])
+@api_view(['POST'])
 @permission_classes([IsAuthenticated])
-def dashboard_stats(request):
+def batch_untransfer_from_stock(request):
     owner_user = get_owner_user(request)
     active_year = EconomicYear.objects.filter(user=owner_user, is_active=True).first()
     if not active_year:
@@ -620,23 +819,103 @@ def dashboard_stats(request):
             'message': 'No active economic year found'
         }, status=status.HTTP_400_BAD_REQUEST)
     
-    mode = request.GET.get('mode', 'kirana')
+    purchase_ids = _batch_purchase_ids(request)
+    if not purchase_ids:
+        return Response({
+            'success': False,
+            'message': 'No purchase IDs provided'
+        }, status=status.HTTP_400_BAD_REQUEST)
     
-    total_categories = Category.objects.filter(user=owner_user, economic_year=active_year, mode=mode).count()
-    total_suppliers = Supplier.objects.filter(user=owner_user, economic_year=active_year, mode=mode).count()
-    total_purchases = Purchase.objects.filter(user=owner_user, economic_year=active_year, mode=mode).count()
-    low_stock_items = Stock.objects.filter(user=owner_user, economic_year=active_year, mode=mode, status='Low').count()
+    try:
+        results = untransfer_purchases(owner_user, active_year, purchase_ids)
+    except Exception as e:
+        return Response({
+            'success': False,
+            'message': f'Error untransferring from stock: {str(e)}'
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
     
+    untransferred_count = sum(1 for result in results.values() if result['status'] == 'untransferred')
     return Response({
-        'success': True,
-        'data': {
-            'totalCategories': total_categories,
-            'totalSuppliers': total_suppliers,
-            'totalPurchases': total_purchases,
-            'lowStockItems': low_stock_items
-        }
+        'success': untransferred_count > 0,
+        'message': f'{untransferred_count} purchases untransferred from stock',
+        'untransferred_count': untransferred_count,
+        'results': results
     })
 
+DASHBOARD_CACHE_TTL = 60
+# Terminals reuse their copy this long, then revalidate with If-None-Match
+DASHBOARD_MAX_AGE = 10
+
+def count_in_year(queryset):
+    """Correlated COUNT of queryset's rows in the outer EconomicYear"""
+    return Coalesce(Subquery(
+        queryset.filter(economic_year=OuterRef('pk')).order_by().values('economic_year').annotate(
+            count=Count('id')
+        ).values('count')
+    ), 0)
+
+def compute_dashboard_stats(owner_user, mode):
+    """The year lookup and all four dashboard counts as one query"""
+    tenant = {'user': owner_user, 'mode': mode}
+    row = EconomicYear.objects.filter(user=owner_user, is_active=True).annotate(
+        total_categories=count_in_year(Category.objects.filter(**tenant)),
+        total_suppliers=count_in_year(Supplier.objects.filter(**tenant)),
+        total_purchases=count_in_year(Purchase.objects.filter(**tenant)),
+        low_stock_items=count_in_year(Stock.objects.filter(**tenant, status='Low'))
+    ).values('total_categories', 'total_suppliers', 'total_purchases', 'low_stock_items').first()
+    if row is None:
+        return None
+    
+    data = {
+        'totalCategories': row['total_categories'],
+        'totalSuppliers': row['total_suppliers'],
+        'totalPurchases': row['total_purchases'],
+        'lowStockItems': row['low_stock_items']
+    }
+    etag = '"%s"' % hashlib.md5(json.dumps(data, sort_keys=True).encode()).hexdigest()
+    return {'data': data, 'etag': etag}
+
+def cached_dashboard_stats(owner_user, mode):
+    """Dashboard counts for the active year with their ETag, or None without an active year.
+
+    Cached until the tenant's inventory next changes; a miss is computed once for all concurrent requests.
+    """
+    version = get_tenant_version(INVENTORY_NAMESPACE, owner_user.id)
+    key = tenant_key(INVENTORY_NAMESPACE, owner_user.id, version, mode, 'dashboard_stats')
+    entry = cache.get(key)
+    if entry is None:
+        entry = single_flight(
+            flight_key('inventory_dashboard', owner_user.id, version, mode),
+            lambda: compute_dashboard_stats(owner_user, mode)
+        )
+        if entry is not None:
+            cache.set(key, entry, DASHBOARD_CACHE_TTL)
+    return entry
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def dashboard_stats(request):
+    owner_user = get_owner_user(request)
+    mode = request.GET.get('mode', 'kirana')
+    
+    entry = cached_dashboard_stats(owner_user, mode)
+    if entry is None:
+        return Response({
+            'success': False,
+            'message': 'No active economic year found'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    if entry['etag'] in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+        response = Response(status=status.HTTP_304_NOT_MODIFIED)
+    else:
+        response = Response({
+            'success': True,
+            'data': entry['data']
+        })
+    response['ETag'] = entry['etag']
+    patch_cache_control(response, private=True, max_age=DASHBOARD_MAX_AGE)
+    return response
+
 @api_view(['DELETE'])
 @permission_classes([IsAuthenticated])
 def bulk_delete_stocks(request):
@@ -656,11 +935,15 @@ def bulk_delete_stocks(request):
         }, status=status.HTTP_400_BAD_REQUEST)
     
     try:
-        deleted_count = Stock.objects.filter(
-            id__in=stock_ids,
-            user=owner_user,
-            economic_year=active_year
-        ).delete()[0]
+        stocks = Stock.objects.filter(id__in=stock_ids, user=owner_user, economic_year=active_year)
+        modes = dict(stocks.order_by().values_list('mode').annotate(count=Count('id')))
+        menu_item_ids = affected_menu_items(list(stocks.values_list('id', flat=True)))
+        # The total from delete() includes cascaded search terms
+        deleted_count = stocks.delete()[1].get(Stock._meta.label, 0)
+        for mode, count in modes.items():
+            adjust_count(Stock._meta.label, owner_user.id, active_year.id, mode, -count)
+        bump_tenant_version(INVENTORY_NAMESPACE, owner_user.id)
+        refresh_menu_items(menu_item_ids)
         
         return Response({
             'success': True,
@@ -736,9 +1019,9 @@ def bulk_create_stocks(request):
             
             if existing_stock:
                 # Update existing stock
-                existing_stock.current_stock += int(stock_data.get('current_stock', 0))
                 existing_stock.selling_price = float(stock_data.get('selling_price', existing_stock.selling_price))
-                existing_stock.cost_price = float(stock_data.get('cost_price', existing_stock.cost_price))
+                existing_stock.cost_price = Decimal(str(stock_data.get('cost_price', existing_stock.cost_price)))
+                existing_stock.receive(int(stock_data.get('current_stock', 0)), existing_stock.cost_price)
                 if category:
                     existing_stock.category = category
                 if supplier:
@@ -0,0 +1,30 @@
+import time
+
+from django.core.cache import cache
+
+
+def tenant_key(namespace, owner_id, *parts):
+    """Build a cache key scoped to a shop owner"""
+    return ':'.join(str(part) for part in (namespace, owner_id) + parts)
+
+
+def get_tenant_version(namespace, owner_id):
+    """Return the current cache version for a tenant namespace"""
+    key = tenant_key(namespace, owner_id, 'version')
+    version = cache.get(key)
+    if version is None:
+        # Seed from the clock so an evicted counter never reuses an old version
+        cache.add(key, int(time.time() * 1000), None)
+        version = cache.get(key)
+    return version
+
+
+def bump_tenant_version(namespace, owner_id):
+    """Invalidate every cached entry built under the tenant's current version"""
+    key = tenant_key(namespace, owner_id, 'version')
+    try:
+        return cache.incr(key)
+    except ValueError:
+        version = int(time.time() * 1000)
+        cache.set(key, version, None)
+        return version
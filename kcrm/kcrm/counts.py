@@ -0,0 +1,75 @@
+from django.core.cache import cache
+from django.db import connections
+
+from .caching import tenant_key
+
+# Result sets up to this size are always counted exactly
+EXACT_COUNT_LIMIT = 1000
+COUNTER_TTL = 60 * 60
+COUNTER_NAMESPACE = 'row_count'
+
+
+def counter_key(label, owner_id, economic_year_id, mode):
+    return tenant_key(COUNTER_NAMESPACE, owner_id, label, economic_year_id, mode)
+
+
+def tenant_counter(model, owner_user, economic_year, mode):
+    """Counter key for all of a tenant's rows of model, for use with count_rows"""
+    return counter_key(model._meta.label, owner_user.id, economic_year.id, mode)
+
+
+def adjust_count(label, owner_id, economic_year_id, mode, delta):
+    """Apply an insert/delete delta to a tenant counter that is already cached"""
+    if not delta:
+        return
+    try:
+        cache.incr(counter_key(label, owner_id, economic_year_id, mode), delta)
+    except ValueError:
+        # Not cached yet; the next count_rows seeds it from an exact count
+        pass
+
+
+def record_deleted(owner_id, economic_year_id, mode, deleted):
+    """Apply the per-model totals returned by QuerySet.delete() or Model.delete()"""
+    for label, count in deleted.items():
+        adjust_count(label, owner_id, economic_year_id, mode, -count)
+
+
+def estimated_count(queryset):
+    """The optimizer's row estimate for a queryset, or None where the database cannot give one"""
+    connection = connections[queryset.db]
+    if connection.vendor != 'mysql':
+        return None
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN {sql}', params)
+        columns = [column[0] for column in cursor.description]
+        row = dict(zip(columns, cursor.fetchone()))
+    if row.get('rows') is None:
+        return None
+    return int(row['rows'] * float(row.get('filtered') or 100) / 100)
+
+
+def count_rows(queryset, counter=None, limit=EXACT_COUNT_LIMIT):
+    """Count a queryset without paying a full COUNT(*) on large results.
+
+    Returns (count, approximate). Results of up to limit rows are counted exactly.
+    Larger ones come from the cached counter when one is given (seeded once, then
+    moved by adjust_count), otherwise from the MySQL optimizer estimate.
+    """
+    bounded = queryset.order_by()[:limit + 1].count()
+    if bounded <= limit:
+        return bounded, False
+
+    if counter:
+        count = cache.get(counter)
+        if count is None:
+            count = queryset.count()
+            cache.add(counter, count, COUNTER_TTL)
+            return count, False
+        return count, True
+
+    estimate = estimated_count(queryset)
+    if estimate is None:
+        return queryset.count(), False
+    return max(estimate, bounded), True
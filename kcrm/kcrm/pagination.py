@@ -0,0 +1,146 @@
+import base64
+import json
+import operator
+from functools import reduce
+
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db.models import Q
+from rest_framework.exceptions import ParseError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+
+from .counts import count_rows
+
+DEFAULT_PAGE_SIZE = 10
+MAX_PAGE_SIZE = 100
+TRUTHY = ('1', 'true', 'yes')
+
+
+def encode_cursor(values):
+    raw = json.dumps(values, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except ValueError:
+        raise ParseError('Invalid cursor')
+    if not isinstance(values, list):
+        raise ParseError('Invalid cursor')
+    return values
+
+
+def get_page_size(params, default=DEFAULT_PAGE_SIZE):
+    try:
+        page_size = int(params.get('page_size', default))
+    except (TypeError, ValueError):
+        page_size = default
+    return max(1, min(page_size, MAX_PAGE_SIZE))
+
+
+def after_position(ordering, values):
+    """Q for the rows that sort strictly after the given key values"""
+    clauses = []
+    for i, term in enumerate(ordering):
+        lookup = 'lt' if term.startswith('-') else 'gt'
+        clause = Q(**{f'{term.lstrip("-")}__{lookup}': values[i]})
+        for previous, value in zip(ordering[:i], values[:i]):
+            clause &= Q(**{previous.lstrip('-'): value})
+        clauses.append(clause)
+    return reduce(operator.or_, clauses)
+
+
+def keyset_page(queryset, ordering, cursor=None, page_size=DEFAULT_PAGE_SIZE):
+    """Fetch the page after cursor with a range condition on the ordering columns.
+
+    ordering must end in a unique column (normally id) so every row has a distinct
+    position. Returns the rows and the cursor of the following page, or None on the last page.
+    """
+    fields = [queryset.model._meta.get_field(term.lstrip('-')) for term in ordering]
+    queryset = queryset.order_by(*ordering)
+
+    if cursor:
+        values = decode_cursor(cursor)
+        if len(values) != len(fields):
+            raise ParseError('Invalid cursor')
+        try:
+            values = [field.to_python(value) for field, value in zip(fields, values)]
+        except ValidationError:
+            raise ParseError('Invalid cursor')
+        queryset = queryset.filter(after_position(ordering, values))
+
+    rows = list(queryset[:page_size + 1])
+    if len(rows) <= page_size:
+        return rows, None
+    rows = rows[:page_size]
+    return rows, encode_cursor([field.value_to_string(rows[-1]) for field in fields])
+
+
+def cursor_pagination(queryset, params, page_size, next_cursor, counter=None):
+    pagination = {
+        'mode': 'cursor',
+        'page_size': page_size,
+        'next_cursor': next_cursor,
+        'has_next': next_cursor is not None,
+        'has_previous': bool(params.get('cursor'))
+    }
+    if str(params.get('with_total', '')).lower() in TRUTHY:
+        pagination['total_items'], pagination['approximate_total'] = count_rows(queryset, counter)
+    return pagination
+
+
+def paginate(request, queryset, ordering, serialize, counter=None):
+    """Page a list endpoint by cursor when one is passed, by page number otherwise.
+
+    Returns the serialized rows and the response's pagination block. Passing an
+    empty cursor (?cursor=) starts cursor paging from the first row. counter is the
+    count_rows counter key for unfiltered lists.
+    """
+    params = request.GET
+    page_size = get_page_size(params)
+
+    if 'cursor' in params:
+        rows, next_cursor = keyset_page(queryset, ordering, params.get('cursor'), page_size)
+        return serialize(rows), cursor_pagination(queryset, params, page_size, next_cursor, counter)
+
+    paginator = Paginator(queryset.order_by(*ordering), page_size)
+    paginator.count, approximate = count_rows(queryset, counter)
+    page_obj = paginator.get_page(params.get('page', 1))
+    return serialize(page_obj), {
+        'mode': 'page',
+        'current_page': page_obj.number,
+        'total_pages': paginator.num_pages,
+        'total_items': paginator.count,
+        'approximate_total': approximate,
+        'has_next': page_obj.has_next(),
+        'has_previous': page_obj.has_previous()
+    }
+
+
+class KeysetPagination(BasePagination):
+    """Cursor pagination for ViewSets, applied only when the client asks for it.
+
+    Without cursor or page_size parameters the list stays a plain array, as it always
+    was. Views can set keyset_ordering to page on something other than newest first.
+    """
+    ordering = ('-created_at', '-id')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if 'cursor' not in params and 'page_size' not in params:
+            return None
+
+        page_size = get_page_size(params)
+        ordering = getattr(view, 'keyset_ordering', self.ordering)
+        rows, next_cursor = keyset_page(queryset, ordering, params.get('cursor'), page_size)
+        self.pagination = cursor_pagination(queryset, params, page_size, next_cursor)
+        return rows
+
+    def get_paginated_response(self, data):
+        return Response({
+            'success': True,
+            'results': data,
+            'pagination': self.pagination
+        })
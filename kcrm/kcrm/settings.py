@@ -74,6 +74,20 @@ DATABASES = {
     }
 }
 
+# Cache Configuration (point CACHE_BACKEND at a shared backend such as Redis in production)
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default='kcrm-cache'),
+    }
+}
+
+# Pub/sub for the kitchen push channel; the in-process broker only reaches screens on the same node
+KITCHEN_EVENT_BROKER = config('KITCHEN_EVENT_BROKER', default='billing.events.InProcessBroker')
+
+# Served (billed) kitchen orders older than this many days move to the archive tables
+KITCHEN_ARCHIVE_AFTER_DAYS = config('KITCHEN_ARCHIVE_AFTER_DAYS', default=30, cast=int)
+
 AUTH_USER_MODEL = 'authentication.User'
 
 AUTH_PASSWORD_VALIDATORS = [
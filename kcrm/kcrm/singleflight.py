@@ -0,0 +1,93 @@
+import threading
+import time
+import uuid
+
+from django.core.cache import cache
+
+from .caching import tenant_key
+
+FLIGHT_NAMESPACE = 'flight'
+# A leader holding the lock longer than this is presumed dead and waiters compute for themselves
+LOCK_TTL = 30
+# Callers arriving just after a computation finishes reuse its result for this long
+RESULT_TTL = 2
+POLL_INTERVAL = 0.05
+
+_MISSING = object()
+_calls_lock = threading.Lock()
+_calls = {}
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def flight_key(endpoint, owner_id, *params):
+    """Key identifying one computation: the endpoint, the tenant and the parameters that shape the result"""
+    return tenant_key(FLIGHT_NAMESPACE, owner_id, endpoint, *params)
+
+
+def _in_process(key, fn, timeout):
+    with _calls_lock:
+        call = _calls.get(key)
+        leader = call is None
+        if leader:
+            call = _calls[key] = _Call()
+
+    if not leader:
+        if not call.done.wait(timeout):
+            return fn()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    try:
+        call.result = fn()
+        return call.result
+    except Exception as e:
+        call.error = e
+        raise
+    finally:
+        with _calls_lock:
+            _calls.pop(key, None)
+        call.done.set()
+
+
+def _across_workers(key, fn, result_ttl, lock_ttl):
+    result_key = f'{key}:result'
+    lock_key = f'{key}:lock'
+    deadline = time.monotonic() + lock_ttl
+
+    while True:
+        result = cache.get(result_key, _MISSING)
+        if result is not _MISSING:
+            return result
+
+        token = uuid.uuid4().hex
+        if cache.add(lock_key, token, lock_ttl):
+            try:
+                result = fn()
+                cache.set(result_key, result, result_ttl)
+                return result
+            finally:
+                # Never release a lock that expired and was taken over by another worker
+                if cache.get(lock_key) == token:
+                    cache.delete(lock_key)
+
+        if time.monotonic() >= deadline:
+            return fn()
+        time.sleep(POLL_INTERVAL)
+
+
+def single_flight(key, fn, result_ttl=RESULT_TTL, lock_ttl=LOCK_TTL):
+    """Run fn once for all concurrent callers with the same key and hand each of them its result.
+
+    Threads of one worker wait on the thread already computing; workers wait on a lock
+    in the cache backend and pick the result up from the cache. If the computation fails,
+    the error reaches the callers waiting in the same process, and the other workers
+    retry it themselves. The result must be picklable.
+    """
+    return _in_process(key, lambda: _across_workers(key, fn, result_ttl, lock_ttl), lock_ttl)
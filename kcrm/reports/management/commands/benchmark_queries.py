@@ -0,0 +1,212 @@
+import json
+import random
+import statistics
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, Sum
+
+from authentication.models import EconomicYear, SecurityActivity, User, UserSession
+from billing.models import Customer, KitchenOrder, Sale, SaleItem
+from inventory.models import Category, Purchase, Stock, Supplier
+
+BENCHMARK_USERNAME = 'benchmark_owner'
+MODE = 'kirana'
+
+
+def query_shapes(owner, economic_year):
+    """The tenant-scoped queries behind the list, dashboard and report views"""
+    tenant = {'user': owner, 'economic_year': economic_year, 'mode': MODE}
+    customer = Customer.objects.filter(**tenant).order_by('id').first()
+    table_id = KitchenOrder.objects.filter(user=owner).values_list('table_id', flat=True).first() or '1'
+    since = date.today() - timedelta(days=30)
+
+    return {
+        'sale_list': Sale.objects.filter(cashier=owner, economic_year=economic_year, mode=MODE).order_by('-created_at')[:20],
+        'sale_period_totals': Sale.objects.filter(
+            cashier=owner, economic_year=economic_year, mode=MODE, created_at__date__gte=since
+        ).values('payment_method').annotate(total=Sum('total'), count=Count('id')).order_by(),
+        'customer_credit': Sale.objects.filter(customer=customer, payment_method='credit').values('customer').annotate(
+            total=Sum('credit_amount')
+        ).order_by(),
+        'sale_item_products': SaleItem.objects.filter(
+            sale__cashier=owner, sale__economic_year=economic_year, sale__mode=MODE
+        ).values('product_name').annotate(quantity=Sum('quantity')).order_by('-quantity')[:10],
+        'purchase_list': Purchase.objects.filter(**tenant).order_by('-purchase_date', '-created_at')[:20],
+        'purchase_last_by_product': Purchase.objects.filter(**tenant, product_name='Product 1').order_by('-created_at')[:1],
+        'purchase_supplier_pending': Purchase.objects.filter(
+            supplier__user=owner, payment_status='pending'
+        ).values('supplier').annotate(total=Sum('total_amount')).order_by(),
+        'stock_list': Stock.objects.filter(**tenant).order_by('-updated_at', '-id')[:20],
+        'stock_low': Stock.objects.filter(**tenant, status='Low').order_by('product_name', 'id')[:20],
+        'customer_list': Customer.objects.filter(**tenant).order_by('-created_at', '-id')[:20],
+        'kitchen_queue': KitchenOrder.objects.filter(
+            user=owner, economic_year=economic_year, status__in=['pending', 'preparing']
+        ).order_by('-created_at')[:50],
+        'kitchen_completed': KitchenOrder.objects.filter(
+            user=owner, economic_year=economic_year, status='completed'
+        ).order_by('-created_at')[:50],
+        'kitchen_table_active': KitchenOrder.objects.filter(
+            user=owner, table_id=table_id, status__in=['pending', 'preparing', 'ready']
+        )[:1],
+        'security_activity': SecurityActivity.objects.filter(user=owner)[:10],
+        'user_sessions': UserSession.objects.filter(user=owner).order_by('-last_activity'),
+        'user_session_current': UserSession.objects.filter(user=owner, is_current=False),
+    }
+
+
+class Command(BaseCommand):
+    help = 'Time the tenant-scoped view queries and capture their EXPLAIN plans, optionally on a seeded dataset'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0, help='Seed this many sales (and proportional related rows) for the benchmark owner')
+        parser.add_argument('--owner', help='Benchmark an existing shop owner instead of the seeded one')
+        parser.add_argument('--repeat', type=int, default=20, help='Timed runs per query')
+        parser.add_argument('--only', help='Comma separated query names to run')
+        parser.add_argument('--output', help='Write results as JSON to this file')
+        parser.add_argument('--compare', help='JSON file from an earlier run to compare latencies against')
+        parser.add_argument('--no-explain', action='store_true', help='Skip capturing query plans')
+
+    def handle(self, *args, **options):
+        if options['seed']:
+            owner, economic_year = self.seed(options['seed'])
+        else:
+            owner, economic_year = self.get_tenant(options['owner'] or BENCHMARK_USERNAME)
+
+        shapes = query_shapes(owner, economic_year)
+        if options['only']:
+            names = [name.strip() for name in options['only'].split(',')]
+            unknown = set(names) - set(shapes)
+            if unknown:
+                raise CommandError(f'Unknown queries: {", ".join(sorted(unknown))}')
+            shapes = {name: shapes[name] for name in names}
+
+        baseline = {}
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f).get('queries', {})
+
+        results = {}
+        for name, queryset in shapes.items():
+            results[name] = self.measure(queryset, max(options['repeat'], 1), not options['no_explain'])
+            line = f'{name:<28} median {results[name]["median_ms"]:>8.2f} ms  p95 {results[name]["p95_ms"]:>8.2f} ms  rows {results[name]["rows"]}'
+            if name in baseline and baseline[name]['median_ms']:
+                line += f'  ({results[name]["median_ms"] / baseline[name]["median_ms"]:.2f}x of baseline)'
+            self.stdout.write(line)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({'owner': owner.username, 'economic_year': economic_year.name, 'queries': results}, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f'Wrote {len(results)} query results to {options["output"]}'))
+
+    def get_tenant(self, username):
+        owner = User.objects.filter(username=username).first()
+        if not owner:
+            raise CommandError(f'User {username} not found; pass --seed to create benchmark data')
+        economic_year = EconomicYear.objects.filter(user=owner, is_active=True).first()
+        if not economic_year:
+            raise CommandError(f'User {username} has no active economic year')
+        return owner, economic_year
+
+    def measure(self, queryset, repeat, explain):
+        rows = len(list(queryset.all()))
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            list(queryset.all())
+            timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        result = {
+            'rows': rows,
+            'median_ms': round(statistics.median(timings), 3),
+            'p95_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3),
+        }
+        if explain:
+            result['plan'] = queryset.explain()
+        return result
+
+    @transaction.atomic
+    def seed(self, sales_count):
+        owner, _ = User.objects.get_or_create(
+            username=BENCHMARK_USERNAME,
+            defaults={'role': 'shop_owner', 'shop_name': 'Benchmark Shop', 'selected_modes': [MODE]}
+        )
+        economic_year = EconomicYear.objects.filter(user=owner, is_active=True).first()
+        if not economic_year:
+            today = date.today()
+            economic_year = EconomicYear.objects.create(
+                user=owner, name=f'{today.year}/{today.year + 1}',
+                start_date=today - timedelta(days=180), end_date=today + timedelta(days=185), is_active=True
+            )
+        tenant = {'user': owner, 'economic_year': economic_year, 'mode': MODE}
+        rng = random.Random(sales_count)
+        products = max(sales_count // 20, 10)
+
+        # Reruns add to the same tenant; MySQL does not return primary keys from a bulk insert,
+        # so parent rows are read back before children point at them
+        category, _ = Category.objects.get_or_create(name='Benchmark', **tenant)
+        Supplier.objects.bulk_create([
+            Supplier(name=f'Supplier {i}', contact='9800000000', address='Benchmark', **tenant) for i in range(10)
+        ], ignore_conflicts=True)
+        suppliers = list(Supplier.objects.filter(name__startswith='Supplier ', **tenant))
+        Customer.objects.bulk_create([
+            Customer(name=f'Customer {i}', phone=f'98{i:08d}', normalized_phone=f'98{i:08d}', **tenant)
+            for i in range(max(sales_count // 10, 10))
+        ], ignore_conflicts=True)
+        customers = list(Customer.objects.filter(name__startswith='Customer ', **tenant))
+        Stock.objects.bulk_create([
+            Stock(
+                product_name=f'Product {i}', current_stock=rng.randint(0, 200), min_stock=10,
+                cost_price=Decimal('100'), selling_price=Decimal('120'), average_cost=Decimal('100'),
+                category=category, supplier=rng.choice(suppliers),
+                status=rng.choice(['Good', 'Low', 'Critical', 'Overstock']), **tenant
+            ) for i in range(products)
+        ], batch_size=1000, ignore_conflicts=True)
+        Purchase.objects.bulk_create([
+            Purchase(
+                supplier=rng.choice(suppliers), category=category, product_name=f'Product {rng.randrange(products)}',
+                quantity=10, unit_price=Decimal('100'), selling_price=Decimal('120'), total_amount=Decimal('1000'),
+                purchase_date=date.today() - timedelta(days=rng.randrange(180)),
+                payment_status=rng.choice(['paid', 'pending', 'partial']), **tenant
+            ) for _ in range(sales_count // 2)
+        ], batch_size=1000)
+
+        prefix = f'BENCH-{time.time_ns()}'
+        Sale.objects.bulk_create([
+            Sale(
+                sale_number=f'{prefix}-{i}', customer=rng.choice(customers), subtotal=Decimal('240'),
+                total=Decimal('240'), amount_paid=Decimal('240'),
+                payment_method=rng.choice(['cash', 'card', 'credit']), mode=MODE, cashier=owner,
+                economic_year=economic_year
+            ) for i in range(sales_count)
+        ], batch_size=1000)
+        sales = Sale.objects.filter(sale_number__startswith=f'{prefix}-').only('id')
+        SaleItem.objects.bulk_create([
+            SaleItem(
+                sale=sale, product_name=f'Product {rng.randrange(products)}', quantity=Decimal('2'),
+                unit_price=Decimal('120'), total_price=Decimal('240'), unit_cost=Decimal('100'), unit='pcs'
+            ) for sale in sales.iterator()
+        ], batch_size=1000)
+        KitchenOrder.objects.bulk_create([
+            KitchenOrder(
+                table_id=str(rng.randrange(30)), table_name='Table', customer_name='Guest', customer_phone='',
+                total=Decimal('500'), status=rng.choice(['pending', 'preparing', 'ready', 'completed', 'completed']),
+                user=owner, economic_year=economic_year
+            ) for _ in range(sales_count // 2)
+        ], batch_size=1000)
+        SecurityActivity.objects.bulk_create([
+            SecurityActivity(user=owner, activity_type='login', description='Benchmark login', ip_address='127.0.0.1')
+            for _ in range(sales_count // 10)
+        ], batch_size=1000)
+        UserSession.objects.bulk_create([
+            UserSession(
+                user=owner, session_key=f'{prefix}-{i}', device_info='Benchmark', ip_address='127.0.0.1',
+                is_current=i == 0
+            ) for i in range(max(sales_count // 100, 5))
+        ], batch_size=1000)
+
+        self.stdout.write(self.style.SUCCESS(f'Seeded {sales_count} sales for {owner.username} in {economic_year.name}'))
+        return owner, economic_year
@@ -1,10 +1,13 @@
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
-from django.db.models import Sum, Count, Avg, F, Q
+from django.db.models import Sum, Count, Avg, F, Q, ExpressionWrapper
 from django.db import models
 from billing.models import Sale
 from inventory.models import Stock
+from inventory.valuation import stock_value, gross_profit, MONEY_FIELD
+from kcrm.counts import count_rows, tenant_counter
+from kcrm.singleflight import single_flight, flight_key
 from datetime import datetime, timedelta
 import random
 
@@ -25,22 +28,48 @@ def get_reports(request):
     mode = request.GET.get('mode', 'kirana')
     eco_year_id = request.GET.get('eco_year_id')
     
-    if report_type == 'sales':
-        return Response(generate_sales_data(owner_user, mode, eco_year_id))
-    elif report_type == 'inventory':
-        return Response(generate_inventory_data(owner_user, mode, eco_year_id))
-    elif report_type == 'financial':
-        return Response(generate_financial_data(owner_user, mode, eco_year_id))
-    elif report_type == 'customer':
-        return Response(generate_customer_data(owner_user, mode, eco_year_id))
-    elif report_type == 'performance':
-        return Response(generate_performance_data(owner_user, mode, eco_year_id))
+    generators = {
+        'sales': generate_sales_data,
+        'inventory': generate_inventory_data,
+        'financial': generate_financial_data,
+        'customer': generate_customer_data,
+        'performance': generate_performance_data
+    }
+    generate = generators.get(report_type)
+    if generate:
+        # Owners and staff opening reports together share one computation
+        return Response(single_flight(
+            flight_key('reports', owner_user.id, report_type, mode, eco_year_id),
+            lambda: generate(owner_user, mode, eco_year_id)
+        ))
     
     return Response({'error': 'Invalid report type'}, status=400)
 
+def kitchen_order_sets(user, statuses, eco_year=None):
+    """The user's kitchen orders with the given statuses, from the hot table and the archive"""
+    from billing.models import KitchenOrder, ArchivedKitchenOrder
+    order_sets = []
+    for model in (KitchenOrder, ArchivedKitchenOrder):
+        orders = model.objects.filter(user=user, status__in=statuses)
+        if eco_year:
+            orders = orders.filter(economic_year=eco_year)
+        order_sets.append(orders)
+    return order_sets
+
+def kitchen_total(order_sets, **filters):
+    return sum(orders.filter(**filters).aggregate(total=Sum('total'))['total'] or 0 for orders in order_sets)
+
+def kitchen_profit(order_sets, **filters):
+    """Revenue minus recipe cost of the orders' lines, at the unit costs snapshotted when they were ordered"""
+    profit = ExpressionWrapper(F('items__quantity') * (F('items__price') - F('items__unit_cost')), output_field=MONEY_FIELD)
+    return sum(
+        orders.filter(**filters).aggregate(profit=Sum(profit, filter=Q(items__unit_cost__isnull=False)))['profit'] or 0
+        for orders in order_sets
+    )
+
 def generate_sales_data(user, mode, eco_year_id=None):
     from authentication.models import EconomicYear
-    from billing.models import SaleItem, KitchenOrder, KitchenOrderItem
+    from billing.models import SaleItem
     
     # Get economic year for filtering
     eco_year = None
@@ -60,60 +89,47 @@ def generate_sales_data(user, mode, eco_year_id=None):
         if eco_year:
             sales = sales.filter(economic_year=eco_year)
     elif mode == 'restaurant':
-        # Restaurant uses kitchen orders, not regular sales
-        kitchen_orders = KitchenOrder.objects.filter(
-            user=user,
-            status__in=['served', 'completed', 'finalized']
-        )
-        if eco_year:
-            kitchen_orders = kitchen_orders.filter(economic_year=eco_year)
+        # Restaurant uses kitchen orders, not regular sales; old ones live in the archive
+        kitchen_orders = kitchen_order_sets(user, ['served', 'completed', 'finalized'], eco_year)
         
         # Calculate metrics from kitchen orders
-        today_sales = kitchen_orders.filter(created_at__date=datetime.now().date()).aggregate(
-            total=Sum('total'))['total'] or 0
+        today_sales = kitchen_total(kitchen_orders, created_at__date=datetime.now().date())
         today_sales = float(today_sales) if today_sales else 0
         
-        month_sales = kitchen_orders.filter(
+        month_sales = kitchen_total(
+            kitchen_orders,
             created_at__month=datetime.now().month,
             created_at__year=datetime.now().year
-        ).aggregate(total=Sum('total'))['total'] or 0
+        )
         month_sales = float(month_sales) if month_sales else 0
         
-        year_sales = kitchen_orders.filter(
-            created_at__year=datetime.now().year
-        ).aggregate(total=Sum('total'))['total'] or 0
+        year_sales = kitchen_total(kitchen_orders, created_at__year=datetime.now().year)
         year_sales = float(year_sales) if year_sales else 0
         
         # Calculate weekly data
         weekly_data = []
         for i in range(7):
             day = datetime.now().date() - timedelta(days=6-i)
-            day_sales = kitchen_orders.filter(created_at__date=day).aggregate(
-                total=Sum('total'))['total'] or 0
+            day_sales = kitchen_total(kitchen_orders, created_at__date=day)
             weekly_data.append(float(day_sales) if day_sales else 0)
         
         # Get top items from kitchen orders
-        category_sales = KitchenOrderItem.objects.filter(
-            order__user=user,
-            order__status__in=['served', 'completed', 'finalized']
-        )
-        if eco_year:
-            category_sales = category_sales.filter(order__economic_year=eco_year)
-        category_sales = category_sales.values('name').annotate(
-            total_qty=Sum('quantity')
-        ).order_by('-total_qty')[:4]
+        item_quantities = {}
+        for orders in kitchen_orders:
+            items = orders.filter(items__isnull=False).values('items__name').annotate(total_qty=Sum('items__quantity'))
+            for item in items.order_by():
+                item_quantities[item['items__name']] = item_quantities.get(item['items__name'], 0) + item['total_qty']
+        category_sales = sorted(item_quantities.items(), key=lambda item: item[1], reverse=True)[:4]
         
         if category_sales:
-            category_data = [float(item['total_qty']) for item in category_sales]
-            category_labels = [item['name'] for item in category_sales]
+            category_data = [float(quantity) for _, quantity in category_sales]
+            category_labels = [name for name, _ in category_sales]
         else:
             category_data = [0]
             category_labels = ['No Orders']
         
-        # Calculate profit (25% margin for restaurant)
-        today_profit = today_sales * 0.25
-        
-        print(f"Restaurant mode - Kitchen orders: {kitchen_orders.count()}, Today: {today_sales}, Profit: {today_profit}")
+        # Calculate profit from the recipe costs snapshotted on each order line
+        today_profit = float(kitchen_profit(kitchen_orders, created_at__date=datetime.now().date()))
         
         return {
             'metrics': {
@@ -139,9 +155,6 @@ def generate_sales_data(user, mode, eco_year_id=None):
         if eco_year:
             sales = sales.filter(economic_year=eco_year)
     
-    # Debug: Print total sales count
-    print(f"Total sales for user {user.id} in mode {mode}: {sales.count()}")
-    
     # Calculate real sales data
     today_sales = sales.filter(created_at__date=datetime.now().date()).aggregate(
         total=Sum('total'))['total'] or 0
@@ -205,10 +218,6 @@ def generate_sales_data(user, mode, eco_year_id=None):
         category_data = [0]
         category_labels = ['No Sales']
     
-    # Calculate actual profit based on cost vs selling price
-    actual_profit = 0
-    from inventory.models import Purchase
-    
     if mode == 'kirana':
         today_sale_items = SaleItem.objects.filter(
             sale__cashier=user,
@@ -234,20 +243,8 @@ def generate_sales_data(user, mode, eco_year_id=None):
         if eco_year:
             today_sale_items = today_sale_items.filter(sale__economic_year=eco_year)
     
-    for item in today_sale_items:
-        # Get cost price from purchases
-        purchase = Purchase.objects.filter(
-            product_name=item.product_name,
-            user=user
-        ).order_by('-created_at').first()
-        
-        if purchase:
-            cost_price = float(purchase.unit_price)
-            selling_price = float(item.unit_price)
-            quantity = float(item.quantity)
-            
-            item_profit = (selling_price - cost_price) * quantity
-            actual_profit += max(0, item_profit)  # Only positive profit
+    # Calculate actual profit from the costs snapshotted at sale time
+    actual_profit = float(gross_profit(today_sale_items))
     
     # Debug: Print final metrics
     print(f"Final metrics for {mode} - Today: {today_sales}, Profit: {actual_profit}, Month: {month_sales}, Year: {year_sales}")
@@ -289,11 +286,11 @@ def generate_inventory_data(user, mode, eco_year_id=None):
     if eco_year:
         products = products.filter(economic_year=eco_year)
     
-    # Debug: Print inventory count
-    print(f"Total inventory items for user {user.id} in mode {mode}: {products.count()}")
-    total_items = products.count()
-    low_stock = products.filter(current_stock__lt=10).count()
-    out_of_stock = products.filter(current_stock=0).count()
+    total_items, total_approximate = count_rows(
+        products, tenant_counter(Stock, user, eco_year, mode) if eco_year else None
+    )
+    low_stock, low_approximate = count_rows(products.filter(current_stock__lt=10))
+    out_of_stock, out_approximate = count_rows(products.filter(current_stock=0))
     
     # Get top products by stock level
     top_products = products.order_by('-current_stock')[:6]
@@ -305,9 +302,7 @@ def generate_inventory_data(user, mode, eco_year_id=None):
         stock_labels = ['No Stock']
     
     # Calculate stock value
-    total_value = products.aggregate(
-        value=Sum(F('current_stock') * F('cost_price'))
-    )['value'] or 0
+    total_value = stock_value(products)
     
     # Weekly movement calculation (purchases)
     from inventory.models import Purchase
@@ -334,6 +329,11 @@ def generate_inventory_data(user, mode, eco_year_id=None):
             'out_of_stock': out_of_stock,
             'total_value': int(total_value)
         },
+        'approximate_counts': [
+            key for key, approximate in (
+                ('total_items', total_approximate), ('low_stock', low_approximate), ('out_of_stock', out_approximate)
+            ) if approximate
+        ],
         'charts': {
             'stock_levels': {
                 'data': stock_data,
@@ -262,17 +262,18 @@ def get_dashboard_stats(request):
     
     from django.db.models import Count, Q
     from datetime import datetime, timedelta
+    from kcrm.counts import count_rows
     
     # Get shop statistics
-    total_shops = User.objects.filter(role='shop_owner').count()
-    pending_requests = User.objects.filter(
+    total_shops, total_approximate = count_rows(User.objects.filter(role='shop_owner'))
+    pending_requests, pending_approximate = count_rows(User.objects.filter(
         role='shop_owner', 
         is_approved=False
     ).exclude(
         shop_request__status='rejected'
-    ).count()
-    approved_shops = User.objects.filter(role='shop_owner', is_approved=True).count()
-    rejected_requests = ShopOwnerRequest.objects.filter(status='rejected').count()
+    ))
+    approved_shops, approved_approximate = count_rows(User.objects.filter(role='shop_owner', is_approved=True))
+    rejected_requests, rejected_approximate = count_rows(ShopOwnerRequest.objects.filter(status='rejected'))
     
     # Recent shop requests (last 10)
     recent_requests = User.objects.filter(
@@ -299,11 +300,10 @@ def get_dashboard_stats(request):
         })
     
     # Mode distribution
-    mode_stats = {}
-    for mode_choice in ShopOwnerPermissions.MODE_CHOICES:
-        mode = mode_choice[0]
-        count = ShopOwnerPermissions.objects.filter(mode=mode, is_active=True).count()
-        mode_stats[mode] = count
+    mode_counts = dict(
+        ShopOwnerPermissions.objects.filter(is_active=True).order_by().values_list('mode').annotate(count=Count('id'))
+    )
+    mode_stats = {mode: mode_counts.get(mode, 0) for mode, _ in ShopOwnerPermissions.MODE_CHOICES}
     
     return Response({
         'success': True,
@@ -313,7 +313,13 @@ def get_dashboard_stats(request):
             'approvedShops': approved_shops,
             'rejectedRequests': rejected_requests,
             'recentRequests': recent_requests_data,
-            'modeDistribution': mode_stats
+            'modeDistribution': mode_stats,
+            'approximateCounts': [
+                key for key, approximate in (
+                    ('totalShops', total_approximate), ('pendingRequests', pending_approximate),
+                    ('approvedShops', approved_approximate), ('rejectedRequests', rejected_approximate)
+                ) if approximate
+            ]
         }
     })
 